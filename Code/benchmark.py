@@ -0,0 +1,396 @@
+"""
+benchmark
+~~~~~~~~~~~~~~~~~
+
+This module provides a benchmark suite for every stage of the pipeline:
+pdf_to_text, clean_paragraphs, lemmatization, tfidf, stylometry,
+w2v_training, text_vector, doc2vec and embedding.
+
+Apart from the pdf conversion, every stage runs on synthetic corpora that
+replicate the bundled texts (Corpora_combined and Reden) scale times, e.g.
+--scales 1 10 100. Every replica is a document of its own, so the number of
+documents and the number of tokens both grow with the scale. The pdf
+conversion only runs on the bundled programmes (Parteiprogramme) at scale 1.
+
+The results (seconds, processed items and throughput per stage and scale)
+are written as JSON together with the git commit, so scaling curves and
+regressions can be compared between commits (--compare OLD.json).
+
+The embedding stage uses a small hashing model by default, which runs
+offline and without torch. --embedding-model loads a sentence transformer
+(a name or a local folder) instead.
+
+Run from the repository root, e.g.:
+python Code/benchmark.py --scales 1 10 --stages tfidf w2v_training
+"""
+
+import argparse
+from datetime import datetime
+import glob
+import json
+import os
+from os.path import join
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, join(os.path.dirname(os.path.abspath(__file__)), "w2v"))
+from chunked_embeddings import embed_documents
+from corpus_store import build_store, CorpusStore, read_text
+from dtm import build_dtm, tfidf, top_k
+from pdf2txt import clean_paragraphs, count_pages, pdf_to_text
+from stylometry import delta_sweep, mfw_cutoffs
+
+STAGES = ["pdf_to_text", "clean_paragraphs", "lemmatization", "tfidf", "stylometry",
+          "w2v_training", "text_vector", "doc2vec", "embedding"]
+# Root of the repository with the bundled corpora
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Everything that is not a (german) letter separates two tokens of the synthetic lemma files
+NON_LETTERS = re.compile(r"[^a-zA-ZäöüÄÖÜß]+")
+
+
+class SkipStage(Exception):
+    """
+    SkipStage is raised by a stage that can't run on a workload.
+    """
+
+
+class HashingEmbedder:
+    """
+    HashingEmbedder is a tiny stand-in for a sentence transformer: every word
+    is hashed into one of n_buckets buckets and the bucket counts of a chunk
+    are projected to the embedding dimension with a fixed random matrix.
+    It has the interface that embed_documents uses.
+    """
+
+    def __init__(self, dimension: int = 64, n_buckets: int = 4096, max_seq_length: int = 512, seed: int = 0):
+        self.max_seq_length = max_seq_length
+        self.tokenizer = None
+        self.n_buckets = n_buckets
+        self.projection = np.random.default_rng(seed).standard_normal((n_buckets, dimension)).astype(np.float32)
+
+    def get_sentence_embedding_dimension(self)->int:
+        return self.projection.shape[1]
+
+    def encode(self, texts: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False)->np.ndarray:
+        counts = np.zeros((len(texts), self.n_buckets), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets = [zlib.crc32(word.encode("utf-8")) % self.n_buckets for word in text.split()]
+            counts[row] = np.bincount(buckets, minlength=self.n_buckets)
+        return np.tanh(counts @ self.projection)
+
+
+class Workload:
+    """
+    Workload is the synthetic corpus of one scale: the texts (name -> (party,
+    text)) and, created on first use, their lemma files and corpus store
+    inside work_dir.
+    """
+
+    def __init__(self, texts: Dict[str, Tuple[str, str]], scale: int, work_dir: str):
+        self.texts = texts
+        self.scale = scale
+        self.work_dir = work_dir
+        self._store: Optional[CorpusStore] = None
+        self.w2v_model = None
+
+    def store(self)->CorpusStore:
+        """
+        store returns the corpus store of the synthetic lemma files. The
+        lemmas are approximated by the lower case words of the texts.
+        """
+        if self._store is None:
+            lemma_dir = join(self.work_dir, "lemmas")
+            os.makedirs(lemma_dir, exist_ok=True)
+            sources = {}
+            for idx, (name, (_, text)) in enumerate(self.texts.items()):
+                sources[name] = join(lemma_dir, f"{idx}.txt")
+                with open(sources[name], "w", encoding="utf-8") as f:
+                    f.write(" ".join(NON_LETTERS.sub(" ", text).lower().split()))
+            self._store = build_store(sources, join(self.work_dir, "store"))
+        return self._store
+
+    def n_tokens(self)->int:
+        return int(self.store().offsets[-1])
+
+
+def load_texts(root: str = ROOT_DIR)->Dict[str, Tuple[str, str]]:
+    """
+    load_texts is a function that returns the bundled texts as name -> (party, text):
+    the combined text of every party and every single speech.
+    """
+    texts = {}
+    for path in sorted(glob.glob(join(root, "Corpora_combined", "*_combined.txt"))):
+        party = os.path.basename(path).split("_")[0]
+        texts[f"{party}/Combined"] = (party, read_text(path).replace("\r\n", "\n"))
+    for path in sorted(glob.glob(join(root, "Reden", "*", "*.txt"))):
+        party = os.path.basename(os.path.dirname(path)).split(" ")[0]
+        name = f"{party}/Reden/{os.path.splitext(os.path.basename(path))[0]}"
+        texts[name] = (party, read_text(path).replace("\r\n", "\n"))
+    return texts
+
+
+def replicate(texts: Dict[str, Tuple[str, str]], scale: int)->Dict[str, Tuple[str, str]]:
+    """
+    replicate is a function that returns scale copies of every text, every
+    copy is a document of its own.
+    """
+    if scale == 1:
+        return dict(texts)
+    return {f"{name}#{copy}": value for copy in range(scale) for name, value in texts.items()}
+
+
+def bench_pdf_to_text(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    if workload.scale != 1:
+        raise SkipStage("pdf_to_text only runs on the bundled programmes (scale 1)")
+    out_dir = join(workload.work_dir, "pdf")
+    os.makedirs(out_dir, exist_ok=True)
+    pages = 0
+    for pdf in sorted(glob.glob(join(args.root, "Parteiprogramme", "*.pdf"))):
+        pages += count_pages(pdf)
+        if pdf_to_text(pdf, join(out_dir, os.path.basename(pdf) + ".txt")) != 0:
+            raise RuntimeError(f"unable to convert {pdf}")
+    return pages, "Seiten"
+
+
+def bench_clean_paragraphs(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    paragraphs = [p for _, text in workload.texts.values() for p in text.split("\n\n")]
+    clean_paragraphs(paragraphs)
+    return len(paragraphs), "Absätze"
+
+
+_lemmatizers: Dict[str, object] = {}
+
+
+def lemmatization_pipeline(model: str):
+    """
+    lemmatization_pipeline is a function that loads the spaCy model of the
+    lemmatization stage once, outside of the measurement. Without the model
+    the stage is skipped: a blank pipeline only tokenizes, so its throughput
+    can't be compared with a run that lemmatizes.
+    """
+    if model not in _lemmatizers:
+        from lemmatize import load_lemmatizer
+        try:
+            _lemmatizers[model] = load_lemmatizer(model)
+        except OSError:
+            raise SkipStage(f"needs the spaCy model {model}")
+    return _lemmatizers[model]
+
+
+def bench_lemmatization(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    from nltk.corpus import stopwords
+    from lemmatize import lemmatize_corpus
+
+    nlp = lemmatization_pipeline(args.spacy_model)
+    corpus = {name: text for name, (_, text) in workload.texts.items()}
+    n_tokens = 0
+    for _, lemmas in lemmatize_corpus(nlp, corpus, set(stopwords.words("german")),
+                                      batch_size=args.batch_size, n_process=args.workers):
+        n_tokens += len(lemmas)
+    return n_tokens, "Tokens"
+
+
+def bench_tfidf(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    store = workload.store()
+    counts, _ = build_dtm(store)
+    top_k(tfidf(counts, tf="relative", idf="plain"), k=10)
+    return workload.n_tokens(), "Tokens"
+
+
+def bench_stylometry(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    counts, _ = build_dtm(workload.store())
+    cutoffs = mfw_cutoffs(50, 5000, 10, counts.shape[1])
+    delta_sweep(counts, cutoffs, "cosine_delta")
+    return len(cutoffs), "Schnitte"
+
+
+def train_w2v(workload: Workload, args: argparse.Namespace):
+    import gensim
+    from w2v_training import StoreSentences, write_corpus_file
+
+    corpus_file = join(workload.work_dir, "w2v_corpus.txt")
+    write_corpus_file(StoreSentences(workload.store()), corpus_file)
+    model = gensim.models.Word2Vec(min_count=1, workers=args.workers, vector_size=50, window=5, epochs=args.epochs)
+    model.build_vocab(corpus_file=corpus_file)
+    model.train(corpus_file=corpus_file, total_words=model.corpus_total_words, epochs=model.epochs)
+    return model
+
+
+def bench_w2v_training(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    workload.w2v_model = train_w2v(workload, args)
+    return workload.n_tokens() * args.epochs, "Wörter"
+
+
+def bench_text_vector(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    from doc_vectors import text_vector, token_index
+
+    if workload.w2v_model is None:
+        raise SkipStage("needs the model of w2v_training")
+    store = workload.store()
+    wv = workload.w2v_model.wv
+    lookup = token_index(store.vocab, wv)
+    for name in store.names:
+        text_vector(store.doc_ids(name), lookup, wv)
+    return workload.n_tokens(), "Tokens"
+
+
+def bench_doc2vec(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    from doc2vec_model import tagged_documents, train_doc2vec
+
+    store = workload.store()
+    documents = [(name, workload.texts[name][0], store.doc_tokens(name)) for name in store.names]
+    train_doc2vec(tagged_documents(documents), workers=args.workers, epochs=args.epochs)
+    return workload.n_tokens() * args.epochs, "Wörter"
+
+
+def bench_embedding(workload: Workload, args: argparse.Namespace)->Tuple[int, str]:
+    if args.embedding_model:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.embedding_model, trust_remote_code=True)
+    else:
+        model = HashingEmbedder()
+    _, stats = embed_documents(model, [[text] for _, text in workload.texts.values()],
+                               batch_size=args.batch_size)
+    return stats["chunks"], "Chunks"
+
+
+BENCHMARKS: Dict[str, Callable[[Workload, argparse.Namespace], Tuple[int, str]]] = {
+    "pdf_to_text": bench_pdf_to_text,
+    "clean_paragraphs": bench_clean_paragraphs,
+    "lemmatization": bench_lemmatization,
+    "tfidf": bench_tfidf,
+    "stylometry": bench_stylometry,
+    "w2v_training": bench_w2v_training,
+    "text_vector": bench_text_vector,
+    "doc2vec": bench_doc2vec,
+    "embedding": bench_embedding,
+}
+
+
+def run_stage(stage: str, workload: Workload, args: argparse.Namespace)->dict:
+    """
+    run_stage is a function that times one stage on one workload. Errors are
+    recorded in the result instead of stopping the suite.
+    """
+    result = {"stage": stage, "scale": workload.scale, "documents": len(workload.texts)}
+    if stage in ("tfidf", "w2v_training", "text_vector", "doc2vec"):
+        # the lemma files and the store are prepared outside of the measurement
+        workload.store()
+    try:
+        if stage == "lemmatization":
+            # the model is loaded outside of the measurement as well
+            lemmatization_pipeline(args.spacy_model)
+            result["model"] = args.spacy_model
+        start = time.perf_counter()
+        items, unit = BENCHMARKS[stage](workload, args)
+    except SkipStage as e:
+        result["skipped"] = str(e)
+        return result
+    except Exception as e:
+        # one line is enough to see why, e.g. a missing model of an offline machine
+        result["error"] = f"{type(e).__name__}: {' '.join(str(e).split())}"[:300]
+        return result
+    seconds = time.perf_counter() - start
+    result.update({"seconds": seconds, "items": items, "unit": unit, "per_second": items / max(seconds, 1e-9)})
+    return result
+
+
+def git_commit(root: str = ROOT_DIR)->str:
+    """
+    git_commit is a function that returns the current commit of the repository, if any.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_results(old: dict, new: dict)->List[str]:
+    """
+    compare_results is a function that returns one line per stage and scale
+    with the throughput of both runs and the speedup of the new one.
+    """
+    old_results = {(r["stage"], r["scale"]): r for r in old["results"] if "per_second" in r}
+    lines = []
+    for result in new["results"]:
+        before = old_results.get((result["stage"], result["scale"]))
+        if before is None or "per_second" not in result:
+            continue
+        lines.append(f"{result['stage']:<18}{result['scale']:>5}x  {before['per_second']:>14.1f} -> "
+                     f"{result['per_second']:>14.1f} {result['unit']}/s  ({result['per_second'] / before['per_second']:.2f}x)")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None)->dict:
+    arg_parser = argparse.ArgumentParser(description="Benchmark every stage of the pipeline.")
+    arg_parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="stages to run")
+    arg_parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100],
+                            help="replication factors of the bundled corpora")
+    arg_parser.add_argument("--root", default=ROOT_DIR, help="repository root with the bundled corpora")
+    arg_parser.add_argument("--output", default=None,
+                            help="JSON file of the results (default: benchmarks/<time>_<commit>.json)")
+    arg_parser.add_argument("--compare", default=None, help="JSON file of an earlier run to compare with")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker threads/processes")
+    arg_parser.add_argument("--epochs", type=int, default=5, help="training epochs of word2vec and Doc2Vec")
+    arg_parser.add_argument("--batch-size", type=int, default=16, help="batch size of spaCy and the embedding")
+    arg_parser.add_argument("--spacy-model", default="de_core_news_lg", help="spaCy model for lemmatization")
+    arg_parser.add_argument("--embedding-model", default=None,
+                            help="sentence transformer (name or local folder) instead of the offline stand-in")
+    arg_parser.add_argument("--keep", action="store_true", help="keep the synthetic corpora after the run")
+    args = arg_parser.parse_args(argv)
+
+    texts = load_texts(args.root)
+    commit = git_commit(args.root)
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": [],
+    }
+
+    work_root = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        for scale in args.scales:
+            workload = Workload(replicate(texts, scale), scale, join(work_root, f"x{scale}"))
+            for stage in args.stages:
+                result = run_stage(stage, workload, args)
+                report["results"].append(result)
+                if "per_second" in result:
+                    print(f"{stage:<18}{scale:>5}x  {result['seconds']:>9.2f}s  "
+                          f"{result['per_second']:>14.1f} {result['unit']}/s")
+                else:
+                    print(f"{stage:<18}{scale:>5}x  {result.get('skipped') or result.get('error')}")
+    finally:
+        if args.keep:
+            print(f"Synthetische Korpora: {work_root}")
+        else:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    output = args.output or join("benchmarks", f"{datetime.now():%Y%m%d-%H%M%S}_{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Ergebnisse gespeichert: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print("\n".join(compare_results(json.load(f), report)))
+    return report
+
+
+if __name__ == '__main__':
+    main()
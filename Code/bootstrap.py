@@ -0,0 +1,183 @@
+"""
+bootstrap
+~~~~~~~~~~~~~~~~~
+
+This module provides bootstrap confidence intervals for the similarity
+matrices of the parties. A party vector is the weighted mean of the vectors
+of its units (speeches, text chunks or sentence transformer chunks):
+
+party vector = sum of the unit sums / sum of the unit weights
+
+Every replicate draws the units of every party with replacement (as many as
+the party has) and computes the party vectors and their cosine similarity
+matrix again. The draws of a batch of replicates are one (replicates *
+parties x units) count matrix, so the party vectors of the whole batch are a
+single matmul with the precomputed unit vectors and the similarity matrices
+a batched matmul. The batches are spread over a process pool, every batch
+has its own seed derived from the main seed, so the result doesn't depend
+on the number of workers.
+
+For every pair of parties the point estimate, the mean and the percentile
+interval of the similarity are reported, together with the stability of its
+rank in the ranking of all pairs.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import untrace_worker
+
+# Replicates that are computed by one task of the process pool
+BOOTSTRAP_BATCH_SIZE = 100
+
+_worker_units: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, int]] = None
+
+
+def group_vectors(counts: np.ndarray, sums: np.ndarray, weights: np.ndarray)->np.ndarray:
+    """
+    group_vectors is a function that returns the weighted mean vectors for
+    a (... x units) count matrix, e.g. the party vectors of every replicate.
+    """
+    totals = counts @ weights
+    vectors = counts @ sums
+    return vectors / np.where(totals == 0, 1.0, totals)[..., None]
+
+
+def normalize_rows(vectors: np.ndarray)->np.ndarray:
+    """
+    normalize_rows is a function that scales every row (the last axis) to
+    unit length, rows of zeros stay zero.
+    """
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def batched_cosine(vectors: np.ndarray)->np.ndarray:
+    """
+    batched_cosine is a function that returns the cosine similarity matrix of
+    every (groups x dimension) matrix of a stack, as one batched matmul.
+    A single (groups x dimension) matrix gives its similarity matrix.
+    """
+    normalized = normalize_rows(vectors)
+    return normalized @ np.swapaxes(normalized, -1, -2)
+
+
+def resample_counts(groups: np.ndarray, n_groups: int, n_replicates: int,
+                    rng: np.random.Generator)->np.ndarray:
+    """
+    resample_counts is a function that draws the units of every group with
+    replacement and returns how often every unit was drawn, as a
+    (replicates x groups x units) count array.
+    """
+    counts = np.zeros((n_replicates, n_groups, len(groups)))
+    for group in range(n_groups):
+        members = np.flatnonzero(groups == group)
+        if len(members):
+            counts[:, group, members] = rng.multinomial(len(members), np.full(len(members), 1.0 / len(members)),
+                                                        size=n_replicates)
+    return counts
+
+
+def replicate_batch(sums: np.ndarray, weights: np.ndarray, groups: np.ndarray, n_groups: int,
+                    n_replicates: int, seed: np.random.SeedSequence)->np.ndarray:
+    """
+    replicate_batch is a function that computes the similarity matrices of
+    n_replicates bootstrap replicates, as a (replicates x groups x groups) array.
+    """
+    counts = resample_counts(groups, n_groups, n_replicates, np.random.default_rng(seed))
+    return batched_cosine(group_vectors(counts, sums, weights))
+
+
+def _init_worker(sums: np.ndarray, weights: np.ndarray, groups: np.ndarray, n_groups: int)->None:
+    global _worker_units
+    untrace_worker()
+    _worker_units = (sums, weights, groups, n_groups)
+
+
+def _replicate_batch(n_replicates: int, seed: np.random.SeedSequence)->np.ndarray:
+    return replicate_batch(*_worker_units, n_replicates, seed)
+
+
+def bootstrap_similarity(sums: np.ndarray, weights: np.ndarray, groups: Sequence[int], n_groups: int,
+                         n_replicates: int = 1000, seed: int = 0, workers: Optional[int] = None,
+                         batch_size: int = BOOTSTRAP_BATCH_SIZE)->Dict[str, np.ndarray]:
+    """
+    bootstrap_similarity is a function that bootstraps the cosine similarity
+    matrix of the groups (parties) from the sums and weights of their units
+    and returns the point estimate ("point", groups x groups) and the
+    similarity matrices of all replicates ("replicates").
+    """
+    sums = np.asarray(sums, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    groups = np.asarray(groups, dtype=np.int64)
+    all_units = np.zeros((n_groups, len(groups)))
+    all_units[groups, np.arange(len(groups))] = 1.0
+    point = batched_cosine(group_vectors(all_units, sums, weights))
+
+    sizes = [min(batch_size, n_replicates - first) for first in range(0, n_replicates, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = min(workers or os.cpu_count() or 1, len(sizes))
+    if workers <= 1:
+        batches = [replicate_batch(sums, weights, groups, n_groups, size, batch_seed)
+                   for size, batch_seed in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(sums, weights, groups, n_groups)) as pool:
+            batches = list(pool.map(_replicate_batch, sizes, seeds))
+    replicates = np.concatenate(batches) if batches else np.zeros((0, n_groups, n_groups))
+    return {"point": point, "replicates": replicates}
+
+
+def pair_ranks(similarities: np.ndarray)->np.ndarray:
+    """
+    pair_ranks is a function that returns the rank (1 = most similar) of
+    every pair in the ranking of all pairs, for every row of a
+    (replicates x pairs) array.
+    """
+    order = np.argsort(-similarities, axis=-1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(1, similarities.shape[-1] + 1), axis=-1)
+    return ranks
+
+
+def pair_intervals(result: Dict[str, np.ndarray], names: List[str], alpha: float = 0.05)->pd.DataFrame:
+    """
+    pair_intervals is a function that returns one row per pair of parties,
+    sorted by the point estimate: similarity, bootstrap mean, percentile
+    interval, rank, rank interval and the share of replicates in which the
+    pair keeps its rank.
+    """
+    rows, cols = np.triu_indices(len(names), k=1)
+    point = result["point"][rows, cols]
+    replicates = result["replicates"][:, rows, cols]
+    point_ranks = pair_ranks(point[None, :])[0]
+    ranks = pair_ranks(replicates)
+    low, high = np.quantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+    rank_low, rank_high = np.quantile(ranks, [alpha / 2, 1 - alpha / 2], axis=0)
+    table = pd.DataFrame({
+        "Paar": [f"{names[i]} – {names[j]}" for i, j in zip(rows, cols)],
+        "Ähnlichkeit": point,
+        "Mittel": replicates.mean(axis=0),
+        "KI unten": low,
+        "KI oben": high,
+        "Rang": point_ranks,
+        "Rang unten": rank_low.astype(int),
+        "Rang oben": rank_high.astype(int),
+        "Rang stabil": (ranks == point_ranks).mean(axis=0),
+    })
+    return table.sort_values("Rang").reset_index(drop=True)
+
+
+def format_intervals(table: pd.DataFrame, n_replicates: int, alpha: float = 0.05)->str:
+    """
+    format_intervals is a function that returns the table of pair_intervals
+    as text, the similarities with 4 digits and the rank stability in percent.
+    """
+    table = table.copy()
+    table["Rang stabil"] = (table["Rang stabil"] * 100).map(lambda value: f"{value:.0f}%")
+    header = f"Bootstrap ({n_replicates} Replikate, {1 - alpha:.0%}-Konfidenzintervalle):\n"
+    return header + table.to_string(index=False, float_format=lambda value: f"{value:.4f}")
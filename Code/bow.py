@@ -1,71 +1,118 @@
-# Import the regular expressions module to help with text processing
-import re  
-from collections import (
-    defaultdict,
-)  
 # Data preprocessing
+import argparse
 import os
 from os.path import join
 from typing import *
 
 import nltk
 from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-import spacy
+
+from corpus_store import document_lemma_path, load_corpus, read_text
+from dtm import build_dtm, top_k
+from instrumentation import stage
+from lemma_cache import LemmaCache
+from lemmatize import lemmatize_corpus, load_lemmatizer
+from near_duplicates import NEAR_DUPLICATE_THRESHOLD, boilerplate_masks
+from phrases import load_phrase_corpus
+from speech_index import load_index
 
 # Download stopwords and tokenizer if you haven't already
 nltk.download("punkt")
 nltk.download("stopwords")
 nltk.download('punkt_tab')
 
+arg_parser = argparse.ArgumentParser(description="Lemmatize the party texts and apply BoW.")
+arg_parser.add_argument("--model", default="de_core_news_lg", help="spaCy model for lemmatization")
+arg_parser.add_argument("--batch-size", type=int, default=256, help="paragraphs per nlp.pipe batch")
+arg_parser.add_argument("--n-process", type=int, default=os.cpu_count() or 1, help="number of spaCy processes")
+arg_parser.add_argument("--no-lemma-cache", action="store_true",
+                        help="lemmatize every paragraph with spaCy (in its context, instead of the most "
+                             "frequent cached lemma of a form)")
+arg_parser.add_argument("--near-duplicates", type=float, nargs="?", const=NEAR_DUPLICATE_THRESHOLD, default=None,
+                        metavar="THRESHOLD",
+                        help="remove boilerplate lines (source notes, applause, ...) that have near duplicates within or "
+                             f"across the documents with a similarity of at least THRESHOLD (default {NEAR_DUPLICATE_THRESHOLD})")
+arg_parser.add_argument("--phrases", action="store_true",
+                        help="merge multi-word terms (bigrams, trigrams) into one token, see phrases.py")
+args = arg_parser.parse_args()
+
+# Every source file is one document, the party of each document is kept aside
 corpus: Dict[str, str] = {}
+parteien: Dict[str, str] = {}
+lemm_paths: Dict[str, str] = {}
 
 for folder in os.listdir("data/"):
     if folder != "raw_programme":
         parteiname: str = folder
-        corpus.setdefault(parteiname, "")
         folder = join("data/", folder)
 
         for subfolder in os.listdir(folder):
             dir = join(folder, subfolder)
+            # The combined texts only repeat the programmes and speeches of the party
+            if subfolder == "Combined" or not os.path.isdir(dir):
+                continue
 
             for file in os.listdir(dir):
                 if "lemmatisiert" not in file:
-                    with open(join(dir, file), 'r') as infile:
-                        corpus[parteiname] += infile.read().replace("\n", " ")
+                    # Keep the line breaks, every line is lemmatized as one paragraph
+                    corpus[join(dir, file)] = read_text(join(dir, file))
+                    parteien[join(dir, file)] = parteiname
+                    lemm_paths[join(dir, file)] = document_lemma_path("data/", parteiname, subfolder, file)
                     
-print(corpus.keys())
+print(sorted(set(parteien.values())))
+
+# Remove the boilerplate lines that are repeated (almost) verbatim within or across the documents
+if args.near_duplicates is not None:
+    documents = list(corpus)
+    lines = [corpus[document].splitlines() for document in documents]
+    with stage("near_duplicates", unit="Zeilen") as record:
+        masks = boilerplate_masks(lines, args.near_duplicates)
+        record.count(sum(len(document_lines) for document_lines in lines))
+    for document, document_lines, mask in zip(documents, lines, masks):
+        corpus[document] = "\n".join(line for line, boilerplate in zip(document_lines, mask) if not boilerplate)
+    print(f"{int(sum(mask.sum() for mask in masks))} Zeilen als Boilerplate entfernt")
 
 # Get the list of stop words in German
 stop_words = set(stopwords.words("german"))
-# Get the spacy German language package for lemmatization
-lemmatizer = spacy.load("de_core_news_lg")
-
-for partei, sentences in corpus.items():
-    # Tokenize
-    s = word_tokenize(sentences)
-    # Remove stop words from the sentence
-    s = [word for word in s if word.lower() not in stop_words]
-    # Join the words back into a sentence
-    s = " ".join(s)
-    # Remove all special characters, numbers etc. with RegEx
-    s = re.sub(r"[^a-zA-ZäöüÄÖÜß]", ' ', s)
-
-    # Lemmatize all words
-    s = lemmatizer.pipe(s, disable=['tok2vec', 'tagger', 'morphologizer', 'parser', 'senter', 'attribute_ruler', 'ner'])
-    s = ''.join([st.text for st in s])
-
-    # Creates a lemmatized file for the data of each party in the "data" folder
+# Get the spacy German language package for lemmatization (without unneeded components)
+lemmatizer = load_lemmatizer(args.model)
+
+# Creates a lemmatized file for the data of each party in the "data" folder
+# and one for every single document (for the speech-level TF-IDF)
+outfiles = {}
+for partei in set(parteien.values()):
     os.makedirs(f"data/{partei}/Lemmatisiert/", exist_ok=True)
-    with open(f"data/{partei}/Lemmatisiert/{partei}_lemmatisiert.txt", 'w') as outfile:
-        outfile.write(s)
-
-    # Applying BoW on the preprocessed data
-    vocab = defaultdict(int)
-    for word in s.split():
-        vocab.setdefault(word.lower(), 0)
-        vocab[word.lower()] += 1
-    
-    # Display the sorted vocabulary with descending frequency count for the 10 most frequent words
-    sorted_vocab = dict(sorted(vocab.items(), key=lambda x: x[1], reverse=True)) 
-    print(f"{partei} Wörter mit Frequenzen:", [(c, v) for i, (c, v) in enumerate(sorted_vocab.items()) if i < 10])
+    outfiles[partei] = open(f"data/{partei}/Lemmatisiert/{partei}_lemmatisiert.txt", 'w', encoding='utf-8')
+for document, lemm_path in lemm_paths.items():
+    outfiles[document] = open(lemm_path, 'w', encoding='utf-8')
+
+# Lemmatize all words, the paragraphs of all documents are streamed through spaCy in batches.
+# Paragraphs with already known tokens are taken from the persistent lemma cache.
+cache = None if args.no_lemma_cache else LemmaCache(args.model)
+for document, lemmas in lemmatize_corpus(lemmatizer, corpus, stop_words,
+                                         batch_size=args.batch_size, n_process=args.n_process,
+                                         cache=cache):
+    line = " ".join(lemmas) + "\n"
+    outfiles[parteien[document]].write(line)
+    outfiles[document].write(line)
+
+for outfile in outfiles.values():
+    outfile.close()
+if cache is not None:
+    cache.close()
+
+# Tokenize the lemmatized files once into the shared corpus store for all analysis scripts
+store = load_corpus("data/")
+if args.phrases:
+    store = load_phrase_corpus("data/", base=store)
+# Sync the speech index once here, the TF-IDF stages after the lemmatization only read it
+load_index("data/")
+
+# Applying BoW on the preprocessed data
+with stage("bow", unit="Tokens") as record:
+    counts, vocab = build_dtm(store)
+    record.count(int(counts.sum()))
+
+# Display the vocabulary with descending frequency count for the 10 most frequent words
+for partei, top_words in zip(store.names, top_k(counts, k=10)):
+    print(f"{partei} Wörter mit Frequenzen:", [(vocab[i], int(c)) for i, c in top_words])
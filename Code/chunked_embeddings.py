@@ -0,0 +1,156 @@
+"""
+chunked_embeddings
+~~~~~~~~~~~~~~~~~
+
+This module provides document embeddings for texts that are much longer than
+the maximum sequence length of the sentence transformer. Every text is split
+into chunks of at most max_tokens tokens of the model's own tokenizer, all
+chunks of all documents are sorted by length and encoded in batches (so a
+batch contains chunks of similar length and hardly any padding), and the
+chunk embeddings are pooled back into one vector per document:
+
+pooling:  "mean"      every chunk counts the same
+          "weighted"  every chunk counts with its number of tokens
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_cache import chunk_key, EmbeddingCache
+from instrumentation import stage
+
+# Tokens per chunk, the attention cost grows quadratically with the chunk length
+MAX_TOKENS = 512
+
+
+def chunk_text(text: str, tokenizer, max_tokens: int = MAX_TOKENS)->List[Tuple[str, int]]:
+    """
+    chunk_text is a function that splits a text into consecutive chunks of at
+    most max_tokens tokens and returns (chunk, number of tokens) for each.
+    The chunks are cut at the token offsets of a (fast) huggingface tokenizer,
+    without one, whitespace separated words are counted instead.
+    """
+    if tokenizer is not None and getattr(tokenizer, "is_fast", False):
+        encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                             return_attention_mask=False, verbose=False)
+        offsets = encoding["offset_mapping"]
+        chunks = []
+        for start in range(0, len(offsets), max_tokens):
+            window = offsets[start:start + max_tokens]
+            chunks.append((text[window[0][0]:window[-1][1]], len(window)))
+        return chunks
+
+    words = text.split()
+    return [(" ".join(words[start:start + max_tokens]), len(words[start:start + max_tokens]))
+            for start in range(0, len(words), max_tokens)]
+
+
+def pooling_weights(chunk_lengths: np.ndarray, pooling: str = "mean")->np.ndarray:
+    """
+    pooling_weights is a function that returns the weight of every chunk,
+    1 ("mean") or its number of tokens ("weighted").
+    """
+    if pooling == "mean":
+        return np.ones(len(chunk_lengths))
+    if pooling == "weighted":
+        return chunk_lengths.astype(np.float64)
+    raise ValueError(f"unknown pooling: {pooling}")
+
+
+def pool_chunks(chunk_embeddings: np.ndarray, chunk_documents: np.ndarray, chunk_lengths: np.ndarray,
+                n_documents: int, pooling: str = "mean")->np.ndarray:
+    """
+    pool_chunks is a function that averages the chunk embeddings of every
+    document, either plain ("mean") or weighted by their number of tokens ("weighted").
+    """
+    weights = pooling_weights(chunk_lengths, pooling)
+    pooled = np.zeros((n_documents, chunk_embeddings.shape[1]))
+    np.add.at(pooled, chunk_documents, chunk_embeddings * weights[:, None])
+    totals = np.bincount(chunk_documents, weights=weights, minlength=n_documents)
+    return pooled / np.where(totals == 0, 1.0, totals)[:, None]
+
+
+def encode_length_bucketed(model, texts: List[str], lengths: np.ndarray, batch_size: int = 16)->np.ndarray:
+    """
+    encode_length_bucketed is a function that encodes the texts sorted by their
+    length in batches, so neighbouring chunks in a batch have (almost) the
+    same length, and returns the embeddings in the original order.
+    """
+    order = np.argsort(lengths, kind="stable")
+    embeddings = np.zeros((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    for first in range(0, len(order), batch_size):
+        batch = order[first:first + batch_size]
+        embeddings[batch] = model.encode([texts[i] for i in batch], batch_size=len(batch),
+                                         convert_to_numpy=True, show_progress_bar=False)
+    return embeddings
+
+
+def embed_chunks(model, documents: Sequence[Sequence[str]], max_tokens: int = MAX_TOKENS,
+                 batch_size: int = 16, cache: 'Optional[EmbeddingCache]' = None
+                 )->Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, float]]:
+    """
+    embed_chunks is a function that embeds every chunk of every document with
+    a sentence transformer model (chunked, length-bucketed) and returns the
+    chunk embeddings, the document and the number of tokens of every chunk
+    and the throughput.
+    Every document is a list of texts (e.g. its files) that are chunked on
+    their own, so a changed text doesn't move the chunks of the others.
+    If an embedding cache is given, only chunks that are not cached yet are
+    encoded by the model.
+    """
+    # the chunks may not be longer than the model allows (including the special tokens)
+    max_seq_length = getattr(model, "max_seq_length", None)
+    if max_seq_length:
+        max_tokens = min(max_tokens, max_seq_length - 2)
+
+    texts, chunk_documents, chunk_lengths = [], [], []
+    for idx, document in enumerate(documents):
+        for text in document:
+            for chunk, n_tokens in chunk_text(text, getattr(model, "tokenizer", None), max_tokens):
+                texts.append(chunk)
+                chunk_documents.append(idx)
+                chunk_lengths.append(n_tokens)
+    chunk_documents = np.array(chunk_documents, dtype=np.int64)
+    chunk_lengths = np.array(chunk_lengths, dtype=np.int64)
+
+    with stage("embedding", unit="Chunks", chunks=len(texts), cached=cache is not None) as record:
+        if cache is None:
+            embeddings = encode_length_bucketed(model, texts, chunk_lengths, batch_size)
+            n_encoded = len(texts)
+        else:
+            keys = [chunk_key(text) for text in texts]
+            rows = cache.lookup(keys)
+            # every missing chunk is encoded only once, even if it occurs several times
+            missing = {}
+            for i in np.flatnonzero(rows < 0):
+                missing.setdefault(keys[i], i)
+            missing = list(missing.values())
+            new_embeddings = encode_length_bucketed(model, [texts[i] for i in missing], chunk_lengths[missing], batch_size)
+            new_rows = dict(zip((keys[i] for i in missing), cache.add([keys[i] for i in missing], new_embeddings)))
+            for i in np.flatnonzero(rows < 0):
+                rows[i] = new_rows[keys[i]]
+            embeddings = cache.get(rows)
+            n_encoded = len(missing)
+        record.count(n_encoded)
+
+    stats = {
+        "chunks": len(texts),
+        "encoded": n_encoded,
+        "tokens": int(chunk_lengths.sum()),
+        "seconds": record.seconds,
+        "chunks_per_second": record.per_second(),
+    }
+    return embeddings, chunk_documents, chunk_lengths, stats
+
+
+def embed_documents(model, documents: Sequence[Sequence[str]], max_tokens: int = MAX_TOKENS,
+                    batch_size: int = 16, pooling: str = "mean",
+                    cache: 'Optional[EmbeddingCache]' = None)->Tuple[np.ndarray, Dict[str, float]]:
+    """
+    embed_documents is a function that embeds every document completely with a
+    sentence transformer model (see embed_chunks) and returns the pooled
+    (documents x dimension) document vectors and the throughput.
+    """
+    embeddings, chunk_documents, chunk_lengths, stats = embed_chunks(model, documents, max_tokens, batch_size, cache)
+    return pool_chunks(embeddings, chunk_documents, chunk_lengths, len(documents), pooling), stats
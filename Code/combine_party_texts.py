@@ -0,0 +1,69 @@
+"""
+combine_party_texts
+~~~~~~~~~~~~~~~~~
+
+This module is the Python version of combine_party_texts.r, so the whole
+pipeline runs without R. All texts of a party (programmes and speeches)
+are combined line by line into one file inside the folder that the
+sentence transformer reads:
+data/<party>/Combined/<party>_combined.txt
+
+A combined file is only rewritten if its content changed.
+"""
+
+import argparse
+import os
+from os.path import join
+from typing import Dict
+
+from corpus_store import read_text
+
+# Subfolders of a party whose texts are combined
+INCLUDE_SUBFOLDERS = ["Parteiprogramm", "Reden"]
+
+
+def combine_party(party_dir: str)->str:
+    """
+    combine_party is a function that returns all lines of all texts of a
+    party, in the order of the subfolders and the file names.
+    """
+    lines = []
+    for subfolder in INCLUDE_SUBFOLDERS:
+        dir = join(party_dir, subfolder)
+        if not os.path.isdir(dir):
+            continue
+        for file in sorted(os.listdir(dir)):
+            if file.endswith(".txt") and "lemmatisiert" not in file.lower():
+                lines.extend(read_text(join(dir, file)).splitlines())
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def combine_all(data_dir: str = "data")->Dict[str, str]:
+    """
+    combine_all is a function that writes the combined file of every party
+    and returns party -> path of the combined file.
+    """
+    combined = {}
+    for partei in sorted(os.listdir(data_dir)):
+        party_dir = join(data_dir, partei)
+        if partei == "raw_programme" or not os.path.isdir(party_dir):
+            continue
+        text = combine_party(party_dir)
+        if not text:
+            print(f"Keine Texte für {partei} gefunden!")
+            continue
+        out_path = join(party_dir, "Combined", f"{partei}_combined.txt")
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        if not os.path.exists(out_path) or read_text(out_path) != text:
+            with open(out_path, "w", encoding="utf-8", newline="\n") as f:
+                f.write(text)
+            print(f"Kombinierte Datei für {partei}: {out_path}")
+        combined[partei] = out_path
+    return combined
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Combine all texts of every party into one file.")
+    arg_parser.add_argument("--data", default="data", help="data folder with one folder per party")
+    args = arg_parser.parse_args()
+    combine_all(args.data)
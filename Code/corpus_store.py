@@ -0,0 +1,244 @@
+"""
+corpus_store
+~~~~~~~~~~~~~~~~~
+
+This module provides a shared, cached store of the lemmatized party corpora,
+so the analysis scripts don't have to walk the "data" folder, read every
+"<party>_lemmatisiert.txt" and split it again on every run.
+
+The texts are tokenized once. The store keeps a shared vocabulary and the
+token ids of all documents as one int32 array on disk:
+<store_dir>/vocab.txt      one token per line, the line number is the token id
+<store_dir>/tokens.bin     token ids of all documents, one after another (int32)
+<store_dir>/offsets.npy    start of every document inside tokens.bin
+<store_dir>/meta.json      documents with name, source file, size and mtime
+
+The token ids are memory-mapped, so every script reads the same physical
+pages and the ids of a document are a view without any copy.
+"""
+
+import json
+import os
+from os.path import join
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from instrumentation import stage
+
+# Default location of the store, relative to the working directory of the scripts
+STORE_DIR = join("cache", "corpus_store")
+# Increase this number whenever the layout of the store changes
+STORE_VERSION = 1
+
+
+def read_text(filepath: str)->str:
+    """
+    read_text is a function that reads a source text. The texts are utf-8,
+    except for the speeches that were saved on Windows (cp1252).
+    """
+    with open(filepath, "rb") as f:
+        data = f.read()
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("cp1252")
+
+
+def find_lemmatized_files(data_dir: str = "data")->Dict[str, str]:
+    """
+    find_lemmatized_files is a function that returns the lemmatized file of
+    every party inside the data folder, e.g. {'AfD': 'data/AfD/Lemmatisiert/AfD_lemmatisiert.txt'}.
+    The folder "raw_programme" is ignored like in the BoW script.
+    """
+    files = {}
+    for partei in sorted(os.listdir(data_dir)):
+        if partei == "raw_programme":
+            continue
+        lemm_file = join(data_dir, partei, "Lemmatisiert", f"{partei}_lemmatisiert.txt")
+        if os.path.exists(lemm_file):
+            files[partei] = lemm_file
+    return files
+
+
+def document_lemma_path(data_dir: str, partei: str, subfolder: str, file: str)->str:
+    """
+    document_lemma_path is a function that returns the path of the lemmatized
+    file of a single document, e.g. ('data', 'AfD', 'Reden', 'Weidel_Generaldebatte_2025.txt')
+    -> 'data/AfD/Lemmatisiert/Reden_Weidel_Generaldebatte_2025_lemmatisiert.txt'.
+    The name contains "lemmatisiert", so the BoW script never reads it as a source text.
+    """
+    stem = os.path.splitext(file)[0]
+    return join(data_dir, partei, "Lemmatisiert", f"{subfolder}_{stem}_lemmatisiert.txt")
+
+
+def find_document_files(data_dir: str = "data")->List[dict]:
+    """
+    find_document_files is a function that returns every speech and programme
+    inside the data folder whose lemmatized file exists, with its metadata:
+    name ('AfD/Reden/Weidel_Generaldebatte_2025'), party, kind (subfolder),
+    source (original text) and path (lemmatized file).
+    """
+    documents = []
+    for partei in sorted(os.listdir(data_dir)):
+        partei_path = join(data_dir, partei)
+        if partei == "raw_programme" or not os.path.isdir(partei_path):
+            continue
+        for subfolder in sorted(os.listdir(partei_path)):
+            dir = join(partei_path, subfolder)
+            if subfolder in ("Lemmatisiert", "Combined") or not os.path.isdir(dir):
+                continue
+            for file in sorted(os.listdir(dir)):
+                lemm_file = document_lemma_path(data_dir, partei, subfolder, file)
+                if "lemmatisiert" not in file and os.path.exists(lemm_file):
+                    documents.append({
+                        "name": f"{partei}/{subfolder}/{os.path.splitext(file)[0]}",
+                        "party": partei,
+                        "kind": subfolder,
+                        "source": join(dir, file),
+                        "path": lemm_file,
+                    })
+    return documents
+
+
+def file_signature(filepath: str)->Tuple[int, int]:
+    """
+    file_signature is a function that returns size and modification time of a
+    file, which is enough to notice that a source file was rewritten.
+    """
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class CorpusStore:
+    """
+    CorpusStore gives read access to a store written by build_store.
+    * vocab: list of all tokens, the index is the token id
+    * names: names of all documents (the parties) in store order
+    * tokens: memory-mapped int32 token ids of all documents
+    """
+
+    def __init__(self, store_dir: str = STORE_DIR):
+        self.store_dir = store_dir
+        with open(join(store_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(join(store_dir, "vocab.txt"), "r", encoding="utf-8", newline="\n") as f:
+            self.vocab: List[str] = f.read().split("\n")[:-1]
+        self.offsets: np.ndarray = np.load(join(store_dir, "offsets.npy"))
+        if self.offsets[-1] > 0:
+            self.tokens = np.memmap(join(store_dir, "tokens.bin"), dtype="<i4", mode="r")
+        else:
+            # numpy can't map an empty file
+            self.tokens = np.zeros(0, dtype="<i4")
+        self.documents: List[dict] = self.meta["documents"]
+        self.names: List[str] = [doc["name"] for doc in self.documents]
+        self._index = {name: idx for idx, name in enumerate(self.names)}
+        self._lowercase = None
+
+    def __len__(self)->int:
+        return len(self.names)
+
+    def __contains__(self, name: str)->bool:
+        return name in self._index
+
+    def doc_ids(self, name: str)->np.ndarray:
+        """
+        doc_ids returns the token ids of a document as a view into the store.
+        """
+        idx = self._index[name]
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def doc_tokens(self, name: str)->List[str]:
+        """
+        doc_tokens returns the tokens of a document as strings, e.g. for gensim.
+        """
+        vocab = self.vocab
+        return [vocab[i] for i in self.doc_ids(name).tolist()]
+
+    def lowercase(self)->Tuple[List[str], np.ndarray]:
+        """
+        lowercase returns the lowercased vocabulary and an array that maps
+        every token id of the store to its id in the lowercased vocabulary,
+        so lowercased ids of a document are simply mapping[store.doc_ids(name)].
+        """
+        if self._lowercase is None:
+            lower_vocab, mapping = np.unique(
+                np.array([token.lower() for token in self.vocab], dtype=object),
+                return_inverse=True,
+            )
+            self._lowercase = (lower_vocab.tolist(), mapping.astype(np.int32))
+        return self._lowercase
+
+
+def build_store(sources: Dict[str, str], store_dir: str = STORE_DIR)->CorpusStore:
+    """
+    build_store is a function that tokenizes the given files (document name ->
+    file path) once and writes the store. The token ids are appended to the
+    store document by document, so only one text is held in memory.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    # meta.json is written last, an interrupted build is therefore never loaded
+    if os.path.exists(join(store_dir, "meta.json")):
+        os.remove(join(store_dir, "meta.json"))
+    vocab: Dict[str, int] = {}
+    offsets = [0]
+    documents = []
+
+    with open(join(store_dir, "tokens.bin"), "wb") as outstream:
+        for name, filepath in sources.items():
+            size, mtime_ns = file_signature(filepath)
+            with open(filepath, "r", encoding="utf-8") as f:
+                tokens = f.read().split()
+            ids = np.fromiter((vocab.setdefault(token, len(vocab)) for token in tokens),
+                              dtype="<i4", count=len(tokens))
+            ids.tofile(outstream)
+            offsets.append(offsets[-1] + len(ids))
+            documents.append({"name": name, "path": filepath, "size": size, "mtime_ns": mtime_ns})
+
+    with open(join(store_dir, "vocab.txt"), "w", encoding="utf-8", newline="\n") as f:
+        for token in vocab:
+            f.write(token + "\n")
+    np.save(join(store_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    with open(join(store_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "documents": documents}, f, indent=2)
+
+    return CorpusStore(store_dir)
+
+
+def is_stale(sources: Dict[str, str], store_dir: str = STORE_DIR)->bool:
+    """
+    is_stale is a function that checks whether the store is missing or was
+    built from other (or since modified) source files.
+    """
+    try:
+        with open(join(store_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return True
+    if meta.get("version") != STORE_VERSION:
+        return True
+
+    recorded = {doc["name"]: (doc["path"], doc["size"], doc["mtime_ns"]) for doc in meta["documents"]}
+    if list(recorded) != list(sources):
+        return True
+    for name, filepath in sources.items():
+        if not os.path.exists(filepath) or recorded[name] != (filepath, *file_signature(filepath)):
+            return True
+    return False
+
+
+def load_corpus(data_dir: str = "data", store_dir: str = STORE_DIR)->CorpusStore:
+    """
+    load_corpus is a function that returns the store of the lemmatized party
+    corpora inside data_dir. The store is (re)built only if it is missing or
+    one of the lemmatized files changed.
+    """
+    sources = find_lemmatized_files(data_dir)
+    if is_stale(sources, store_dir):
+        print(f"Baue Korpus-Speicher in {store_dir} auf...")
+        with stage("corpus_store", unit="Tokens") as record:
+            store = build_store(sources, store_dir)
+            record.count(int(store.offsets[-1]))
+        return store
+    return CorpusStore(store_dir)
+
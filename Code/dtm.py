@@ -0,0 +1,129 @@
+"""
+dtm
+~~~~~~~~~~~~~~~~~
+
+This module provides a sparse (CSR) document-term matrix for BoW and TF-IDF.
+The matrix is built directly from the token ids of the corpus store and all
+weightings are vectorized over the whole matrix:
+
+term frequency:   "raw" (absolute counts), "relative" (count / count of the
+                  most frequent term of the document, like the TF-IDF script),
+                  "share" (count / length of the document), "log" (1 + log(count))
+idf:              "plain" (log(N / df)), "smooth" (log((1 + N) / (1 + df)) + 1)
+
+The k best terms of every document are selected with np.argpartition, so the
+vocabulary never has to be sorted completely.
+"""
+
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from corpus_store import CorpusStore
+
+
+def build_dtm(store: CorpusStore, names: Optional[Sequence[str]] = None,
+              lowercase: bool = True)->Tuple[sparse.csr_matrix, List[str]]:
+    """
+    build_dtm is a function that counts the tokens of the given documents of
+    the store (default: all) and returns the (documents x vocabulary) count
+    matrix together with its vocabulary.
+    """
+    names = store.names if names is None else names
+    vocab, mapping = store.lowercase() if lowercase else (store.vocab, None)
+
+    ids = [store.doc_ids(name) for name in names]
+    lengths = np.array([len(doc) for doc in ids], dtype=np.int64)
+    cols = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32)
+    if mapping is not None:
+        cols = mapping[cols]
+    rows = np.repeat(np.arange(len(names)), lengths)
+
+    # duplicate (row, col) entries are summed up on conversion to CSR
+    counts = sparse.coo_matrix((np.ones(len(cols), dtype=np.int64), (rows, cols)),
+                               shape=(len(names), len(vocab))).tocsr()
+    counts.sum_duplicates()
+    return counts, vocab
+
+
+def term_frequency(counts: sparse.csr_matrix, scheme: str = "relative")->sparse.csr_matrix:
+    """
+    term_frequency is a function that weights the counts of every document
+    with the given scheme ("raw", "relative", "share" or "log").
+    """
+    counts = counts.tocsr().astype(np.float64)
+    if scheme == "raw":
+        return counts
+    if scheme == "log":
+        counts.data = 1.0 + np.log(counts.data)
+        return counts
+    if scheme == "relative":
+        norm = counts.max(axis=1).toarray().ravel()
+    elif scheme == "share":
+        norm = np.asarray(counts.sum(axis=1)).ravel()
+    else:
+        raise ValueError(f"unknown term frequency scheme: {scheme}")
+    # scale the rows, empty documents stay empty
+    norm[norm == 0] = 1.0
+    return sparse.diags(1.0 / norm) @ counts
+
+
+def document_frequency(counts: sparse.csr_matrix)->np.ndarray:
+    """
+    document_frequency is a function that returns in how many documents every
+    term of the vocabulary occurs.
+    """
+    return np.bincount(counts.tocsr().indices, minlength=counts.shape[1])
+
+
+def inverse_document_frequency(df: np.ndarray, n_documents: int, scheme: str = "plain")->np.ndarray:
+    """
+    inverse_document_frequency is a function that returns the idf of every term
+    for the given document frequencies ("plain" or "smooth"). Terms that occur
+    in no document get an idf of 0.
+    """
+    df = np.asarray(df, dtype=np.float64)
+    if scheme == "plain":
+        with np.errstate(divide="ignore"):
+            idf = np.log(n_documents / df)
+        idf[df == 0] = 0.0
+        return idf
+    if scheme == "smooth":
+        return np.log((1.0 + n_documents) / (1.0 + df)) + 1.0
+    raise ValueError(f"unknown idf scheme: {scheme}")
+
+
+def tfidf(counts: sparse.csr_matrix, tf: str = "relative", idf: str = "plain")->sparse.csr_matrix:
+    """
+    tfidf is a function that returns the TF-IDF weighted document-term matrix.
+    """
+    weights = inverse_document_frequency(document_frequency(counts), counts.shape[0], idf)
+    result = term_frequency(counts, tf) @ sparse.diags(weights)
+    result = result.tocsr()
+    result.eliminate_zeros()
+    return result
+
+
+def top_k(matrix: sparse.csr_matrix, k: int = 10,
+          exclude: Iterable[int] = ())->List[List[Tuple[int, float]]]:
+    """
+    top_k is a function that returns the k columns with the highest values of
+    every row as a list of (column, value), in descending order. Columns in
+    exclude are skipped (e.g. known filter errors).
+    """
+    matrix = matrix.tocsr()
+    excluded = np.zeros(matrix.shape[1], dtype=bool)
+    excluded[list(exclude)] = True
+    result = []
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        cols, values = matrix.indices[start:end], matrix.data[start:end]
+        keep = ~excluded[cols]
+        cols, values = cols[keep], values[keep]
+        if len(values) > k:
+            best = np.argpartition(-values, k - 1)[:k]
+            cols, values = cols[best], values[best]
+        order = np.lexsort((cols, -values))
+        result.append([(int(cols[i]), float(values[i])) for i in order])
+    return result
@@ -0,0 +1,116 @@
+"""
+embedding_cache
+~~~~~~~~~~~~~~~~~
+
+This module provides a persistent store of chunk embeddings, keyed by the
+model id and the content hash of the chunk. Only chunks that are new (or
+changed) have to go through the model, everything else is read from disk.
+
+Every model has its own folder below the cache directory:
+<cache_dir>/<model>/keys.bin      16 byte blake2b hash of every chunk, in row order
+<cache_dir>/<model>/vectors.f16   the embeddings as a float16 matrix, one row per key
+
+Both files are only appended to, the vectors are written before their keys.
+Whatever an interrupted run left behind without its counterpart is cut off
+on the next load. The vectors are memory-mapped for reading.
+"""
+
+import hashlib
+import os
+from os.path import join
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Default location of the cache, relative to the working directory of the scripts
+CACHE_DIR = join("cache", "embeddings")
+KEY_SIZE = 16
+
+
+def chunk_key(text: str)->bytes:
+    """
+    chunk_key is a function that returns the content hash of a chunk.
+    """
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=KEY_SIZE).digest()
+
+
+class EmbeddingCache:
+    """
+    EmbeddingCache maps chunk hashes to the embeddings of one model.
+    """
+
+    def __init__(self, model_id: str, dimension: int, cache_dir: str = CACHE_DIR):
+        self.dimension = dimension
+        self.dir = join(cache_dir, model_id.replace("/", "__"))
+        os.makedirs(self.dir, exist_ok=True)
+        self.keys_path = join(self.dir, "keys.bin")
+        self.vectors_path = join(self.dir, "vectors.f16")
+
+        data = b""
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                data = f.read()
+        keys = [data[i:i + KEY_SIZE] for i in range(0, len(data) - KEY_SIZE + 1, KEY_SIZE)]
+        row_size = 2 * dimension
+        n_vectors = os.path.getsize(self.vectors_path) // row_size if os.path.exists(self.vectors_path) else 0
+
+        # cut off the rest of an interrupted run, so keys and vectors stay aligned
+        self.n_rows = min(len(keys), n_vectors)
+        for path, size in ((self.keys_path, self.n_rows * KEY_SIZE), (self.vectors_path, self.n_rows * row_size)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+        self.rows: Dict[bytes, int] = {key: row for row, key in enumerate(keys[:self.n_rows])}
+        self._vectors = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self)->int:
+        return self.n_rows
+
+    def vectors(self)->np.ndarray:
+        """
+        vectors returns all cached embeddings as a memory-mapped float16 matrix.
+        """
+        if self._vectors is None or len(self._vectors) != self.n_rows:
+            if self.n_rows == 0:
+                return np.zeros((0, self.dimension), dtype=np.float16)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r",
+                                      shape=(self.n_rows, self.dimension))
+        return self._vectors
+
+    def lookup(self, keys: Sequence[bytes])->np.ndarray:
+        """
+        lookup returns the row of every key, or -1 for keys that are not cached.
+        """
+        rows = np.fromiter((self.rows.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+        misses = int((rows < 0).sum())
+        self.hits += len(rows) - misses
+        self.misses += misses
+        return rows
+
+    def get(self, rows: np.ndarray)->np.ndarray:
+        """
+        get returns the embeddings of the given rows as float32.
+        """
+        return np.asarray(self.vectors()[rows], dtype=np.float32)
+
+    def add(self, keys: List[bytes], embeddings: np.ndarray)->np.ndarray:
+        """
+        add appends the embeddings of new keys and returns their rows.
+        """
+        rows = []
+        new_keys, new_vectors = [], []
+        for key, embedding in zip(keys, embeddings):
+            row = self.rows.get(key)
+            if row is None:
+                row = self.rows[key] = self.n_rows + len(new_keys)
+                new_keys.append(key)
+                new_vectors.append(embedding)
+            rows.append(row)
+        if new_keys:
+            with open(self.vectors_path, "ab") as f:
+                np.asarray(new_vectors, dtype=np.float16).tofile(f)
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(new_keys))
+            self.n_rows += len(new_keys)
+        return np.array(rows, dtype=np.int64)
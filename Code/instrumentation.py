@@ -0,0 +1,262 @@
+"""
+instrumentation
+~~~~~~~~~~~~~~~~~
+
+This module provides a lightweight instrumentation layer for all scripts.
+A stage is measured with a context manager:
+
+    with stage("lemmatization", unit="Tokens") as record:
+        ...
+        record.count(len(lemmas))
+
+Every stage records its wall time, the number of processed items (pages,
+tokens, chunks, ...) and their throughput. If tracing is enabled, the peak
+memory of the stage (tracemalloc) is captured as well, and every finished
+stage is appended as one JSON line to the trace file. Optionally, every stage
+is profiled with cProfile and dumped to <profile_dir>/<stage>-<pid>-<n>.prof
+(e.g. for snakeviz or pstats).
+
+Tracing is switched on by environment variables, so no script needs flags:
+PIPELINE_TRACE=trace.jsonl        append the stages to this file
+PIPELINE_PROFILE=profiles         additionally dump a cProfile file per stage
+PIPELINE_TRACE_MEMORY=0           don't capture the peak memory
+
+Without PIPELINE_TRACE a stage only costs two clock reads. tracemalloc slows
+down every allocation of the traced process, so the timings of a trace with
+memory capture are only comparable to each other. Worker processes stop the
+tracing they inherit (see untrace_worker), their memory is not captured.
+A trace is summarized per stage with:
+python Code/instrumentation.py trace.jsonl
+"""
+
+import argparse
+import cProfile
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+from os.path import join
+import time
+import tracemalloc
+from typing import Dict, Iterator, List, Optional
+
+TRACE_ENV = "PIPELINE_TRACE"
+PROFILE_ENV = "PIPELINE_PROFILE"
+MEMORY_ENV = "PIPELINE_TRACE_MEMORY"
+
+
+class StageRecord:
+    """
+    StageRecord collects the measurements of one stage.
+    """
+
+    def __init__(self, name: str, unit: Optional[str] = None, **meta):
+        self.name = name
+        self.unit = unit
+        self.meta = meta
+        self.items = 0
+        self.seconds = 0.0
+        self.peak_bytes: Optional[int] = None
+        self.error: Optional[str] = None
+        # highest traced memory of the finished child stages
+        self._child_peak = 0
+
+    def count(self, n: int = 1)->None:
+        """
+        count adds n processed items to the throughput counter.
+        """
+        self.items += n
+
+    def per_second(self)->float:
+        return self.items / max(self.seconds, 1e-9)
+
+    def as_dict(self)->dict:
+        entry = {"stage": self.name, "pid": os.getpid(), "time": time.time(), "seconds": self.seconds}
+        if self.unit is not None:
+            entry.update({"items": self.items, "unit": self.unit, "per_second": self.per_second()})
+        if self.peak_bytes is not None:
+            entry["peak_bytes"] = self.peak_bytes
+        if self.meta:
+            entry["meta"] = self.meta
+        if self.error is not None:
+            entry["error"] = self.error
+        return entry
+
+
+class Tracer:
+    """
+    Tracer writes the finished stages to a trace file (JSON lines) and keeps
+    track of nested stages, so the peak memory of an outer stage includes
+    the peaks of its inner stages and only the outermost profiled stage
+    runs cProfile (there can only be one active profiler).
+    """
+
+    def __init__(self, trace_path: Optional[str] = None, profile_dir: Optional[str] = None, memory: bool = True):
+        self.trace_path = trace_path
+        self.profile_dir = profile_dir
+        self.memory = memory
+        self._stack: List[StageRecord] = []
+        self._profiling = False
+        self._n_profiles = 0
+
+    @property
+    def enabled(self)->bool:
+        return self.trace_path is not None
+
+    def write(self, record: StageRecord)->None:
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.trace_path) or ".", exist_ok=True)
+        with open(self.trace_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record.as_dict(), ensure_ascii=False) + "\n")
+
+    @contextmanager
+    def stage(self, name: str, unit: Optional[str] = None, **meta)->Iterator[StageRecord]:
+        """
+        stage measures the enclosed block as a stage of the given name.
+        """
+        record = StageRecord(name, unit, **meta)
+        if not self.enabled:
+            start = time.perf_counter()
+            try:
+                yield record
+            finally:
+                record.seconds = time.perf_counter() - start
+            return
+
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if self._stack:
+                # keep the peak of the outer stage before the peak is reset for this one
+                parent = self._stack[-1]
+                parent._child_peak = max(parent._child_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stack.append(record)
+
+        profiler = None
+        if self.profile_dir is not None and not self._profiling:
+            profiler = cProfile.Profile()
+            self._profiling = True
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            yield record
+        except GeneratorExit:
+            # a generator stage that was closed early by its consumer
+            raise
+        except BaseException as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record.seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                os.makedirs(self.profile_dir, exist_ok=True)
+                self._n_profiles += 1
+                profiler.dump_stats(join(self.profile_dir, f"{name}-{os.getpid()}-{self._n_profiles}.prof"))
+            self._stack.pop()
+            if self.memory:
+                record.peak_bytes = max(record._child_peak, tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]._child_peak = max(self._stack[-1]._child_peak, record.peak_bytes)
+            self.write(record)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer()->Tracer:
+    """
+    get_tracer is a function that returns the tracer of this process,
+    configured from the environment variables on first use.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(os.environ.get(TRACE_ENV) or None, os.environ.get(PROFILE_ENV) or None,
+                         os.environ.get(MEMORY_ENV, "1") != "0")
+    return _tracer
+
+
+def configure(trace_path: Optional[str] = None, profile_dir: Optional[str] = None, memory: bool = True)->Tracer:
+    """
+    configure is a function that replaces the tracer of this process, e.g. to
+    trace from code instead of by environment variables.
+    """
+    global _tracer
+    _tracer = Tracer(trace_path, profile_dir, memory)
+    return _tracer
+
+
+def untrace_worker()->None:
+    """
+    untrace_worker is a function for the initializer of a process pool: a
+    forked worker inherits the memory tracing of its parent, which would slow
+    it down without ever being reported.
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def stage(name: str, unit: Optional[str] = None, **meta):
+    """
+    stage is a function that returns the context manager of a stage of the
+    current tracer, see Tracer.stage.
+    """
+    return get_tracer().stage(name, unit, **meta)
+
+
+def load_trace(trace_path: str)->List[dict]:
+    """
+    load_trace is a function that reads all stages of a trace file.
+    """
+    with open(trace_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(entries: List[dict])->Dict[str, dict]:
+    """
+    summarize is a function that aggregates the stages of a trace by name:
+    number of calls, total and maximum seconds, processed items, throughput,
+    highest peak memory and number of errors.
+    """
+    summary: Dict[str, dict] = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                                    "items": 0, "unit": None, "peak_bytes": None, "errors": 0})
+    for entry in entries:
+        stats = summary[entry["stage"]]
+        stats["calls"] += 1
+        stats["seconds"] += entry["seconds"]
+        stats["max_seconds"] = max(stats["max_seconds"], entry["seconds"])
+        if "items" in entry:
+            stats["items"] += entry["items"]
+            stats["unit"] = entry["unit"]
+        if "peak_bytes" in entry:
+            stats["peak_bytes"] = max(stats["peak_bytes"] or 0, entry["peak_bytes"])
+        if "error" in entry:
+            stats["errors"] += 1
+    for stats in summary.values():
+        stats["per_second"] = stats["items"] / max(stats["seconds"], 1e-9) if stats["unit"] else None
+    return dict(summary)
+
+
+def format_summary(summary: Dict[str, dict])->str:
+    """
+    format_summary is a function that returns the summary as a table, the
+    slowest stages first.
+    """
+    lines = [f"{'Stage':<28}{'Aufrufe':>8}{'Sekunden':>11}{'Max s':>9}{'Durchsatz':>24}{'Peak MB':>10}{'Fehler':>8}"]
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["seconds"]):
+        throughput = f"{stats['per_second']:.1f} {stats['unit']}/s" if stats["unit"] else "-"
+        peak = f"{stats['peak_bytes'] / 2**20:.1f}" if stats["peak_bytes"] is not None else "-"
+        lines.append(f"{name:<28}{stats['calls']:>8}{stats['seconds']:>11.2f}{stats['max_seconds']:>9.2f}"
+                     f"{throughput:>24}{peak:>10}{stats['errors']:>8}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Summarize a trace file per stage.")
+    arg_parser.add_argument("trace", help="trace file written with PIPELINE_TRACE")
+    args = arg_parser.parse_args()
+    print(format_summary(summarize(load_trace(args.trace))))
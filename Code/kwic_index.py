@@ -0,0 +1,572 @@
+"""
+kwic_index
+~~~~~~~~~~~~~~~~~
+
+This module provides a positional inverted index over the original texts
+(combined corpora, speeches and programmes) and a keyword-in-context (KWIC)
+search on it, so a surprising TF-IDF word or word2vec neighbour can be
+traced back to the passages it comes from:
+
+term       flüchtlinge         every occurrence of the word
+prefix     flücht*             every word that starts with "flücht"
+phrase     soziale marktwirtschaft   the words directly one after another
+proximity  --near 5 euro krise     all words within 5 words of the first one
+
+Every hit is shown with its context, party, speaker and file. The words are
+the lowercased surface forms of the texts, not the lemmas.
+
+The index consists of segments. An update writes the new and changed files
+as a new segment, the replaced documents of the older segments are only
+marked as deleted. As soon as there are too many small segments they are
+merged, a segment with too many deleted documents is rewritten. A segment
+holds at most about SEGMENT_BYTES of text, so building it needs bounded
+memory no matter how large the corpus grows. A segment is a folder
+of .npy files that are loaded with mmap, so opening the index and answering
+a query only reads the pages of the terms that are looked up:
+
+<segment>/terms.npy, term_offsets.npy        sorted terms (utf-8) and their offsets
+<segment>/postings.npy, posting_offsets.npy  compressed posting list of every term
+<segment>/texts.npy, text_offsets.npy        utf-8 text of every document (snippets)
+<segment>/starts.npy, token_offsets.npy      byte offset of every token in its text, first token of every document
+meta.json                                    documents (party, kind, speaker, file, ...) and segments
+
+A posting list is one sequence of varints (7 bits per byte): number of
+documents, document gaps, frequency per document and position gaps (which
+start again in every document). Encoding and decoding are vectorized.
+"""
+
+import argparse
+from bisect import bisect_left
+import json
+import os
+from os.path import join
+import re
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from corpus_store import file_signature, read_text
+from instrumentation import stage
+from time_slices import parse_speech_name
+
+# Default location of the index, relative to the working directory of the scripts
+INDEX_DIR = join("cache", "kwic_index")
+# Increase this number whenever the layout of the index changes
+INDEX_VERSION = 1
+# Subfolders of a party whose texts are indexed
+INDEX_SUBFOLDERS = ["Combined", "Parteiprogramm", "Reden"]
+# Text (utf-8 bytes) of one segment, bounds the memory that is needed to build it
+SEGMENT_BYTES = 16 * 1024 * 1024
+# Segments below half of SEGMENT_BYTES are merged when there are more of them,
+# a segment is rewritten when more than MAX_DELETED of its documents are deleted
+MAX_SEGMENTS = 8
+MAX_DELETED = 0.5
+# Words of context left and right of a hit
+CONTEXT_WORDS = 8
+TOKEN = re.compile(r"\w+")
+QUERY_TOKEN = re.compile(r"\w+\*?")
+
+
+def varint_lengths(values: np.ndarray)->np.ndarray:
+    """
+    varint_lengths is a function that returns the number of bytes of every
+    value as varint (7 bits per byte, values below 2^35).
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        lengths += values >= np.uint64(1 << shift)
+    return lengths
+
+
+def encode_varints(values: np.ndarray)->np.ndarray:
+    """
+    encode_varints is a function that encodes the values as varints: the
+    lowest 7 bits first, the highest bit of a byte is set if another byte follows.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = varint_lengths(values)
+    owner = np.repeat(np.arange(len(values)), lengths)
+    byte = np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    encoded = ((values[owner] >> (np.uint64(7) * byte.astype(np.uint64))) & np.uint64(0x7F)).astype(np.uint8)
+    encoded[byte < lengths[owner] - 1] |= 0x80
+    return encoded
+
+
+def decode_varints(data: np.ndarray)->np.ndarray:
+    """
+    decode_varints is a function that decodes a sequence of varints (see encode_varints).
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    byte = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.uint64) << (np.uint64(7) * byte.astype(np.uint64))
+    return np.add.reduceat(parts, starts)
+
+
+def tokenize(text: str)->Tuple[List[str], np.ndarray]:
+    """
+    tokenize is a function that returns the lowercased words of a text and
+    their byte offsets inside the utf-8 encoded text.
+    """
+    matches = list(TOKEN.finditer(text))
+    chars = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    char_bytes = 1 + (chars >= 0x80).astype(np.int64) + (chars >= 0x800) + (chars >= 0x10000)
+    byte_offsets = np.concatenate([[0], np.cumsum(char_bytes)])
+    char_starts = np.fromiter((match.start() for match in matches), dtype=np.int64, count=len(matches))
+    return [match.group().lower() for match in matches], byte_offsets[char_starts]
+
+
+def find_texts(data_dir: str = "data")->List[dict]:
+    """
+    find_texts is a function that returns every text that is indexed, with
+    its name ('AfD/Reden/Weidel_Generaldebatte_2025'), party, kind
+    (subfolder), speaker (speeches only) and file.
+    """
+    texts = []
+    for partei in sorted(os.listdir(data_dir)):
+        if partei == "raw_programme" or not os.path.isdir(join(data_dir, partei)):
+            continue
+        for subfolder in INDEX_SUBFOLDERS:
+            dir = join(data_dir, partei, subfolder)
+            if not os.path.isdir(dir):
+                continue
+            for file in sorted(os.listdir(dir)):
+                if not file.endswith(".txt") or "lemmatisiert" in file.lower():
+                    continue
+                parsed = parse_speech_name(file) if subfolder == "Reden" else None
+                texts.append({
+                    "name": f"{partei}/{subfolder}/{os.path.splitext(file)[0]}",
+                    "party": partei,
+                    "kind": subfolder,
+                    "speaker": parsed["speaker"] if parsed else "",
+                    "file": join(dir, file),
+                })
+    return texts
+
+
+class _Terms:
+    """
+    _Terms is the sorted term list of a segment as a sequence, every term is
+    only decoded when bisect looks at it.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self)->int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int)->str:
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+
+def write_segment(segment_dir: str, texts: Sequence[str])->None:
+    """
+    write_segment is a function that builds the positional index of the
+    texts and writes it as a segment. The posting lists of all terms are
+    built at once: the values (header, document gaps, frequencies, position
+    gaps) of all terms are sorted into their order and encoded together.
+    """
+    term_ids: Dict[str, int] = {}
+    ids, starts, token_offsets, encoded_texts = [], [], [0], []
+    for text in texts:
+        terms, text_starts = tokenize(text)
+        ids.append(np.fromiter((term_ids.setdefault(term, len(term_ids)) for term in terms),
+                               dtype=np.int64, count=len(terms)))
+        starts.append(text_starts.astype(np.uint32))
+        token_offsets.append(token_offsets[-1] + len(terms))
+        encoded = text.encode("utf-8")
+        encoded_texts.append(encoded)
+    ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    token_offsets = np.array(token_offsets, dtype=np.int64)
+    lengths = np.diff(token_offsets)
+
+    # term ids in alphabetical order, so a term is found by binary search
+    vocab = sorted(term_ids)
+    rank = np.empty(len(vocab), dtype=np.int64)
+    rank[np.fromiter((term_ids[term] for term in vocab), dtype=np.int64, count=len(vocab))] = np.arange(len(vocab))
+    order = np.argsort(rank[ids], kind="stable")
+    terms = rank[ids][order]
+    docs = np.repeat(np.arange(len(texts)), lengths)[order]
+    positions = (np.arange(len(ids)) - np.repeat(token_offsets[:-1], lengths))[order]
+
+    # one entry per (term, document) pair, one per occurrence
+    pair_start = np.flatnonzero(np.concatenate([[True], (terms[1:] != terms[:-1]) | (docs[1:] != docs[:-1])])) \
+        if len(terms) else np.zeros(0, dtype=np.int64)
+    pair_terms, pair_docs = terms[pair_start], docs[pair_start]
+    frequencies = np.diff(np.concatenate([pair_start, [len(terms)]]))
+    first_pair = np.concatenate([[True], pair_terms[1:] != pair_terms[:-1]]) if len(pair_terms) else pair_terms
+    doc_gaps = np.where(first_pair, pair_docs, pair_docs - np.concatenate([[0], pair_docs[:-1]]))
+    first_occurrence = np.zeros(len(terms), dtype=bool)
+    first_occurrence[pair_start] = True
+    position_gaps = np.where(first_occurrence, positions, positions - np.concatenate([[0], positions[:-1]]))
+    n_docs = np.bincount(pair_terms, minlength=len(vocab))
+
+    # values of all posting lists, ordered by (term, section, entry)
+    value_terms = np.concatenate([np.arange(len(vocab)), pair_terms, pair_terms, terms])
+    sections = np.repeat([0, 1, 2, 3], [len(vocab), len(pair_terms), len(pair_terms), len(terms)])
+    entries = np.concatenate([np.zeros(len(vocab), dtype=np.int64), np.arange(len(pair_terms)),
+                              np.arange(len(pair_terms)), np.arange(len(terms))])
+    values = np.concatenate([n_docs, doc_gaps, frequencies, position_gaps])
+    order = np.lexsort((entries, sections, value_terms))
+    values, value_terms = values[order], value_terms[order]
+    term_bytes = np.bincount(value_terms, weights=varint_lengths(values), minlength=len(vocab)).astype(np.int64)
+
+    encoded_terms = [term.encode("utf-8") for term in vocab]
+    os.makedirs(segment_dir, exist_ok=True)
+    np.save(join(segment_dir, "terms.npy"), np.frombuffer(b"".join(encoded_terms), dtype=np.uint8))
+    np.save(join(segment_dir, "term_offsets.npy"),
+            np.concatenate([[0], np.cumsum([len(term) for term in encoded_terms], dtype=np.int64)]))
+    np.save(join(segment_dir, "postings.npy"), encode_varints(values))
+    np.save(join(segment_dir, "posting_offsets.npy"), np.concatenate([[0], np.cumsum(term_bytes)]))
+    np.save(join(segment_dir, "texts.npy"), np.frombuffer(b"".join(encoded_texts), dtype=np.uint8))
+    np.save(join(segment_dir, "text_offsets.npy"),
+            np.concatenate([[0], np.cumsum([len(text) for text in encoded_texts], dtype=np.int64)]))
+    np.save(join(segment_dir, "starts.npy"), np.concatenate(starts) if starts else np.zeros(0, dtype=np.uint32))
+    np.save(join(segment_dir, "token_offsets.npy"), token_offsets)
+
+
+class Segment:
+    """
+    Segment is one part of the index, all arrays are memory-mapped.
+    """
+
+    def __init__(self, segment_dir: str):
+        def load(name: str)->np.ndarray:
+            return np.load(join(segment_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.dir = segment_dir
+        self.terms = _Terms(load("terms"), load("term_offsets"))
+        self.postings = load("postings")
+        self.posting_offsets = load("posting_offsets")
+        self.texts = load("texts")
+        self.text_offsets = load("text_offsets")
+        self.starts = load("starts")
+        self.token_offsets = load("token_offsets")
+
+    def __len__(self)->int:
+        return len(self.token_offsets) - 1
+
+    def term_range(self, word: str)->Tuple[int, int]:
+        """
+        term_range returns the range of term ids of a word, or of all words
+        with a prefix if the word ends with '*'.
+        """
+        if word.endswith("*"):
+            prefix = word[:-1]
+            return bisect_left(self.terms, prefix), bisect_left(self.terms, prefix + "\U0010FFFF")
+        first = bisect_left(self.terms, word)
+        return first, first + int(first < len(self.terms) and self.terms[first] == word)
+
+    def occurrences(self, word: str)->Tuple[np.ndarray, np.ndarray]:
+        """
+        occurrences returns document and position of every occurrence of a
+        word (or prefix), sorted by document and position.
+        """
+        docs, positions = [], []
+        first, last = self.term_range(word)
+        for term in range(first, last):
+            values = decode_varints(self.postings[self.posting_offsets[term]:self.posting_offsets[term + 1]])
+            n = int(values[0])
+            frequencies = values[1 + n:1 + 2 * n].astype(np.int64)
+            gaps = values[1 + 2 * n:].astype(np.int64)
+            # positions are gaps inside a document: cumulative sum, minus the sum before the document
+            cumulative = np.cumsum(gaps)
+            doc_first = np.cumsum(frequencies) - frequencies
+            docs.append(np.repeat(np.cumsum(values[1:1 + n].astype(np.int64)), frequencies))
+            positions.append(cumulative - np.repeat(cumulative[doc_first] - gaps[doc_first], frequencies))
+        if not docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        docs, positions = np.concatenate(docs), np.concatenate(positions)
+        if last - first > 1:
+            order = np.lexsort((positions, docs))
+            docs, positions = docs[order], positions[order]
+        return docs, positions
+
+    def snippet(self, doc: int, first: int, last: int, context: int = CONTEXT_WORDS)->Tuple[str, str, str]:
+        """
+        snippet returns the text left of, between and right of the words
+        first to last (positions) of a document, with context words on each
+        side. Only the start of every word is stored, the ends are found by
+        tokenizing the snippet again.
+        """
+        base, n_tokens = int(self.token_offsets[doc]), int(self.token_offsets[doc + 1] - self.token_offsets[doc])
+        text_start, text_end = int(self.text_offsets[doc]), int(self.text_offsets[doc + 1])
+        left, right = max(0, first - context), min(n_tokens - 1, last + context)
+
+        def offset(token: int)->int:
+            return text_start + int(self.starts[base + token]) if token < n_tokens else text_end
+
+        def text(start: int, stop: int)->str:
+            return bytes(self.texts[start:stop]).decode("utf-8", errors="replace")
+
+        rest = text(offset(first), offset(right + 1))
+        ends = [match.end() for match in TOKEN.finditer(rest)]
+        match_end, right_end = ends[last - first], ends[right - first]
+        return (" ".join(text(offset(left), offset(first)).split()),
+                " ".join(rest[:match_end].split()),
+                " ".join(rest[match_end:right_end].split()))
+
+    def document_text(self, doc: int)->str:
+        return bytes(self.texts[self.text_offsets[doc]:self.text_offsets[doc + 1]]).decode("utf-8")
+
+
+def match_query(segment: Segment, words: List[str], near: Optional[int],
+                allowed: np.ndarray)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    match_query is a function that returns document, first and last position
+    of every hit of the words in a segment: a single word, a phrase (near is
+    None) or all words within near words of the first one. Only documents
+    with allowed[doc] are searched.
+    """
+    keys = []
+    for word in words:
+        docs, positions = segment.occurrences(word)
+        keep = allowed[docs]
+        # document and position as one sortable key
+        keys.append((docs[keep] << 32) | positions[keep])
+    hits = keys[0]
+    if near is None:
+        for offset, word_keys in enumerate(keys[1:], start=1):
+            hits = np.intersect1d(hits, word_keys - offset)
+        first = hits & 0xFFFFFFFF
+        return hits >> 32, first, first + len(words) - 1
+    first = last = hits & 0xFFFFFFFF
+    for word_keys in keys[1:]:
+        if len(word_keys) == 0:
+            return hits[:0] >> 32, first[:0], last[:0]
+        # the first occurrence from near words before the hit on, in the same document
+        i = np.searchsorted(word_keys, hits - near)
+        candidates = word_keys[np.minimum(i, len(word_keys) - 1)]
+        found = (i < len(word_keys)) & (candidates >> 32 == hits >> 32) & (candidates <= hits + near)
+        hits, first, last, candidates = hits[found], first[found], last[found], candidates[found]
+        first = np.minimum(first, candidates & 0xFFFFFFFF)
+        last = np.maximum(last, candidates & 0xFFFFFFFF)
+    return hits >> 32, first, last
+
+
+class KwicIndex:
+    """
+    KwicIndex is the positional index of all texts, made of segments.
+    * documents: metadata (party, kind, speaker, file, size, mtime) of every
+      document by name, with its segment and its number inside the segment
+    * segments: names of the segments and the document names inside them
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.dir = index_dir
+        self.documents: Dict[str, dict] = {}
+        self.segments: List[dict] = []
+        self.next_segment = 0
+        self._open: Dict[str, Segment] = {}
+        try:
+            with open(join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") == INDEX_VERSION:
+                self.documents, self.segments, self.next_segment = \
+                    meta["documents"], meta["segments"], meta["next_segment"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def __len__(self)->int:
+        return len(self.documents)
+
+    def segment(self, name: str)->Segment:
+        if name not in self._open:
+            self._open[name] = Segment(join(self.dir, name))
+        return self._open[name]
+
+    def save(self)->None:
+        os.makedirs(self.dir, exist_ok=True)
+        meta = {"version": INDEX_VERSION, "next_segment": self.next_segment,
+                "segments": self.segments, "documents": self.documents}
+        tmp_path = join(self.dir, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp_path, join(self.dir, "meta.json"))
+        # segments without any live document are removed after the new meta data is written
+        live = {segment["name"] for segment in self.segments}
+        for name in os.listdir(self.dir):
+            if name.startswith("segment_") and name not in live:
+                shutil.rmtree(join(self.dir, name), ignore_errors=True)
+                self._open.pop(name, None)
+
+    def add_segment(self, documents: Sequence[dict], texts: Sequence[str])->None:
+        """
+        add_segment writes the texts as a new segment, documents that were
+        indexed before now point to the new segment.
+        """
+        name = f"segment_{self.next_segment:05d}"
+        self.next_segment += 1
+        write_segment(join(self.dir, name), texts)
+        self.segments.append({"name": name, "documents": [document["name"] for document in documents],
+                              "bytes": sum(len(text.encode("utf-8")) for text in texts)})
+        for doc, document in enumerate(documents):
+            self.documents[document["name"]] = {**document, "segment": name, "doc": doc}
+
+    def add_documents(self, documents: Sequence[dict], texts: Sequence[str])->None:
+        """
+        add_documents writes the texts as new segments of at most about
+        SEGMENT_BYTES of text each.
+        """
+        first, size = 0, 0
+        for i, text in enumerate(texts):
+            size += len(text.encode("utf-8"))
+            if size >= SEGMENT_BYTES or i == len(texts) - 1:
+                self.add_segment(documents[first:i + 1], texts[first:i + 1])
+                first, size = i + 1, 0
+
+    def live_documents(self, segment: dict)->np.ndarray:
+        """
+        live_documents returns, for every document of a segment, whether it
+        is still indexed in this segment (and not replaced or removed).
+        """
+        return np.array([self.documents.get(name, {}).get("segment") == segment["name"]
+                         for name in segment["documents"]], dtype=bool)
+
+    def merge(self)->None:
+        """
+        merge rewrites the live documents of the segments that have more than
+        MAX_DELETED deleted documents, and of all small segments once there
+        are more than MAX_SEGMENTS of them.
+        """
+        small = [segment for segment in self.segments if segment["bytes"] < SEGMENT_BYTES // 2]
+        merged = [segment for segment in self.segments
+                  if (len(small) > MAX_SEGMENTS and segment in small)
+                  or 1.0 - self.live_documents(segment).mean() > MAX_DELETED]
+        if not merged:
+            return
+        documents, texts = [], []
+        for segment in merged:
+            for doc, live in enumerate(self.live_documents(segment)):
+                if live:
+                    name = segment["documents"][doc]
+                    documents.append({key: value for key, value in self.documents[name].items()
+                                      if key not in ("segment", "doc")})
+                    texts.append(self.segment(segment["name"]).document_text(doc))
+        self.segments = [segment for segment in self.segments if segment not in merged]
+        if documents:
+            self.add_documents(documents, texts)
+
+    def sync(self, data_dir: str = "data")->Tuple[List[str], List[str]]:
+        """
+        sync brings the index up to date with the texts inside data_dir: new
+        and changed texts are written as a new segment, removed texts are
+        dropped. Returns (updated, removed) names.
+        """
+        files = {text["name"]: text for text in find_texts(data_dir)}
+        removed = [name for name in self.documents if name not in files]
+        for name in removed:
+            del self.documents[name]
+
+        updated, texts = [], []
+        for name, text in files.items():
+            size, mtime_ns = file_signature(text["file"])
+            known = self.documents.get(name)
+            if known is not None and (known["size"], known["mtime_ns"]) == (size, mtime_ns):
+                continue
+            updated.append({**text, "size": size, "mtime_ns": mtime_ns})
+            texts.append(read_text(text["file"]))
+        if updated:
+            self.add_documents(updated, texts)
+        self.segments = [segment for segment in self.segments if self.live_documents(segment).any()]
+        self.merge()
+        return [document["name"] for document in updated], removed
+
+    def search(self, query: str, near: Optional[int] = None, kinds: Optional[Sequence[str]] = None,
+               parties: Optional[Sequence[str]] = None, limit: Optional[int] = None,
+               context: int = CONTEXT_WORDS)->Tuple[int, List[dict]]:
+        """
+        search returns the number of hits of a query and the first limit hits
+        (default: all) with metadata and context (left, match, right). The
+        words of the query are a phrase, or with near all have to occur
+        within near words of the first one. A word ending with '*' is a prefix.
+        """
+        words = QUERY_TOKEN.findall(query.lower())
+        if not words:
+            return 0, []
+        total, hits = 0, []
+        for segment in self.segments:
+            names = segment["documents"]
+            allowed = self.live_documents(segment)
+            for doc, name in enumerate(names):
+                if allowed[doc]:
+                    document = self.documents[name]
+                    allowed[doc] = (kinds is None or document["kind"] in kinds) and \
+                                   (parties is None or document["party"] in parties)
+            if not allowed.any():
+                continue
+            index_segment = self.segment(segment["name"])
+            docs, first, last = match_query(index_segment, words, near, allowed)
+            total += len(docs)
+            for doc, start, end in zip(docs, first, last):
+                if limit is not None and len(hits) >= limit:
+                    break
+                document = self.documents[names[doc]]
+                left, match, right = index_segment.snippet(int(doc), int(start), int(end), context)
+                hits.append({"name": names[doc], "party": document["party"], "kind": document["kind"],
+                             "speaker": document["speaker"], "file": document["file"],
+                             "position": int(start), "left": left, "match": match, "right": right})
+        return total, hits
+
+
+def load_index(data_dir: str = "data", index_dir: str = INDEX_DIR)->KwicIndex:
+    """
+    load_index is a function that loads the index, synchronizes it with the
+    texts inside data_dir and saves it again if anything changed.
+    """
+    with stage("kwic_index", unit="Dokumente") as record:
+        index = KwicIndex(index_dir)
+        segments = [segment["name"] for segment in index.segments]
+        updated, removed = index.sync(data_dir)
+        record.count(len(updated))
+    print(f"KWIC-Index: {len(index)} Dokumente in {len(index.segments)} Segment(en), "
+          f"{len(updated)} neu/geändert, {len(removed)} entfernt")
+    if updated or removed or segments != [segment["name"] for segment in index.segments]:
+        index.save()
+    return index
+
+
+def format_hit(hit: dict, width: int = 60)->str:
+    """
+    format_hit is a function that returns a hit as one KWIC line: the left
+    context right-aligned, the match and the right context, followed by
+    party, speaker and file.
+    """
+    left = hit["left"][-width:].rjust(width)
+    right = hit["right"][:width].ljust(width)
+    source = " | ".join(part for part in (hit["party"], hit["speaker"], os.path.basename(hit["file"])) if part)
+    return f"{left} [{hit['match']}] {right}  ({source})"
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Keyword-in-context search over the combined corpora, "
+                                                     "speeches and programmes.")
+    arg_parser.add_argument("query", nargs="*",
+                            help="word, prefix (flücht*) or phrase; without a query the index is only updated")
+    arg_parser.add_argument("--near", type=int, metavar="N",
+                            help="proximity query: all words within N words of the first one, in any order")
+    arg_parser.add_argument("--kinds", nargs="+", choices=INDEX_SUBFOLDERS, default=["Parteiprogramm", "Reden"],
+                            help="texts to search (the combined corpora repeat the programmes and speeches)")
+    arg_parser.add_argument("--party", nargs="+", help="only search the texts of these parties")
+    arg_parser.add_argument("--limit", type=int, default=20, help="hits that are shown")
+    arg_parser.add_argument("--context", type=int, default=CONTEXT_WORDS, help="words of context on each side")
+    args = arg_parser.parse_args()
+
+    index = load_index("data/")
+    if args.query:
+        query = " ".join(args.query)
+        with stage("kwic_query", unit="Treffer", query=query) as record:
+            total, hits = index.search(query, near=args.near, kinds=args.kinds, parties=args.party,
+                                       limit=args.limit, context=args.context)
+            record.count(total)
+        print(f"\n{total} Treffer für '{query}' in {record.seconds * 1000:.1f} ms"
+              + (f" (die ersten {len(hits)})" if len(hits) < total else "") + "\n")
+        for hit in hits:
+            print(format_hit(hit))
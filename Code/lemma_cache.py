@@ -0,0 +1,124 @@
+"""
+lemma_cache
+~~~~~~~~~~~~~~~~~
+
+This module provides a persistent lemma cache on disk (SQLite), keyed by the
+spaCy model and the surface form of a token. Most tokens of the speeches and
+programmes repeat many times, so the lemmatization stage looks the tokens up
+here first and only sends paragraphs with unknown tokens through the spaCy
+pipeline.
+
+The lookup happens before the pipeline runs, so there is no part-of-speech
+tag to key it on. spaCy's lemmas depend on the context, one form can get
+different lemmas in different sentences. The cache therefore counts how
+often every form got every lemma and returns the most frequent one (on a
+tie the alphabetically first), instead of whichever lemma was written last.
+For such forms the cached output can differ from an uncached run
+(bow.py --no-lemma-cache), which lemmatizes every occurrence in its context.
+"""
+
+from collections import defaultdict
+import os
+from os.path import join
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Default location of the cache, relative to the working directory of the scripts
+CACHE_PATH = join("cache", "lemma_cache.sqlite")
+
+
+class LemmaCache:
+    """
+    LemmaCache keeps the lemma counts of one model in memory for fast lookups
+    and writes the new counts back to the SQLite file on flush (or close).
+    Hits and misses are counted per looked up paragraph and per token. A
+    paragraph with a single unknown token goes through spaCy in full, so all
+    of its tokens count as misses.
+    """
+
+    def __init__(self, model: str, path: str = CACHE_PATH):
+        self.model = model
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            # the old layout kept only the last lemma of every form
+            self.connection.execute("DROP TABLE IF EXISTS lemmas")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS lemma_counts ("
+                "model TEXT NOT NULL, form TEXT NOT NULL, lemma TEXT NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (model, form, lemma))"
+            )
+        self.counts: Dict[str, Dict[str, int]] = defaultdict(dict)
+        rows = self.connection.execute("SELECT form, lemma, count FROM lemma_counts WHERE model = ?", (model,))
+        for form, lemma, count in rows:
+            self.counts[form][lemma] = count
+        self.lemmas: Dict[str, str] = {form: self._most_frequent(form) for form in self.counts}
+        self.new_counts: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.paragraph_hits = 0
+        self.paragraph_misses = 0
+
+    def __len__(self)->int:
+        return len(self.lemmas)
+
+    def __enter__(self)->'LemmaCache':
+        return self
+
+    def __exit__(self, *exc)->None:
+        self.close()
+
+    def _most_frequent(self, form: str)->str:
+        return min(self.counts[form].items(), key=lambda item: (-item[1], item[0]))[0]
+
+    def lookup(self, forms: Iterable[str])->Optional[List[str]]:
+        """
+        lookup returns the most frequent lemma of all given forms, or None if
+        at least one of them is not cached yet.
+        """
+        lemmas = [self.lemmas.get(form) for form in forms]
+        if None in lemmas:
+            self.misses += len(lemmas)
+            self.paragraph_misses += 1
+            return None
+        self.hits += len(lemmas)
+        self.paragraph_hits += 1
+        return lemmas
+
+    def add(self, form: str, lemma: str)->None:
+        """
+        add counts one occurrence of a surface form with the given lemma.
+        """
+        counts = self.counts[form]
+        counts[lemma] = counts.get(lemma, 0) + 1
+        self.new_counts[(form, lemma)] += 1
+        self.lemmas[form] = self._most_frequent(form)
+
+    def hit_rate(self)->float:
+        """
+        hit_rate returns the share of looked up tokens that were served from
+        the cache, i.e. that did not go through spaCy.
+        """
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def flush(self)->None:
+        """
+        flush adds all new counts to the SQLite file.
+        """
+        if self.new_counts:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO lemma_counts (model, form, lemma, count) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (model, form, lemma) DO UPDATE SET count = count + excluded.count",
+                    ((self.model, form, lemma, count) for (form, lemma), count in self.new_counts.items()),
+                )
+            self.new_counts = defaultdict(int)
+
+    def close(self)->None:
+        """
+        close flushes the new counts and closes the SQLite file.
+        """
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,165 @@
+"""
+lemmatize
+~~~~~~~~~~~~~~~~~
+
+This module provides the lemmatization stage of the BoW script. The texts
+(e.g. of every party or every single document) are split into paragraphs, the stop words and special characters
+are removed and the paragraphs are streamed in batches through spaCy's
+nlp.pipe, optionally spread over several processes. Only the pipeline
+components that the lemmatizer needs are kept enabled, and paragraphs whose
+tokens are all known to the lemma cache don't go through spaCy at all.
+"""
+
+import re
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import spacy
+from spacy.tokens import Doc
+from nltk.tokenize import word_tokenize
+
+from instrumentation import stage, StageRecord
+from lemma_cache import LemmaCache
+
+# Everything that is not a (german) letter is removed before lemmatization
+NON_LETTERS = re.compile(r"[^a-zA-ZäöüÄÖÜß]")
+
+
+def required_components(nlp: 'spacy.language.Language')->Set[str]:
+    """
+    required_components is a function that returns the names of the pipeline
+    components the lemmatizer depends on. A rule based lemmatizer needs the
+    part-of-speech tags, lookup and trainable lemmatizers only need their own
+    component and the shared tok2vec layer.
+    """
+    needed = {"tok2vec", "lemmatizer"}
+    if "lemmatizer" in nlp.pipe_names and getattr(nlp.get_pipe("lemmatizer"), "mode", None) == "rule":
+        needed |= {"tagger", "morphologizer", "attribute_ruler"}
+    return needed
+
+
+def load_lemmatizer(model: str = "de_core_news_lg")->'spacy.language.Language':
+    """
+    load_lemmatizer is a function that loads the given spaCy model with all
+    components disabled that are not needed for lemmatization.
+    """
+    nlp = spacy.load(model)
+    for name in set(nlp.pipe_names) - required_components(nlp):
+        nlp.disable_pipe(name)
+    return nlp
+
+
+def preprocess(paragraph: str, stop_words: Set[str])->str:
+    """
+    preprocess is a function that tokenizes a paragraph, removes the stop
+    words and replaces all special characters, numbers etc. by a space.
+    """
+    # Tokenize
+    words = word_tokenize(paragraph)
+    # Remove stop words from the sentence and join the words back into a sentence
+    s = " ".join(word for word in words if word.lower() not in stop_words)
+    # Remove all special characters, numbers etc. with RegEx
+    return NON_LETTERS.sub(' ', s)
+
+
+def iter_paragraphs(corpus: Dict[str, str], stop_words: Set[str])->Iterator[Tuple[str, str]]:
+    """
+    iter_paragraphs is a generator that yields (preprocessed paragraph, name)
+    for every non empty line of every text, in the order of the corpus.
+    """
+    for name, text in corpus.items():
+        for line in text.splitlines():
+            paragraph = preprocess(line, stop_words)
+            if paragraph.strip():
+                yield paragraph, name
+
+
+def lemmatize_corpus(nlp: 'spacy.language.Language', corpus: Dict[str, str], stop_words: Set[str],
+                     batch_size: int = 256, n_process: int = 1,
+                     cache: 'Optional[LemmaCache]' = None)->Iterator[Tuple[str, List[str]]]:
+    """
+    lemmatize_corpus is a generator that lemmatizes all texts of the corpus
+    (name -> text) in one stream and yields (name, lemmas) for every paragraph.
+    The paragraphs keep their order, so the lemmas of a text can be written
+    to its file as they arrive. The throughput is printed at the end.
+    If a lemma cache is given, every paragraph is only tokenized and looked
+    up first, a cached form gets its most frequent lemma (see lemma_cache).
+    Paragraphs with unknown tokens are sent through the pipeline and their
+    lemmas are counted in the cache. Cached paragraphs are yielded right away
+    while no piped paragraph before them is still outstanding.
+    """
+    with stage("lemmatization", unit="Tokens", n_process=n_process, batch_size=batch_size) as record:
+        yield from _lemmatize_corpus(nlp, corpus, stop_words, batch_size, n_process, cache, record)
+
+
+def _lemmatize_corpus(nlp: 'spacy.language.Language', corpus: Dict[str, str], stop_words: Set[str],
+                      batch_size: int, n_process: int, cache: 'Optional[LemmaCache]',
+                      record: StageRecord)->Iterator[Tuple[str, List[str]]]:
+    n_piped = 0
+    start = time.perf_counter()
+    paragraphs = enumerate(iter_paragraphs(corpus, stop_words))
+    # lemmas of cached paragraphs that wait for earlier paragraphs from the pipeline
+    pending: Dict[int, Tuple[str, List[str]]] = {}
+
+    def lookup(doc: Doc)->Optional[List[str]]:
+        return None if cache is None else cache.lookup(token.text for token in doc if not token.is_space)
+
+    def cache_misses(first: Tuple[Doc, Tuple[int, str]])->Iterator[Tuple[Doc, Tuple[int, str]]]:
+        # feeds the pipeline from the shared paragraph stream, until batch_size
+        # cached paragraphs in a row show that the misses have run out for now
+        nonlocal n_piped
+        n_piped += 1
+        yield first
+        cached_in_a_row = 0
+        for seq, (paragraph, name) in paragraphs:
+            doc = nlp.make_doc(paragraph)
+            lemmas = lookup(doc)
+            if lemmas is None:
+                n_piped += 1
+                cached_in_a_row = 0
+                yield doc, (seq, name)
+            else:
+                pending[seq] = (name, lemmas)
+                cached_in_a_row += 1
+                if cached_in_a_row >= batch_size:
+                    return
+
+    next_seq = 0
+    for seq, (paragraph, name) in paragraphs:
+        doc = nlp.make_doc(paragraph)
+        lemmas = lookup(doc)
+        if lemmas is not None:
+            # no piped paragraph is outstanding, so a cached one is yielded right away
+            record.count(len(lemmas))
+            next_seq = seq + 1
+            yield name, lemmas
+            continue
+        docs = nlp.pipe(cache_misses((doc, (seq, name))), as_tuples=True,
+                        batch_size=batch_size, n_process=n_process)
+        for doc, (piped_seq, piped_name) in docs:
+            tokens = [token for token in doc if not token.is_space]
+            if cache is not None:
+                for token in tokens:
+                    cache.add(token.text, token.lemma_)
+            pending[piped_seq] = (piped_name, [token.lemma_ for token in tokens])
+            # yield all paragraphs up to the current one in their original order
+            while next_seq in pending:
+                pending_name, pending_lemmas = pending.pop(next_seq)
+                record.count(len(pending_lemmas))
+                next_seq += 1
+                yield pending_name, pending_lemmas
+        # the cached paragraphs after the last piped one
+        while next_seq in pending:
+            pending_name, pending_lemmas = pending.pop(next_seq)
+            record.count(len(pending_lemmas))
+            next_seq += 1
+            yield pending_name, pending_lemmas
+
+    duration = time.perf_counter() - start
+    print(f"{record.items} Tokens lemmatisiert in {duration:.1f}s "
+          f"({record.items / max(duration, 1e-9):.0f} Tokens/s, {n_process} Prozesse, batch_size={batch_size})")
+    if cache is not None:
+        cache.flush()
+        print(f"Lemma-Cache: {cache.hit_rate():.1%} Treffer ({cache.hits} von {cache.hits + cache.misses} Tokens, "
+              f"{cache.paragraph_hits} von {cache.paragraph_hits + cache.paragraph_misses} Absätzen "
+              f"ohne spaCy), {n_piped} Absätze durch spaCy")
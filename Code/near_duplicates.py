@@ -0,0 +1,166 @@
+"""
+near_duplicates
+~~~~~~~~~~~~~~~~~
+
+This module provides a near-duplicate detector for boilerplate paragraphs:
+running headers and footers, page numbers, table of contents lines or
+applause notes that are repeated with small differences (another page
+number, a hyphenation, another party in "(Beifall bei der ...)").
+
+Every paragraph is normalized to its lower case letters (digits, spaces and
+punctuation are dropped) and split into character shingles. A MinHash
+signature estimates the Jaccard similarity of two shingle sets, and
+locality sensitive hashing (LSH) puts the signatures into buckets band by
+band, so only paragraphs that share a bucket are compared. The whole run is
+roughly linear in the number of paragraphs. Paragraphs whose group of near
+duplicates (similarity >= threshold) has at least min_count members are
+boilerplate, within a document or across documents.
+"""
+
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Default similarity threshold (estimated Jaccard similarity of the shingles)
+NEAR_DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+NON_LETTERS = re.compile(r"[^a-zäöüß]+")
+
+
+def normalize(paragraph: str)->str:
+    """
+    normalize is a function that keeps only the lower case letters of a
+    paragraph, so page numbers, spacing and hyphenation don't matter.
+    """
+    return NON_LETTERS.sub("", paragraph.lower())
+
+
+def shingle_hashes(paragraph: str, k: int = SHINGLE_SIZE)->np.ndarray:
+    """
+    shingle_hashes is a function that returns the 32 bit hashes of all
+    character k-shingles of the normalized paragraph (a short paragraph is
+    one shingle).
+    """
+    text = normalize(paragraph)
+    if not text:
+        return np.zeros(0, dtype=np.uint64)
+    shingles = {text[i:i + k] for i in range(max(len(text) - k + 1, 1))}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def lsh_parameters(threshold: float, num_perm: int)->Tuple[int, int]:
+    """
+    lsh_parameters is a function that returns (bands, rows) with
+    bands * rows <= num_perm whose S-curve (1 / bands) ** (1 / rows) is
+    closest to the threshold.
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashLSH:
+    """
+    MinHashLSH collects the MinHash signatures of paragraphs and groups the
+    paragraphs whose estimated similarity is at least the threshold.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD, num_perm: int = NUM_PERM,
+                 shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # multiply-shift hashing: the upper 32 bits of a * x + b (mod 2 ** 64), a odd
+        self.a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2)
+        self.bands, self.rows = lsh_parameters(threshold, num_perm)
+        self.buckets: List[Dict[bytes, int]] = [{} for _ in range(self.bands)]
+        self.signatures: List[Optional[np.ndarray]] = []
+        self.parent: List[int] = []
+
+    def signature(self, paragraph: str)->Optional[np.ndarray]:
+        """
+        signature returns the MinHash signature of a paragraph, or None if it has no letters.
+        """
+        hashes = shingle_hashes(paragraph, self.shingle_size)
+        if len(hashes) == 0:
+            return None
+        # uint64 arrays wrap around on overflow
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) >> np.uint64(32)
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _find(self, i: int)->int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def add(self, paragraph: str)->int:
+        """
+        add adds a paragraph and returns its index. In every band it is
+        only compared with the first paragraph of its bucket, which keeps
+        the work per paragraph constant even for very frequent boilerplate.
+        """
+        idx = len(self.signatures)
+        signature = self.signature(paragraph)
+        self.signatures.append(signature)
+        self.parent.append(idx)
+        if signature is None:
+            return idx
+        for band, buckets in enumerate(self.buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            first = buckets.setdefault(key, idx)
+            if first != idx and np.mean(self.signatures[first] == signature) >= self.threshold:
+                root, other = self._find(idx), self._find(first)
+                if root != other:
+                    self.parent[max(root, other)] = min(root, other)
+        return idx
+
+    def groups(self)->np.ndarray:
+        """
+        groups returns the group (index of its first member) of every paragraph.
+        """
+        return np.array([self._find(i) for i in range(len(self.parent))], dtype=np.int64)
+
+    def duplicates(self, min_count: int = 2)->np.ndarray:
+        """
+        duplicates returns a boolean mask of the paragraphs whose group has
+        at least min_count members.
+        """
+        groups = self.groups()
+        if len(groups) == 0:
+            return np.zeros(0, dtype=bool)
+        sizes = np.bincount(groups, minlength=len(groups))
+        return sizes[groups] >= min_count
+
+
+def near_duplicate_mask(paragraphs: Iterable[str], threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                        min_count: int = 2)->np.ndarray:
+    """
+    near_duplicate_mask is a function that flags every paragraph that has at
+    least min_count - 1 near duplicates among the given paragraphs.
+    """
+    lsh = MinHashLSH(threshold)
+    for paragraph in paragraphs:
+        lsh.add(paragraph)
+    return lsh.duplicates(min_count)
+
+
+def boilerplate_masks(documents: Sequence[Sequence[str]], threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                      min_count: int = 2)->List[np.ndarray]:
+    """
+    boilerplate_masks is a function that flags the near-duplicate paragraphs
+    within and across the documents (lists of paragraphs) and returns one
+    mask per document.
+    """
+    mask = near_duplicate_mask((p for document in documents for p in document), threshold, min_count)
+    offsets = np.cumsum([0] + [len(document) for document in documents])
+    return [mask[offsets[i]:offsets[i + 1]] for i in range(len(documents))]
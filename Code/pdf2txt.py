@@ -13,11 +13,21 @@ way:
 ... and so on
 """
 
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import inspect
 from io import StringIO
+from itertools import chain
+import json
 import os
 from os import listdir
 from os.path import isfile, join
 import re
+import tempfile
+import time
+from typing import Iterable, Iterator
 
 from pdfminer.converter import TextConverter
 from pdfminer.layout import LAParams
@@ -26,6 +36,9 @@ from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfparser import PDFParser
 
+from instrumentation import stage, untrace_worker
+from near_duplicates import NEAR_DUPLICATE_THRESHOLD, MinHashLSH
+
 
 def delete_file(filepath:str)->None:
     """
@@ -57,52 +70,127 @@ def read_file(filepath:str)->str:
     return ''.join(data)
 
 
-def clean_paragraphs(raw_paragraphs: 'list[str]')->str:
+# Increase this number whenever the cleaning rules change in a way that is not
+# visible in the source of the cleaning functions (e.g. a pdfminer update).
+CLEANING_RULES_VERSION = 1
+# Name of the manifest of already converted files inside the pdf folder
+MANIFEST_NAME = "pdf2txt_manifest.json"
+
+# precompiled patterns of the cleaning rules
+NUMBERS_ONLY = re.compile(r'^[0-9\.]+$')
+CLUTTER_SYMBOLS = re.compile(r'[+=<>•|Ώ]')
+NON_STANDARD_SYMBOLS = re.compile(r"[^a-zA-Z0-9\s\n.;:#(){}'`´/\\^-äöüÄÖÜß]")
+
+
+def strip_clutter(paragraph: str)->str:
+    """
+    strip_clutter is a function that removes clutter symbols (+, =, <, >, –, •, |, Ώ),
+    uncommon combinations (-\n, //_) and line breaks inside a paragraph.
+    """
+    return (CLUTTER_SYMBOLS.sub(' ', paragraph)
+            .replace('-\n', '').replace('\n', ' ')
+            # .replace('–', '')#.replace('// ', '')
+            .replace('—', ' ').replace('....', ''))
+
+
+def clean_lines(paragraph: str)->str:
+    """
+    clean_lines is a function that removes all non standard symbols from a
+    paragraph, strips the whitespaces of every line and drops repeated lines.
+    """
+    # remove all non standard symbols
+    paragraph = NON_STANDARD_SYMBOLS.sub(' ', paragraph)
+    # get each line inside a paragraph
+    lines = paragraph.splitlines()
+    line_counts = Counter(lines)
+    # stript whitespaces from every line in paragrpahs and remove repeated sentences
+    return ''.join(" ".join(line.split()) for line in lines if line_counts[line] < 2)
+
+
+def fingerprint(paragraph: str)->bytes:
+    """
+    fingerprint is a function that returns a short hash of a paragraph, so
+    repeated paragraphs can be found without keeping the paragraphs in memory.
+    """
+    return hashlib.blake2b(paragraph.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def iter_clean_paragraphs(raw_paragraphs: 'Iterable[str]',
+                          near_duplicate_threshold: 'float | None' = None)->'Iterator[str]':
+    """
+    iter_clean_paragraphs is a generator for cleaning text paragraphs in a
+    standardized manner, one paragraph at a time.
+    * input: iterable of text paragraphs (e.g. streamed page by page)
+    * output: cleaned, non empty paragraphs in their original order
+    Repeated paragraphs are removed entirely. To find them, the first pass
+    only counts paragraph hashes and spools the paragraphs to a temporary
+    file, the second pass reads them back, so memory stays flat.
+    If near_duplicate_threshold is given, near-duplicate paragraphs (running
+    headers, footers or table of contents lines that only differ by a page
+    number or a hyphenation) are removed as well, see near_duplicates.
+    """
+    counts: 'Counter[bytes]' = Counter()
+    lsh = MinHashLSH(near_duplicate_threshold) if near_duplicate_threshold is not None else None
+
+    with tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogatepass',
+                                newline='\n') as spool:
+        for p in raw_paragraphs:
+            # convert non str elements to a str
+            p = strip_clutter(str(p))
+            counts[fingerprint(p)] += 1
+            if lsh is not None:
+                lsh.add(p)
+            # paragraphs don't contain line breaks anymore, so one per line
+            spool.write(p + '\n')
+
+        boilerplate = lsh.duplicates() if lsh is not None else None
+        spool.seek(0)
+        for idx, line in enumerate(spool):
+            p = line[:-1]
+            # remove paragraphs that only consist of dots and numbers or are repeated
+            if NUMBERS_ONLY.match(p) or counts[fingerprint(p)] > 1:
+                continue
+            if boilerplate is not None and boilerplate[idx]:
+                continue
+            p = clean_lines(p)
+            # remove empty paragraphs (paragraphs with images only will become "\n\n" otherwise)
+            if p:
+                yield p
+
+
+def clean_paragraphs(raw_paragraphs: 'list[str]', near_duplicate_threshold: 'float | None' = None)->str:
     """
     clean_paragraphs is a function for cleaning text files in a standardized
     manner.
-    * input: list of text paragraphs (strings)
+    * input: list of text paragraphs (strings), optionally the similarity
+      threshold above which near-duplicate paragraphs are removed
     * output: single, cleaned string with all paragraphs combined
     """
-    # convert non str elements to a str
-    raw_paragraphs = [str(p) for p in raw_paragraphs]
     # # remove duplicated sentences from the entire text
     # sentences = " ". join(raw_paragraphs).split(".")
     # raw_paragraphs = [sentence for sentence in sentences if sentences.count(sentence) < 2]
     # # delete unnecessary data again
     # del sentences
-    # remove clutter symbols (+, =, <, >, –, •, |, Ώ),
-    # uncommon combinations (-\n, //_)
-    # and line breaks inside a paragraph
-    paragraphs = [
-                    re.sub(r'[+=<>•|Ώ]', ' ', p)
-                    .replace('-\n', '').replace('\n', ' ')
-                    # .replace('–', '')#.replace('// ', '')
-                    .replace('—', ' ').replace('....', '')
-                    for p in raw_paragraphs
-                 ]
-    del raw_paragraphs
-    # remove paragraphs that only consist of dots and numbers or are repeated
-    paragraphs = [p for p in paragraphs if not re.compile(r'^[0-9\.]+$').match(p) and (paragraphs.count(p) < 2)]
-
-    for idx, p in enumerate(paragraphs):
-        # remove all non standard symbols
-        p = re.sub(r"[^a-zA-Z0-9\s\n.;:#(){}'`´/\\^-äöüÄÖÜß]", ' ', p)
-        # get each line inside a paragraph
-        lines = p.splitlines()
-        # stript whitespaces from every line in paragrpahs and remove repeated sentences
-        lines = [" ".join([word for word in line.split()]) for line in lines if (lines.count(line) < 2)]
-        # combine the paragraph to a single string again
-        paragraphs[idx] = ''.join(lines)
-
-    # remove empty paragraphs (paragraphs with images only will become "\n\n" otherwise)
-    paragraphs = [p for p in paragraphs if p]
-    
     # combine all paragraphs, separated by two newlines
-    return '\n\n'.join(paragraphs)
+    return '\n\n'.join(iter_clean_paragraphs(raw_paragraphs, near_duplicate_threshold))
 
 
-def pdf_to_text(pdf_filepath: str, out_path:str)->int:
+def save_paragraphs(filepath: str, paragraphs: 'Iterable[str]')->None:
+    """
+    save_paragraphs is a function that writes paragraphs to a file as soon as
+    they arrive, separated by an empty line. The file is written under a
+    temporary name first, so a failed conversion never leaves half a file.
+    """
+    part_path = filepath + '.part'
+    with open(part_path, 'w', encoding='utf-8') as outstream:
+        for idx, p in enumerate(paragraphs):
+            if idx:
+                outstream.write('\n\n')
+            outstream.write(p)
+    os.replace(part_path, filepath)
+
+
+def pdf_to_text(pdf_filepath: str, out_path:str, near_duplicate_threshold: 'float | None' = None)->int:
     """
     pdf_to_text is a function for converting pdf files to plain text.
     The resulting file will keep the original name and
@@ -110,59 +198,286 @@ def pdf_to_text(pdf_filepath: str, out_path:str)->int:
     The original file can be deleted afterwards.
     """
     try:
-        # extract all paragraphs from the given pdf as a list of strings
-        raw_paragraphs = extract_text_by_paragraph(pdf_filepath)
-        # clean every paragraph and combine all to a single string
-        text = clean_paragraphs(raw_paragraphs)
-        # save the text file in the same directory and with it's original name
-        save_file(filepath=out_path, content=text)
+        # stream the paragraphs of the given pdf page by page
+        raw_paragraphs = iter_page_paragraphs(pdf_filepath)
+        # clean every paragraph and write it to the text file incrementally
+        save_paragraphs(out_path, iter_clean_paragraphs(raw_paragraphs, near_duplicate_threshold))
 
     except Exception as e:
         # catch some unexpected errors
         print(f"|[Error]|: unable to convert pdf {pdf_filepath} with error: {e}")
         return 1
-    
-    finally:
-        return 0
+
+    return 0
 
     
-def extract_text_by_paragraph(pdf_path: str)->'list[str]':
+def extract_text_by_paragraph(pdf_path: str, page_numbers: 'range | None' = None)->'list[str]':
     """
     extract_text_by_paragraph is a function for extracting every text paragraph
     of a given pdf via the PDF Miner library.
     This function will return a list with each paragraph of the pdf as a string.
+    Optionally, only the (zero based) pages inside page_numbers are extracted.
     """
-    # Create a PDF parser object
-    parser = PDFParser(open(pdf_path, 'rb'))
-    # Create a PDF document object
-    document = PDFDocument(parser)
-    # Connect the parser and document objects
-    parser.set_document(document)
-    
-    # Create a PDF resource manager object
-    resource_manager = PDFResourceManager()
-    # Create a string buffer
-    string_buffer = StringIO()
-    # Set the parameter for text extraction
-    laparams = LAParams()
-    # Create a PDF page aggregator object
-    device = TextConverter(resource_manager, string_buffer, laparams=laparams)
-    # Create a PDF interpreter object
-    interpreter = PDFPageInterpreter(resource_manager, device)
-    
-    # Extract the text from each page
-    for page in PDFPage.create_pages(document):
-        interpreter.process_page(page)
-    # Get the text from the string buffer
-    text = string_buffer.getvalue()
-    # Close the string buffer and the device
-    string_buffer.close()
-    device.close()
-    # Split the text into paragraphs
-    paragraphs = text.split('\n\n')
-    
-    # Return the list of paragraphs
-    return paragraphs
+    return list(iter_page_paragraphs(pdf_path, page_numbers))
+
+
+def iter_page_paragraphs(pdf_path: str, page_numbers: 'range | None' = None)->'Iterator[str]':
+    """
+    iter_page_paragraphs is a generator for extracting the text paragraphs of a
+    given pdf via the PDF Miner library. Every page is rendered on its own and
+    its paragraphs are yielded right away, so only one page is held in memory.
+    If page_numbers is given, only these (zero based) pages are processed,
+    which allows to split one pdf into several shards.
+    """
+    # Open the file in a context manager, so the handle is closed again
+    with open(pdf_path, 'rb') as instream:
+        # Create a PDF parser object
+        parser = PDFParser(instream)
+        # Create a PDF document object
+        document = PDFDocument(parser)
+        # Connect the parser and document objects
+        parser.set_document(document)
+        
+        # Create a PDF resource manager object
+        resource_manager = PDFResourceManager()
+        # Create a string buffer
+        string_buffer = StringIO()
+        # Set the parameter for text extraction
+        laparams = LAParams()
+        # Create a PDF page aggregator object
+        device = TextConverter(resource_manager, string_buffer, laparams=laparams)
+        # Create a PDF interpreter object
+        interpreter = PDFPageInterpreter(resource_manager, device)
+        
+        try:
+            # Extract the text from each (requested) page
+            for page_number, page in enumerate(PDFPage.create_pages(document)):
+                if page_numbers is not None:
+                    if page_number >= page_numbers.stop:
+                        break
+                    if page_number not in page_numbers:
+                        continue
+                interpreter.process_page(page)
+                # Get the text of this page and empty the buffer again
+                text = string_buffer.getvalue()
+                string_buffer.seek(0)
+                string_buffer.truncate()
+                # Split the text into paragraphs
+                yield from text.split('\n\n')
+        finally:
+            # Close the string buffer and the device
+            string_buffer.close()
+            device.close()
+
+
+def count_pages(pdf_path: str)->int:
+    """
+    count_pages is a function that returns the number of pages of a given pdf
+    without interpreting the page contents.
+    """
+    with open(pdf_path, 'rb') as instream:
+        document = PDFDocument(PDFParser(instream))
+        return sum(1 for _ in PDFPage.create_pages(document))
+
+
+def list_pdf_files(path: str)->'list[str]':
+    """
+    list_pdf_files is a function that returns the names of all files inside the
+    given folder that should be converted (versioning files are ignored).
+    """
+    return sorted(f for f in listdir(path) if isfile(join(path, f))
+                      and not (f.endswith('.dvc')
+                      or f.endswith('.gitignore')
+                      or f in (MANIFEST_NAME, MANIFEST_NAME + ".tmp")))
+
+
+def output_path_for(file: str)->str:
+    """
+    output_path_for is a function that returns the path of the text file for a
+    given party programme, e.g. 'AfD.pdf' -> 'data/AfD/Parteiprogramm/AfD.txt'.
+    """
+    party = file.split(".pdf")[0]
+    return join(f"data/{party}/Parteiprogramm/", file.split(".")[0]+".txt")
+
+
+def cleaning_rules_version(near_duplicate_threshold: 'float | None' = None)->str:
+    """
+    cleaning_rules_version is a function that returns a fingerprint of the
+    extraction and cleaning logic. Every change of these functions, of the
+    near-duplicate threshold (or of CLEANING_RULES_VERSION) invalidates all
+    converted files.
+    """
+    source = ''.join(inspect.getsource(function) for function in
+                     (strip_clutter, clean_lines, iter_clean_paragraphs, iter_page_paragraphs, MinHashLSH))
+    if near_duplicate_threshold is not None:
+        source += f"near_duplicate_threshold={near_duplicate_threshold}"
+    source_hash = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+    return f"{CLEANING_RULES_VERSION}-{source_hash}"
+
+
+def file_hash(filepath: str)->str:
+    """
+    file_hash is a function that returns the sha256 hash of a file's content.
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as instream:
+        for block in iter(lambda: instream.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def load_manifest(filepath: str)->'dict[str, dict]':
+    """
+    load_manifest is a function that reads the manifest of already converted
+    files. A missing or broken manifest is treated as an empty one.
+    """
+    try:
+        with open(filepath, 'r', encoding='utf-8') as instream:
+            return json.load(instream)
+    except (OSError, ValueError):
+        return {}
+
+
+def manifest_entry(pdf_path: str, out_path: str, rules: str)->dict:
+    """
+    manifest_entry is a function that describes a converted file by its size,
+    content hash, the cleaning rules and the path of the resulting text file.
+    """
+    return {
+        "size": os.path.getsize(pdf_path),
+        "sha256": file_hash(pdf_path),
+        "cleaning_rules": rules,
+        "output": out_path,
+    }
+
+
+def is_up_to_date(entry: 'dict | None', pdf_path: str, out_path: str, rules: str)->bool:
+    """
+    is_up_to_date is a function that checks whether a pdf was already converted
+    with the current cleaning rules and neither the pdf nor its text file
+    changed since then. The (cheap) size is compared before the content hash.
+    """
+    return (entry is not None
+            and entry.get("cleaning_rules") == rules
+            and entry.get("output") == out_path
+            and isfile(out_path)
+            and entry.get("size") == os.path.getsize(pdf_path)
+            and entry.get("sha256") == file_hash(pdf_path))
+
+
+def convert_files_serial(path: str, files: 'list[str]', near_duplicate_threshold: 'float | None' = None)->'list[str]':
+    """
+    convert_files_serial is a function that converts the given files of a
+    folder one after another and returns the files that were converted.
+    """
+    converted = []
+    for file in files:
+        out_path = output_path_for(file)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with stage("pdf_to_text", file=file):
+            if pdf_to_text(join(path, file), out_path, near_duplicate_threshold) == 0:
+                converted.append(file)
+                print(f"{file} -> {out_path}")
+    return converted
+
+
+def convert_files_parallel(path: str, files: 'list[str]', workers: 'int | None' = None,
+                           pages_per_shard: int = 16, near_duplicate_threshold: 'float | None' = None)->'list[str]':
+    """
+    convert_files_parallel is a function for converting the given files of a
+    folder at once. Every pdf is split into shards of pages_per_shard pages,
+    all shards of all files are extracted in parallel by a process pool and the
+    shards are put back together in page order before cleaning.
+    Returns the files that were converted.
+    """
+    workers = workers or os.cpu_count() or 1
+    pdf_paths = [join(path, file) for file in files]
+    converted = []
+    start = time.perf_counter()
+
+    with stage("pdf_to_text", unit="Seiten", workers=workers) as record, \
+            ProcessPoolExecutor(max_workers=workers, initializer=untrace_worker) as pool:
+        counts = [pool.submit(count_pages, pdf_path) for pdf_path in pdf_paths]
+        page_counts = {}
+        for pdf_path, count in zip(pdf_paths, counts):
+            try:
+                page_counts[pdf_path] = count.result()
+            except Exception as e:
+                # e.g. a corrupt or encrypted pdf, the other files are converted anyway
+                print(f"|[Error]|: unable to convert pdf {pdf_path} with error: {e}")
+
+        # Submit every shard of every file, so all cores stay busy
+        shards = {}
+        for pdf_path, n_pages in page_counts.items():
+            shards[pdf_path] = [
+                pool.submit(extract_text_by_paragraph, pdf_path,
+                            range(first, min(first + pages_per_shard, n_pages)))
+                for first in range(0, n_pages, pages_per_shard)
+            ]
+
+        # Reassemble the shards of each file in page order
+        for file, pdf_path in zip(files, pdf_paths):
+            if pdf_path not in page_counts:
+                continue
+            n_pages = page_counts[pdf_path]
+            out_path = output_path_for(file)
+            try:
+                raw_paragraphs = chain.from_iterable(shard.result() for shard in shards[pdf_path])
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                save_paragraphs(out_path, iter_clean_paragraphs(raw_paragraphs, near_duplicate_threshold))
+            except Exception as e:
+                print(f"|[Error]|: unable to convert pdf {pdf_path} with error: {e}")
+                continue
+            converted.append(file)
+            record.count(n_pages)
+            print(f"{file}: {n_pages} Seiten -> {out_path}")
+
+    duration = time.perf_counter() - start
+    total_pages = sum(page_counts.values())
+    print(f"{total_pages} Seiten aus {len(files)} Dateien in {duration:.1f}s "
+          f"({total_pages / max(duration, 1e-9):.1f} Seiten/s, {workers} Prozesse)")
+
+    return converted
+
+
+def convert_folder(path: str, workers: 'int | None' = None, pages_per_shard: int = 16,
+                   serial: bool = False, force: bool = False,
+                   near_duplicate_threshold: 'float | None' = None)->int:
+    """
+    convert_folder is a function for converting all pdf files inside a folder.
+    Files whose content and cleaning rules did not change since the last run
+    (according to the manifest inside the folder) are skipped, unless force
+    is set. Returns the number of files that could not be converted.
+    """
+    files = list_pdf_files(path)
+    manifest_path = join(path, MANIFEST_NAME)
+    rules = cleaning_rules_version(near_duplicate_threshold)
+    # forget the files that were removed from the folder
+    manifest = {file: entry for file, entry in load_manifest(manifest_path).items()
+                if file in files}
+
+    stale = [file for file in files
+             if force or not is_up_to_date(manifest.get(file), join(path, file),
+                                           output_path_for(file), rules)]
+    print(f"Cache: {len(files) - len(stale)} Treffer (übersprungen), "
+          f"{len(stale)} neu oder geändert (werden konvertiert)")
+
+    if not stale:
+        converted = []
+    elif serial:
+        converted = convert_files_serial(path, stale, near_duplicate_threshold)
+    else:
+        converted = convert_files_parallel(path, stale, workers, pages_per_shard, near_duplicate_threshold)
+
+    for file in converted:
+        manifest[file] = manifest_entry(join(path, file), output_path_for(file), rules)
+    # write to a temporary file first, so a crash cannot leave a broken manifest behind
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as outstream:
+        json.dump(manifest, outstream, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    return len(stale) - len(converted)
 
 
 if __name__ == '__main__':
@@ -173,13 +488,21 @@ if __name__ == '__main__':
 
     # pdf_to_text(pdf_filepath, output_txt_path)
 
-    # alternatively: process all files inside a folder at once:
-    path = "data/raw_programme/"
-    files: list[str] = [f for f in listdir(path) if isfile(join(path, f))
-                            and not (f.endswith('.dvc')
-                            or f.endswith('.gitignore'))]
-    for file in files:
-        party = file.split(".pdf")[0]
-        out_path = f"data/{party}/Parteiprogramm/"
+    # alternatively: process all files inside a folder at once, spread over all cores:
+    arg_parser = argparse.ArgumentParser(description="Convert all party programmes to plain text.")
+    arg_parser.add_argument("--path", default="data/raw_programme/")
+    arg_parser.add_argument("--workers", type=int, default=None,
+                            help="number of processes (default: all cores)")
+    arg_parser.add_argument("--pages-per-shard", type=int, default=16)
+    arg_parser.add_argument("--serial", action="store_true",
+                            help="convert one file after another in this process")
+    arg_parser.add_argument("--force", action="store_true",
+                            help="convert all files, even if they did not change")
+    arg_parser.add_argument("--near-duplicates", type=float, nargs="?", const=NEAR_DUPLICATE_THRESHOLD,
+                            default=None, metavar="THRESHOLD",
+                            help="also remove near-duplicate paragraphs (headers, footers, table of contents) "
+                                 f"with a similarity of at least THRESHOLD (default {NEAR_DUPLICATE_THRESHOLD})")
+    args = arg_parser.parse_args()
 
-        pdf_to_text(join(path, file), join(out_path, file.split(".")[0]+".txt"))
+    convert_folder(args.path, workers=args.workers, pages_per_shard=args.pages_per_shard,
+                   serial=args.serial, force=args.force, near_duplicate_threshold=args.near_duplicates)
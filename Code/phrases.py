@@ -0,0 +1,300 @@
+"""
+phrases
+~~~~~~~~~~~~~~~~~
+
+This module provides the phrase (collocation) detection stage. Multi-word
+terms such as "sozial Marktwirtschaft" or "europäisch Union" are merged
+into one token ("sozial_Marktwirtschaft") for BoW, TF-IDF and word2vec,
+instead of being split into unrelated single words.
+
+Bigrams and trigrams are counted in one streaming pass over the token ids
+of the corpus store, document by document, so no n-gram crosses the border
+of a document. An n-gram is a single int64 key of its token ids and the
+counts are kept in a sorted table of keys and counts. Whenever a table grows
+beyond max_table_size, all n-grams with at most prune_count occurrences are
+dropped and prune_count is increased, so the memory stays bounded.
+
+An n-gram is scored with its normalized pointwise mutual information
+
+npmi = log(p(abc) / (p(a) p(b) p(c))) / ((n - 1) * -log p(abc))
+
+which is 1 for words that only occur together and 0 for independent words.
+Every n-gram with at least min_count occurrences and an npmi of at least
+threshold is a phrase. The token streams are rewritten from left to right,
+a trigram takes precedence over a bigram starting at the same token.
+
+The rewritten streams are a corpus store of their own (cache/corpus_store_phrases,
+rebuilt when the corpus store or the parameters change), which BoW, TF-IDF
+and word2vec read with --phrases, without reading the lemmatized files again.
+"""
+
+import argparse
+import json
+import os
+from os.path import join
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from corpus_store import CorpusStore, load_corpus, STORE_VERSION
+from instrumentation import stage
+
+# Default location of the rewritten store, relative to the working directory of the scripts
+PHRASE_STORE_DIR = join("cache", "corpus_store_phrases")
+PHRASE_DELIMITER = "_"
+MIN_COUNT = 5
+THRESHOLD = 0.5
+# Maximum number of n-grams per count table before it is pruned
+MAX_TABLE_SIZE = 10_000_000
+# Number of new n-gram keys that are collected before they are merged into the table
+MERGE_BLOCK_SIZE = 1_000_000
+
+
+def ngram_keys(ids: np.ndarray, n: int, vocab_size: int)->np.ndarray:
+    """
+    ngram_keys is a function that returns the int64 key of every n-gram of a
+    token id sequence, e.g. (a * V + b) * V + c for a trigram.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    keys = ids[:len(ids) - n + 1].copy()
+    for offset in range(1, n):
+        keys = keys * vocab_size + ids[offset:len(ids) - n + 1 + offset]
+    return keys
+
+
+def split_keys(keys: np.ndarray, n: int, vocab_size: int)->List[np.ndarray]:
+    """
+    split_keys is a function that returns the token ids of the n-gram keys,
+    one array per position.
+    """
+    parts = []
+    for _ in range(n):
+        parts.append(keys % vocab_size)
+        keys = keys // vocab_size
+    return parts[::-1]
+
+
+class NgramCounter:
+    """
+    NgramCounter counts unigrams, bigrams and trigrams of token id streams
+    in bounded memory. The bigram and trigram counts are sorted (keys, counts)
+    tables that are pruned when they grow beyond max_table_size.
+    """
+
+    def __init__(self, vocab_size: int, max_table_size: int = MAX_TABLE_SIZE,
+                 merge_block_size: int = MERGE_BLOCK_SIZE):
+        if vocab_size ** 3 >= 2 ** 63:
+            raise ValueError(f"vocabulary too large for int64 trigram keys: {vocab_size}")
+        self.vocab_size = vocab_size
+        self.max_table_size = max_table_size
+        self.merge_block_size = merge_block_size
+        self.unigrams = np.zeros(vocab_size, dtype=np.int64)
+        self.n_tokens = 0
+        self.prune_count = 0
+        self.tables: Dict[int, Tuple[np.ndarray, np.ndarray]] = {
+            n: (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)) for n in (2, 3)}
+        self._pending: Dict[int, List[np.ndarray]] = {2: [], 3: []}
+        self._n_pending = 0
+
+    def add(self, ids: np.ndarray)->None:
+        """
+        add counts the n-grams of one document.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        self.unigrams += np.bincount(ids, minlength=self.vocab_size)
+        self.n_tokens += len(ids)
+        for n in (2, 3):
+            if len(ids) >= n:
+                self._pending[n].append(ngram_keys(ids, n, self.vocab_size))
+                self._n_pending += len(ids) - n + 1
+        if self._n_pending >= self.merge_block_size:
+            self.flush()
+
+    def flush(self)->None:
+        """
+        flush merges the collected n-grams into the count tables and prunes them.
+        """
+        for n in (2, 3):
+            if not self._pending[n]:
+                continue
+            keys, counts = self.tables[n]
+            new_keys, new_counts = np.unique(np.concatenate(self._pending[n]), return_counts=True)
+            keys, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate([counts, new_counts]),
+                                 minlength=len(keys)).astype(np.int64)
+            while len(keys) > self.max_table_size:
+                # drop the rare n-grams, they can't become phrases anymore
+                self.prune_count += 1
+                keep = counts > self.prune_count
+                keys, counts = keys[keep], counts[keep]
+            self.tables[n] = (keys, counts)
+            self._pending[n] = []
+        self._n_pending = 0
+
+    def score(self, n: int)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        score returns the keys, counts and npmi of all counted n-grams.
+        """
+        self.flush()
+        keys, counts = self.tables[n]
+        total = max(self.n_tokens, 1)
+        log_joint = np.log(counts / total)
+        log_parts = sum(np.log(self.unigrams[part] / total) for part in split_keys(keys, n, self.vocab_size))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            npmi = (log_joint - log_parts) / ((n - 1) * -log_joint)
+        # an n-gram that makes up the whole corpus
+        npmi[~np.isfinite(npmi)] = 1.0
+        return keys, counts, npmi
+
+
+class PhraseModel:
+    """
+    PhraseModel holds the detected bigram and trigram phrases (sorted keys)
+    of a vocabulary and rewrites token id streams with merged phrase tokens.
+    The id of a phrase token is len(vocab) + its index in phrase_vocab.
+    """
+
+    def __init__(self, vocab: List[str], phrases: Dict[int, np.ndarray]):
+        self.vocab = vocab
+        self.vocab_size = len(vocab)
+        self.phrases = {n: np.sort(np.asarray(phrases.get(n, []), dtype=np.int64)) for n in (2, 3)}
+        self.phrase_vocab: List[str] = []
+        self._first_id = {}
+        for n in (2, 3):
+            self._first_id[n] = self.vocab_size + len(self.phrase_vocab)
+            for parts in zip(*split_keys(self.phrases[n], n, self.vocab_size)):
+                self.phrase_vocab.append(PHRASE_DELIMITER.join(vocab[i] for i in parts))
+
+    def __len__(self)->int:
+        return len(self.phrase_vocab)
+
+    def _matches(self, ids: np.ndarray, n: int)->np.ndarray:
+        """
+        _matches returns the phrase index of the n-gram starting at every position, or -1.
+        """
+        result = np.full(len(ids), -1, dtype=np.int64)
+        table = self.phrases[n]
+        if len(ids) < n or len(table) == 0:
+            return result
+        keys = ngram_keys(ids, n, self.vocab_size)
+        pos = np.minimum(np.searchsorted(table, keys), len(table) - 1)
+        found = table[pos] == keys
+        result[:len(keys)][found] = pos[found]
+        return result
+
+    def rewrite(self, ids: np.ndarray)->np.ndarray:
+        """
+        rewrite returns the token ids with every phrase merged into its phrase token.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        trigrams, bigrams = self._matches(ids, 3), self._matches(ids, 2)
+        out = ids.copy()
+        keep = np.ones(len(ids), dtype=bool)
+        next_free = 0
+        # only the (few) positions where a phrase starts are visited
+        for i in np.flatnonzero((trigrams >= 0) | (bigrams >= 0)).tolist():
+            if i < next_free:
+                continue
+            if trigrams[i] >= 0:
+                out[i] = self._first_id[3] + trigrams[i]
+                keep[i + 1:i + 3] = False
+                next_free = i + 3
+            else:
+                out[i] = self._first_id[2] + bigrams[i]
+                keep[i + 1] = False
+                next_free = i + 2
+        return out[keep]
+
+
+def detect_phrases(store: CorpusStore, min_count: int = MIN_COUNT, threshold: float = THRESHOLD,
+                   max_table_size: int = MAX_TABLE_SIZE)->Tuple[PhraseModel, List[tuple]]:
+    """
+    detect_phrases is a function that counts the n-grams of all documents of
+    the store in one pass and returns the phrase model together with
+    (phrase, count, npmi) of every phrase, the most frequent first.
+    """
+    counter = NgramCounter(len(store.vocab), max_table_size)
+    for name in store.names:
+        counter.add(store.doc_ids(name))
+
+    phrases, scored = {}, []
+    for n in (2, 3):
+        keys, counts, npmi = counter.score(n)
+        selected = (counts >= min_count) & (npmi >= threshold)
+        phrases[n] = keys[selected]
+        parts = zip(*(part.tolist() for part in split_keys(phrases[n], n, counter.vocab_size)))
+        for ids, count, value in zip(parts, counts[selected].tolist(), npmi[selected].tolist()):
+            scored.append((PHRASE_DELIMITER.join(store.vocab[i] for i in ids), count, value))
+    scored.sort(key=lambda x: (-x[1], -x[2], x[0]))
+    return PhraseModel(store.vocab, phrases), scored
+
+
+def build_phrase_store(store: CorpusStore, params: dict, store_dir: str = PHRASE_STORE_DIR)->CorpusStore:
+    """
+    build_phrase_store is a function that detects the phrases of the store,
+    writes the rewritten token ids as a corpus store of their own together
+    with the list of phrases (phrases.tsv) and returns the new store.
+    """
+    model, scored = detect_phrases(store, params["min_count"], params["threshold"])
+    os.makedirs(store_dir, exist_ok=True)
+    if os.path.exists(join(store_dir, "meta.json")):
+        os.remove(join(store_dir, "meta.json"))
+
+    offsets = [0]
+    with open(join(store_dir, "tokens.bin"), "wb") as outstream:
+        for name in store.names:
+            ids = model.rewrite(store.doc_ids(name)).astype("<i4")
+            ids.tofile(outstream)
+            offsets.append(offsets[-1] + len(ids))
+
+    with open(join(store_dir, "vocab.txt"), "w", encoding="utf-8", newline="\n") as f:
+        for token in store.vocab + model.phrase_vocab:
+            f.write(token + "\n")
+    with open(join(store_dir, "phrases.tsv"), "w", encoding="utf-8", newline="\n") as f:
+        for phrase, count, value in scored:
+            f.write(f"{phrase}\t{count}\t{value:.4f}\n")
+    np.save(join(store_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    with open(join(store_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "documents": store.documents, "phrases": params}, f, indent=2)
+    return CorpusStore(store_dir)
+
+
+def load_phrase_corpus(data_dir: str = "data", min_count: int = MIN_COUNT, threshold: float = THRESHOLD,
+                       store_dir: str = PHRASE_STORE_DIR, base: Optional[CorpusStore] = None)->CorpusStore:
+    """
+    load_phrase_corpus is a function that returns the store of the party
+    corpora with merged phrase tokens. It is rebuilt only if the corpus store
+    (see load_corpus) or the parameters changed.
+    """
+    base = load_corpus(data_dir) if base is None else base
+    params = {"min_count": min_count, "threshold": threshold}
+    try:
+        with open(join(store_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        up_to_date = (meta.get("version") == STORE_VERSION and meta.get("phrases") == params
+                      and meta.get("documents") == base.documents)
+    except (OSError, ValueError):
+        up_to_date = False
+    if up_to_date:
+        return CorpusStore(store_dir)
+
+    print(f"Erkenne Phrasen und baue {store_dir} auf...")
+    with stage("phrases", unit="Tokens") as record:
+        store = build_phrase_store(base, params, store_dir)
+        record.count(int(base.offsets[-1]))
+    return store
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Detect phrases (bigrams and trigrams) in the party corpora.")
+    arg_parser.add_argument("--min-count", type=int, default=MIN_COUNT, help="minimum number of occurrences")
+    arg_parser.add_argument("--threshold", type=float, default=THRESHOLD, help="minimum npmi of a phrase (-1 to 1)")
+    arg_parser.add_argument("--top", type=int, default=30, help="number of phrases that are shown")
+    args = arg_parser.parse_args()
+
+    store = load_phrase_corpus("data/", args.min_count, args.threshold)
+    with open(join(PHRASE_STORE_DIR, "phrases.tsv"), "r", encoding="utf-8") as f:
+        phrases = [line.rstrip("\n").split("\t") for line in f]
+    print(f"{len(phrases)} Phrasen, {int(store.offsets[-1])} Tokens nach dem Zusammenfassen")
+    for phrase, count, value in phrases[:args.top]:
+        print(f"{phrase}: {count} ({value})")
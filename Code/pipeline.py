@@ -0,0 +1,301 @@
+"""
+pipeline
+~~~~~~~~~~~~~~~~~
+
+This module is the single entry point of the whole workflow. The scripts
+are stages of a DAG, every stage declares the stages it depends on and its
+input and output files. The code it runs is its script and every module of
+the Code folder the script imports, directly or through other modules:
+
+pdf2txt -> combine -> kwic_index
+                   -> embeddings
+        -> lemmatize -> tfidf, tfidf_speeches -> tfidf_time_slices
+                     -> w2v -> w2v_similarity
+                     -> doc2vec, stylometry
+
+A stage runs as soon as all of its dependencies are done, independent
+stages run at the same time in a process pool (e.g. TF-IDF, word2vec and
+Doc2Vec right after the lemmatization, the embeddings and the KWIC index
+right after the party texts are combined). A stage is skipped if the
+content of its inputs, its code and its command didn't change since its
+last successful run and all of its outputs exist. The fingerprints are kept in cache/pipeline/state.json,
+the output of every stage in cache/pipeline/logs/<stage>.log.
+
+Run from the folder that contains "data", e.g.:
+python Code/pipeline.py --jobs 4
+"""
+
+import argparse
+import ast
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import glob
+import hashlib
+import json
+import os
+from os.path import join
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Folder of the scripts
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = join("cache", "pipeline")
+
+SOURCE_TEXTS = ["data/*/Parteiprogramm/*.txt", "data/*/Reden/*.txt"]
+LEMMATIZED = ["data/*/Lemmatisiert/*_lemmatisiert.txt"]
+
+
+def imported_modules(module: str)->List[str]:
+    """
+    imported_modules is a function that returns the names of all modules a
+    file of the Code folder imports, also inside functions (lazy imports).
+    """
+    with open(join(CODE_DIR, module), "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=module)
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [alias.name.split(".")[0] for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.append(node.module.split(".")[0])
+    return names
+
+
+def code_closure(script: str)->List[str]:
+    """
+    code_closure is a function that returns the script and all modules of
+    the Code folder it runs, i.e. the closure of its imports, as paths
+    relative to the Code folder. Other packages (numpy, spaCy, ...) are left out.
+    """
+    code = [script]
+    todo = [script]
+    while todo:
+        module = todo.pop()
+        for name in imported_modules(module):
+            # the scripts find their modules next to themselves and in the Code folder
+            for folder in dict.fromkeys([os.path.dirname(module), os.path.dirname(script), ""]):
+                path = join(folder, name + ".py") if folder else name + ".py"
+                if os.path.isfile(join(CODE_DIR, path)):
+                    if path not in code:
+                        code.append(path)
+                        todo.append(path)
+                    break
+    return [script] + sorted(code[1:])
+
+
+class Stage:
+    """
+    Stage is one step of the pipeline: a script (relative to the Code
+    folder) with its arguments, the stages it depends on and the glob
+    patterns of its inputs and outputs. The modules of its code are found
+    from the imports of the script.
+    """
+
+    def __init__(self, name: str, command: List[str], deps: Sequence[str] = (), inputs: Sequence[str] = (),
+                 outputs: Sequence[str] = ()):
+        self.name = name
+        self.command = command
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = code_closure(command[0])
+
+    def argv(self)->List[str]:
+        return [sys.executable, join(CODE_DIR, self.command[0])] + self.command[1:]
+
+
+STAGES = [
+    Stage("pdf2txt", ["pdf2txt.py"],
+          inputs=["data/raw_programme/*.pdf"], outputs=["data/*/Parteiprogramm/*.txt"]),
+    Stage("combine", ["combine_party_texts.py"], deps=["pdf2txt"],
+          inputs=SOURCE_TEXTS, outputs=["data/*/Combined/*_combined.txt"]),
+    Stage("lemmatize", ["bow.py"], deps=["pdf2txt"],
+          inputs=SOURCE_TEXTS, outputs=LEMMATIZED),
+    Stage("tfidf", ["tf-idf.py"], deps=["lemmatize"], inputs=LEMMATIZED),
+    Stage("tfidf_speeches", ["tf-idf.py", "--speeches"], deps=["lemmatize"], inputs=LEMMATIZED),
+    Stage("tfidf_time_slices", ["tf-idf.py", "--time-slices", "4"], deps=["lemmatize", "tfidf_speeches"], inputs=LEMMATIZED),
+    Stage("w2v", ["w2v/Generierung w2v-Modell.py"], deps=["lemmatize"],
+          inputs=LEMMATIZED, outputs=["word2vec_parteien.model", "word2vec_parteien.kv"]),
+    Stage("w2v_similarity", ["w2v/cosine similarity w2v.py"], deps=["w2v"],
+          inputs=LEMMATIZED + ["word2vec_parteien.kv*"]),
+    Stage("doc2vec", ["w2v/doc2vec.py", "--retrain"], deps=["lemmatize"],
+          inputs=LEMMATIZED, outputs=["doc2vec_parteien.model", "doc2vec_parteien.dv"]),
+    Stage("stylometry", ["stylometry.py"], deps=["lemmatize"], inputs=LEMMATIZED),
+    Stage("embeddings", ["sentence transformers.py"], deps=["combine"],
+          inputs=SOURCE_TEXTS + ["data/*/Combined/*.txt"], outputs=["Cosine_Similarities.png", "PCA_embeddings.png"]),
+    Stage("kwic_index", ["kwic_index.py"], deps=["combine"],
+          inputs=SOURCE_TEXTS + ["data/*/Combined/*.txt"]),
+]
+
+
+class PipelineState:
+    """
+    PipelineState keeps the fingerprint of every stage after its last
+    successful run, and the content hashes of all files by (size, mtime),
+    so a file is only hashed again after it was rewritten.
+    """
+
+    def __init__(self, path: str = join(PIPELINE_DIR, "state.json")):
+        self.path = path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        self.stages: Dict[str, str] = state.get("stages", {})
+        self.hashes: Dict[str, list] = state.get("hashes", {})
+
+    def file_hash(self, path: str)->str:
+        """
+        file_hash returns the content hash of a file.
+        """
+        stat = os.stat(path)
+        known = self.hashes.get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.hashes[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def save(self)->None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".part", "w", encoding="utf-8") as f:
+            json.dump({"stages": self.stages, "hashes": self.hashes}, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".part", self.path)
+
+
+def expand(patterns: Sequence[str])->List[str]:
+    """
+    expand is a function that returns all files matching the glob patterns, sorted.
+    """
+    return sorted({path for pattern in patterns for path in glob.glob(pattern) if os.path.isfile(path)})
+
+
+def fingerprint(stage: Stage, state: PipelineState)->str:
+    """
+    fingerprint is a function that combines the command, the code and the
+    content of all inputs of a stage into one hash.
+    """
+    digest = hashlib.sha256(json.dumps(stage.command).encode("utf-8"))
+    for module in stage.code:
+        digest.update(f"code {module} {state.file_hash(join(CODE_DIR, module))}\n".encode("utf-8"))
+    for path in expand(stage.inputs):
+        digest.update(f"input {path} {state.file_hash(path)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def outputs_exist(stage: Stage)->bool:
+    """
+    outputs_exist is a function that checks that every declared output
+    pattern matches at least one file.
+    """
+    return all(expand([pattern]) for pattern in stage.outputs)
+
+
+def run_command(argv: List[str], log_path: str)->Tuple[int, float]:
+    """
+    run_command is a function that runs the script of a stage in the current
+    folder, writes its output to log_path and returns (exit code, seconds).
+    """
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "w", encoding="utf-8") as log:
+        returncode = subprocess.run(argv, stdout=log, stderr=subprocess.STDOUT).returncode
+    return returncode, time.perf_counter() - start
+
+
+def run_pipeline(stages: List[Stage], jobs: Optional[int] = None, force: Sequence[str] = (),
+                 dry_run: bool = False)->Dict[str, str]:
+    """
+    run_pipeline is a function that runs all stages in dependency order,
+    independent stages in parallel, and returns the status of every stage:
+    "unverändert" (skipped), "fertig", "fehlgeschlagen" or "blockiert"
+    (a dependency failed).
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"stage {stage.name} depends on unknown stage {dep}")
+
+    state = PipelineState()
+    status: Dict[str, str] = {}
+    running = {}
+    fingerprints = {}
+
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        while len(status) < len(stages):
+            n_done = len(status)
+            # start (or skip) every stage whose dependencies are done
+            for stage in stages:
+                if stage.name in status or stage.name in running.values():
+                    continue
+                dep_status = [status.get(dep) for dep in stage.deps]
+                if any(s in ("fehlgeschlagen", "blockiert") for s in dep_status):
+                    status[stage.name] = "blockiert"
+                    print(f"[{stage.name}] blockiert (eine Abhängigkeit ist fehlgeschlagen)")
+                    continue
+                if any(s is None for s in dep_status):
+                    continue
+                fingerprints[stage.name] = fingerprint(stage, state)
+                up_to_date = (state.stages.get(stage.name) == fingerprints[stage.name]
+                              and outputs_exist(stage) and stage.name not in force)
+                if up_to_date or dry_run:
+                    status[stage.name] = "unverändert" if up_to_date else "würde laufen"
+                    print(f"[{stage.name}] {status[stage.name]}")
+                    continue
+                print(f"[{stage.name}] läuft: {' '.join(stage.command)}")
+                log_path = join(PIPELINE_DIR, "logs", f"{stage.name}.log")
+                running[pool.submit(run_command, stage.argv(), log_path)] = stage.name
+
+            if not running:
+                if len(status) == n_done:
+                    raise ValueError(f"cyclic dependencies: {sorted(set(by_name) - set(status))}")
+                continue
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, seconds = future.result()
+                if returncode == 0:
+                    status[name] = "fertig"
+                    # the fingerprint of the inputs at the start of the stage
+                    state.stages[name] = fingerprints[name]
+                    state.save()
+                    print(f"[{name}] fertig in {seconds:.1f}s")
+                else:
+                    status[name] = "fehlgeschlagen"
+                    state.stages.pop(name, None)
+                    state.save()
+                    print(f"[{name}] fehlgeschlagen (Exit-Code {returncode}), "
+                          f"siehe {join(PIPELINE_DIR, 'logs', name + '.log')}")
+
+    state.save()
+    return status
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Run the whole pipeline, only the stages whose inputs changed.")
+    arg_parser.add_argument("--jobs", type=int, default=None, help="stages that run at the same time")
+    arg_parser.add_argument("--force", nargs="*", default=None, metavar="STAGE",
+                            help="run these stages (without names: all stages) even if nothing changed")
+    arg_parser.add_argument("--only", nargs="+", default=None, metavar="STAGE",
+                            help="run only these stages, their dependencies are taken as they are")
+    arg_parser.add_argument("--dry-run", action="store_true", help="only show which stages would run")
+    args = arg_parser.parse_args()
+
+    stages = STAGES
+    if args.only:
+        unknown = set(args.only) - {stage.name for stage in STAGES}
+        if unknown:
+            arg_parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+        stages = [Stage(stage.name, stage.command, [dep for dep in stage.deps if dep in args.only],
+                        stage.inputs, stage.outputs)
+                  for stage in STAGES if stage.name in args.only]
+    force = [stage.name for stage in stages] if args.force == [] else (args.force or [])
+
+    status = run_pipeline(stages, jobs=args.jobs, force=force, dry_run=args.dry_run)
+    sys.exit(1 if any(s in ("fehlgeschlagen", "blockiert") for s in status.values()) else 0)
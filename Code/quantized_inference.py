@@ -0,0 +1,116 @@
+"""
+quantized_inference
+~~~~~~~~~~~~~~~~~
+
+This module provides a faster CPU inference mode for the sentence transformer:
+the weights of all linear layers are quantized to int8 (dynamic quantization,
+the activations are quantized on the fly), which makes the matmuls of the
+transformer several times cheaper on a CPU, and the number of intra-op
+threads of torch is set explicitly.
+
+Because the quantized embeddings are not exactly the same as the fp32 ones,
+drift_report compares both: how far the party similarity matrix and the 2d
+PCA projection move, and whether the ranking of the party pairs stays the same.
+"""
+
+import copy
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+from bootstrap import batched_cosine, normalize_rows
+
+
+def configure_threads(threads: Optional[int] = None)->int:
+    """
+    configure_threads is a function that sets the number of intra-op threads
+    of torch (default: all cores) and returns it.
+    """
+    threads = threads or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    return torch.get_num_threads()
+
+
+def quantize_model(model: torch.nn.Module)->torch.nn.Module:
+    """
+    quantize_model is a function that returns a copy of the model with all
+    linear layers dynamically quantized to int8, the model itself stays fp32.
+    """
+    engines = torch.backends.quantized.supported_engines
+    if torch.backends.quantized.engine not in ("fbgemm", "qnnpack"):
+        for engine in ("fbgemm", "qnnpack"):
+            if engine in engines:
+                torch.backends.quantized.engine = engine
+                break
+    quantized = torch.quantization.quantize_dynamic(copy.deepcopy(model).cpu().eval(),
+                                                   {torch.nn.Linear}, dtype=torch.qint8)
+    return quantized
+
+
+def pca_projection(vectors: np.ndarray, n_components: int = 2)->np.ndarray:
+    """
+    pca_projection is a function that returns the same projection as
+    PCA(n_components).fit(vectors.T).components_ in sentence transformers.py,
+    with the sign of every component fixed (largest entry positive).
+    """
+    centered = vectors.T - vectors.T.mean(axis=0)
+    _, _, vt = np.linalg.svd(centered, full_matrices=False)
+    components = vt[:n_components]
+    signs = np.sign(components[np.arange(len(components)), np.argmax(np.abs(components), axis=1)])
+    return components * np.where(signs == 0, 1.0, signs)[:, None]
+
+
+def _ranks(values: np.ndarray)->np.ndarray:
+    ranks = np.empty(len(values))
+    ranks[np.argsort(-values, kind="stable")] = np.arange(len(values))
+    return ranks
+
+
+def drift_report(reference: np.ndarray, vectors: np.ndarray)->Dict[str, float]:
+    """
+    drift_report is a function that compares document vectors (e.g. of the
+    quantized model) with reference vectors (fp32) of the same documents.
+    """
+    sim_reference, sim = batched_cosine(reference), batched_cosine(vectors)
+    rows, cols = np.triu_indices(len(reference), k=1)
+    ranks_reference, ranks = _ranks(sim_reference[rows, cols]), _ranks(sim[rows, cols])
+
+    pca_reference, pca = pca_projection(reference), pca_projection(vectors)
+    # a component may flip its sign between both models, that is no drift
+    signs = np.sign(np.sum(pca_reference * pca, axis=1))
+    pca = pca * np.where(signs == 0, 1.0, signs)[:, None]
+
+    n_pairs = len(rows)
+    rank_correlation = 1.0
+    if n_pairs > 1:
+        rank_correlation = float(np.corrcoef(ranks_reference, ranks)[0, 1])
+    return {
+        "similarity_max_abs_diff": float(np.abs(sim - sim_reference).max()),
+        "similarity_mean_abs_diff": float(np.abs(sim - sim_reference)[rows, cols].mean()) if n_pairs else 0.0,
+        "pair_rank_spearman": rank_correlation,
+        "pairs_same_rank": float((ranks == ranks_reference).mean()) if n_pairs else 1.0,
+        "pca_max_abs_diff": float(np.abs(pca - pca_reference).max()),
+        "vector_cosine_min": float(np.min(np.sum(normalize_rows(reference) * normalize_rows(vectors), axis=1))),
+    }
+
+
+def format_report(names: List[str], stats: Dict[str, Dict[str, float]], drift: Dict[str, float])->str:
+    """
+    format_report is a function that returns the throughput of every model
+    variant side by side, followed by the drift against fp32.
+    """
+    variants = list(stats)
+    lines = [f"{'':<22}" + "".join(f"{variant:>12}" for variant in variants)]
+    for key, label in (("chunks", "Chunks"), ("seconds", "Sekunden"), ("chunks_per_second", "Chunks/s")):
+        lines.append(f"{label:<22}" + "".join(f"{stats[variant][key]:>12.2f}" for variant in variants))
+    reference = variants[0]
+    lines.append(f"{'Speedup':<22}" + "".join(
+        f"{stats[variant]['chunks_per_second'] / max(stats[reference]['chunks_per_second'], 1e-9):>11.2f}x"
+        for variant in variants))
+    lines.append("")
+    lines.append(f"Drift gegenüber fp32 ({len(names)} Parteien):")
+    for key, value in drift.items():
+        lines.append(f"  {key:<26}{value:.4f}")
+    return "\n".join(lines)
@@ -1,3 +1,5 @@
+import argparse
+
 from huggingface_hub import configure_http_backend
 import matplotlib.pyplot as plt
 import numpy as np
@@ -11,17 +13,51 @@ from sklearn.decomposition import PCA
 import torch
 from torchmetrics.functional import pairwise_cosine_similarity as cosine_similarity
 
+from bootstrap import bootstrap_similarity, format_intervals, pair_intervals
+from chunked_embeddings import embed_chunks, embed_documents, MAX_TOKENS, pool_chunks, pooling_weights
+from corpus_store import read_text
+from embedding_cache import EmbeddingCache
+from quantized_inference import configure_threads, drift_report, format_report, quantize_model
+from time_slices import find_speeches, similarity_trajectory, slice_embeddings, year_windows
+
+arg_parser = argparse.ArgumentParser(description="Embed the texts (programmes and speeches) of all parties.")
+arg_parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help="tokens per chunk")
+arg_parser.add_argument("--batch-size", type=int, default=16, help="chunks per forward pass")
+arg_parser.add_argument("--pooling", choices=["mean", "weighted"], default="mean",
+                        help="how the chunk embeddings of a party are combined")
+arg_parser.add_argument("--no-cache", action="store_true", help="encode all chunks, without the embedding cache")
+arg_parser.add_argument("--quantize", action="store_true",
+                        help="fast CPU mode: linear layers dynamically quantized to int8")
+arg_parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: all cores)")
+arg_parser.add_argument("--report", action="store_true",
+                        help="embed with fp32 and int8 (without cache) and report throughput and drift")
+arg_parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="confidence intervals from N bootstrap replicates over the chunks of the parties")
+arg_parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap")
+arg_parser.add_argument("--workers", type=int, default=None, help="processes for the bootstrap (default: all cores)")
+arg_parser.add_argument("--time-slices", type=int, metavar="YEARS",
+                        help="similarity trajectory of the parties in windows of YEARS years, summed from the "
+                             "cached per-year embeddings of the speeches, see time_slices.py")
+arg_parser.add_argument("--step", type=int, metavar="YEARS",
+                        help="distance between the windows of --time-slices (default: YEARS, no overlap)")
+args = arg_parser.parse_args()
 
 # Load the model
-model = SentenceTransformer("jinaai/jina-embeddings-v2-base-de", trust_remote_code=True)
-
-# Load all combined files for each party
+MODEL_ID = "jinaai/jina-embeddings-v2-base-de"
+model = SentenceTransformer(MODEL_ID, trust_remote_code=True)
+if args.quantize or args.report:
+    print(f"Torch-Threads: {configure_threads(args.threads)}")
+    model = model.cpu()
+
+# Load all texts (programmes and speeches) of each party, every file is chunked on its own,
+# so editing one speech only changes the chunks of that speech (and the embedding cache keeps the rest)
 base_dir = "data"
 ignore_folder = "raw_programme"
+source_folders = ["Parteiprogramm", "Reden"]
 
 corpus = {}
 
-for partei in os.listdir(base_dir):
+for partei in sorted(os.listdir(base_dir)):
 
     partei_path = join(base_dir, partei)
     if not os.path.isdir(partei_path):
@@ -31,39 +67,81 @@ for partei in os.listdir(base_dir):
     if partei == ignore_folder:
         continue
 
-    combined_path = join(partei_path, "Combined")
-    if not os.path.exists(combined_path):
-        print(f"Kein Combined-Ordner für {partei}")
-        continue
+    texts = []
 
-    full_text = ""
+    for subfolder in source_folders:
+        folder_path = join(partei_path, subfolder)
+        if not os.path.isdir(folder_path):
+            continue
+        for file in sorted(os.listdir(folder_path)):
+            if file.endswith(".txt") and "lemmatisiert" not in file.lower():
+                texts.append(read_text(join(folder_path, file)).strip())
 
-    for file in os.listdir(combined_path):
-        if file.endswith(".txt"):
-            file_path = join(combined_path, file)
-            with open(file_path, "r", encoding="utf-8") as f:
-                full_text += f.read().replace("\n", " ").strip()
+    # Without the source folders, the combined file of the party is used
+    combined_path = join(partei_path, "Combined")
+    if not texts and os.path.exists(combined_path):
+        for file in sorted(os.listdir(combined_path)):
+            if file.endswith(".txt"):
+                texts.append(read_text(join(combined_path, file)).strip())
 
-    if full_text.strip() == "":
+    if "".join(texts).strip() == "":
         print(f"Keine Texte für {partei} gefunden!")
         continue
 
-    corpus[partei] = full_text.strip()
-    print(f"Loaded Combined text for {partei}")
+    corpus[partei] = texts
+    print(f"Loaded {len(texts)} texts for {partei}")
 
 print("\nParteien im Korpus:", list(corpus.keys()))
 
-# Embed each party's full combined text
+# Embed each party's full combined texts, split into chunks that fit into the model
 documents = list(corpus.values())
 
+if args.report:
+    # both variants encode every chunk, so the throughput is comparable
+    print("\nVergleiche fp32 und int8...")
+    variants = {"fp32": model, "int8": quantize_model(model)}
+    variant_vectors, variant_stats = {}, {}
+    for variant, variant_model in variants.items():
+        variant_vectors[variant], variant_stats[variant] = embed_documents(
+            variant_model, documents, max_tokens=args.max_tokens, batch_size=args.batch_size, pooling=args.pooling)
+    print(format_report(list(corpus.keys()), variant_stats,
+                        drift_report(variant_vectors["fp32"], variant_vectors["int8"])))
+
+cache_id = MODEL_ID
+if args.quantize:
+    model = quantize_model(model)
+    cache_id += "@int8"
+cache = None if args.no_cache else EmbeddingCache(cache_id, model.get_sentence_embedding_dimension())
+
 print("\nGenerating embeddings...")
-embeddings = model.encode(documents, convert_to_tensor=True)
+chunk_embeddings, chunk_parties, chunk_lengths, stats = embed_chunks(model, documents, max_tokens=args.max_tokens,
+                                                                     batch_size=args.batch_size, cache=cache)
+doc_vectors = pool_chunks(chunk_embeddings, chunk_parties, chunk_lengths, len(documents), args.pooling)
+embeddings = torch.from_numpy(doc_vectors).float()
+print(f"{stats['encoded']} von {stats['chunks']} Chunks neu berechnet ({stats['tokens']} Tokens) "
+      f"in {stats['seconds']:.1f}s ({stats['chunks_per_second']:.2f} Chunks/s)")
 print("Embeddings shape:", embeddings.shape)
 
 sim = cosine_similarity(embeddings) # embeddings.shape = (N,d), sim.shape = (N,N)
 sim += torch.eye(sim.shape[0])
 print(sim)
 
+# Stability of the similarities: resample the chunks of every party
+if args.bootstrap:
+    chunk_weights = pooling_weights(chunk_lengths, args.pooling)
+    result = bootstrap_similarity(chunk_embeddings * chunk_weights[:, None], chunk_weights, chunk_parties,
+                                  len(documents), n_replicates=args.bootstrap, seed=args.seed, workers=args.workers)
+    print(format_intervals(pair_intervals(result, list(corpus.keys())), args.bootstrap))
+
+# Development of the similarities over time: the speeches of every party and year are one slice,
+# a window sums the cached chunk embeddings of its slices
+if args.time_slices:
+    slices = slice_embeddings(model, find_speeches(base_dir), key=cache_id, max_tokens=args.max_tokens,
+                              batch_size=args.batch_size, pooling=args.pooling, cache=cache)
+    trajectory = similarity_trajectory(slices, year_windows(slices.years(), args.time_slices, args.step))
+    print(f"\nÄhnlichkeiten der Parteien in Zeitfenstern von {args.time_slices} Jahren (Reden):\n")
+    print(trajectory.to_string(float_format=lambda value: f"{value:.4f}", na_rep="–"))
+
 # Visualize the results
 sns.heatmap(sim, xticklabels=list(corpus.keys()), yticklabels=list(corpus.keys()), annot=True, cbar=False)
 plt.title("Cosine Similarities zwischen allen Parteien", pad=20, fontweight='bold')
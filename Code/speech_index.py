@@ -0,0 +1,221 @@
+"""
+speech_index
+~~~~~~~~~~~~~~~~~
+
+This module provides a speech-level TF-IDF index. Every speech and every
+party programme is its own document, the party is kept as metadata. With only
+one document per party N is 7 and every term that all parties use gets an idf
+of 0, on speech level the idf is much more informative.
+
+The index keeps the (lowercased) term counts of every document and the
+document frequency of every term. Adding or removing a document only touches
+the document frequencies of its own terms, the idf is derived from them when
+needed and the scores of a document are only computed when it is scored.
+The index is saved to disk and synchronized with the lemmatized files, so a
+new speech costs one document instead of recomputing the whole corpus.
+Party rankings are aggregated from the speech-level matrix.
+"""
+
+import json
+import os
+from os.path import join
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from corpus_store import file_signature, find_document_files
+from dtm import inverse_document_frequency, term_frequency
+from instrumentation import stage
+
+# Default location of the index, relative to the working directory of the scripts
+INDEX_DIR = join("cache", "speech_index")
+
+
+class SpeechIndex:
+    """
+    SpeechIndex keeps the term counts of every document and the document
+    frequency (df) of every term, and derives idf and TF-IDF scores from them.
+    * vocab: list of all terms, the index is the term id
+    * documents: metadata (party, kind, path, ...) of every document by name
+    """
+
+    def __init__(self):
+        self.vocab: List[str] = []
+        self.term_ids: Dict[str, int] = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.documents: Dict[str, dict] = {}
+        # term ids and counts of every document
+        self.rows: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self)->int:
+        return len(self.documents)
+
+    def __contains__(self, name: str)->bool:
+        return name in self.documents
+
+    @property
+    def names(self)->List[str]:
+        return list(self.documents)
+
+    def _term_id(self, term: str)->int:
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.vocab)
+            self.vocab.append(term)
+        return term_id
+
+    def add_document(self, name: str, tokens: Iterable[str], **meta)->None:
+        """
+        add_document adds (or replaces) a document and updates the document
+        frequencies of its terms.
+        """
+        if name in self.documents:
+            self.remove_document(name)
+        ids = np.fromiter((self._term_id(token.lower()) for token in tokens), dtype=np.int32)
+        cols, counts = np.unique(ids, return_counts=True)
+        if len(self.df) < len(self.vocab):
+            self.df = np.concatenate([self.df, np.zeros(len(self.vocab) - len(self.df), dtype=np.int64)])
+        self.df[cols] += 1
+        self.rows[name] = (cols.astype(np.int32), counts.astype(np.int32))
+        self.documents[name] = meta
+
+    def remove_document(self, name: str)->None:
+        """
+        remove_document removes a document and updates the document
+        frequencies of its terms.
+        """
+        cols, _ = self.rows.pop(name)
+        self.df[cols] -= 1
+        del self.documents[name]
+
+    def idf(self, scheme: str = "plain")->np.ndarray:
+        """
+        idf returns the idf of every term of the vocabulary for the current documents.
+        """
+        return inverse_document_frequency(self.df, len(self.documents), scheme)
+
+    def counts(self, names: Optional[Iterable[str]] = None)->sparse.csr_matrix:
+        """
+        counts returns the (documents x vocabulary) count matrix of the given
+        documents (default: all).
+        """
+        names = self.names if names is None else list(names)
+        rows = [self.rows[name] for name in names]
+        indptr = np.cumsum([0] + [len(cols) for cols, _ in rows])
+        indices = np.concatenate([cols for cols, _ in rows]) if rows else np.zeros(0, dtype=np.int32)
+        data = np.concatenate([counts for _, counts in rows]) if rows else np.zeros(0, dtype=np.int32)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(names), len(self.vocab)))
+
+    def tfidf(self, names: Optional[Iterable[str]] = None, tf: str = "relative",
+              idf: str = "plain")->sparse.csr_matrix:
+        """
+        tfidf returns the TF-IDF matrix of the given documents (default: all),
+        weighted with the idf of the whole index.
+        """
+        result = (term_frequency(self.counts(names), tf) @ sparse.diags(self.idf(idf))).tocsr()
+        result.eliminate_zeros()
+        return result
+
+    def party_tfidf(self, tf: str = "relative", idf: str = "plain")->Tuple[List[str], sparse.csr_matrix]:
+        """
+        party_tfidf returns the parties and their TF-IDF vectors, the mean of
+        the speech-level TF-IDF vectors of all documents of each party.
+        """
+        names = self.names
+        parties = sorted({self.documents[name]["party"] for name in names})
+        party_ids = {party: i for i, party in enumerate(parties)}
+        rows = np.array([party_ids[self.documents[name]["party"]] for name in names], dtype=np.int64)
+        membership = sparse.csr_matrix((np.ones(len(names)), (rows, np.arange(len(names)))),
+                                       shape=(len(parties), len(names)))
+        sizes = np.asarray(membership.sum(axis=1)).ravel()
+        membership = sparse.diags(1.0 / np.maximum(sizes, 1)) @ membership
+        return parties, (membership @ self.tfidf(names, tf, idf)).tocsr()
+
+    def save(self, index_dir: str = INDEX_DIR)->None:
+        """
+        save writes the index to index_dir. Every file is written to a
+        temporary file first and then renamed, so a reader never sees a
+        half-written file.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        names = self.names
+        counts = self.counts(names)
+        sparse.save_npz(join(index_dir, "counts.tmp.npz"), counts)
+        with open(join(index_dir, "vocab.txt.tmp"), "w", encoding="utf-8", newline="\n") as f:
+            for term in self.vocab:
+                f.write(term + "\n")
+        with open(join(index_dir, "documents.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump([{"name": name, **self.documents[name]} for name in names], f, indent=2)
+        os.replace(join(index_dir, "counts.tmp.npz"), join(index_dir, "counts.npz"))
+        os.replace(join(index_dir, "vocab.txt.tmp"), join(index_dir, "vocab.txt"))
+        os.replace(join(index_dir, "documents.json.tmp"), join(index_dir, "documents.json"))
+
+    @classmethod
+    def load(cls, index_dir: str = INDEX_DIR)->'SpeechIndex':
+        """
+        load reads an index written by save, or returns an empty index if
+        there is none yet.
+        """
+        index = cls()
+        try:
+            with open(join(index_dir, "documents.json"), "r", encoding="utf-8") as f:
+                documents = json.load(f)
+            with open(join(index_dir, "vocab.txt"), "r", encoding="utf-8", newline="\n") as f:
+                index.vocab = f.read().split("\n")[:-1]
+            counts = sparse.load_npz(join(index_dir, "counts.npz")).tocsr()
+        except (OSError, ValueError):
+            return cls()
+        # files of two different saves don't fit together, the index is built again
+        if counts.shape != (len(documents), len(index.vocab)):
+            return cls()
+
+        index.term_ids = {term: i for i, term in enumerate(index.vocab)}
+        index.df = np.bincount(counts.indices, minlength=len(index.vocab)).astype(np.int64)
+        for row, document in enumerate(documents):
+            name = document.pop("name")
+            start, end = counts.indptr[row], counts.indptr[row + 1]
+            index.rows[name] = (counts.indices[start:end].astype(np.int32),
+                                counts.data[start:end].astype(np.int32))
+            index.documents[name] = document
+        return index
+
+
+def sync_index(index: SpeechIndex, data_dir: str = "data")->Tuple[List[str], List[str]]:
+    """
+    sync_index is a function that brings the index up to date with the
+    lemmatized documents inside data_dir: removed documents are removed,
+    new or changed documents are (re)added. Returns (updated, removed) names.
+    """
+    documents = {document["name"]: document for document in find_document_files(data_dir)}
+    removed = [name for name in index.names if name not in documents]
+    for name in removed:
+        index.remove_document(name)
+
+    updated = []
+    for name, document in documents.items():
+        size, mtime_ns = file_signature(document["path"])
+        known = index.documents.get(name)
+        if known is not None and (known.get("size"), known.get("mtime_ns")) == (size, mtime_ns):
+            continue
+        with open(document["path"], "r", encoding="utf-8") as f:
+            tokens = f.read().split()
+        index.add_document(name, tokens, party=document["party"], kind=document["kind"],
+                           path=document["path"], size=size, mtime_ns=mtime_ns)
+        updated.append(name)
+    return updated, removed
+
+
+def load_index(data_dir: str = "data", index_dir: str = INDEX_DIR)->SpeechIndex:
+    """
+    load_index is a function that loads the saved index, synchronizes it with
+    the documents inside data_dir and saves it again if anything changed.
+    """
+    with stage("speech_index", unit="Dokumente") as record:
+        index = SpeechIndex.load(index_dir)
+        updated, removed = sync_index(index, data_dir)
+        record.count(len(updated))
+    print(f"Speech-Index: {len(index)} Dokumente, {len(updated)} neu/geändert, {len(removed)} entfernt")
+    if updated or removed:
+        index.save(index_dir)
+    return index
@@ -0,0 +1,205 @@
+"""
+stylometry
+~~~~~~~~~~~~~~~~~
+
+This module is the Python version of stylo.r. It compares the documents by
+the relative frequencies of their most frequent words (MFW), built on the
+same term counts as BoW and TF-IDF (corpus store or speech index):
+
+burrows:       mean absolute difference of the z-scores (Burrows' Delta)
+cosine_delta:  1 - cosine similarity of the z-scores (Cosine Delta,
+               "wurzburg" in stylo)
+cosine:        1 - cosine similarity of the relative frequencies ("cosine"
+               in stylo, as used by stylo.r)
+
+The z-scores of the mfw_max most frequent words are computed once. A sweep
+over the MFW cutoffs adds the columns of every step to running sums
+(absolute differences for Burrows' Delta, dot products for the cosine
+measures), so every cutoff only costs its new columns instead of a whole
+new analysis. The distances are averaged over all cutoffs (consensus) and
+the nearest neighbour of every document is counted per cutoff.
+
+Run from the folder that contains "data", e.g.:
+python Code/stylometry.py --mfw-min 50 --mfw-max 5000 --mfw-incr 10
+"""
+
+import argparse
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from corpus_store import load_corpus
+from dtm import build_dtm, term_frequency
+from instrumentation import stage
+from speech_index import load_index
+
+MEASURES = ("burrows", "cosine_delta", "cosine")
+
+
+def mfw_order(freqs: sparse.csr_matrix)->np.ndarray:
+    """
+    mfw_order is a function that returns the columns of the relative
+    frequency matrix sorted by their mean relative frequency (most frequent
+    word first), like the frequency list of stylo.
+    """
+    mean = np.asarray(freqs.mean(axis=0)).ravel()
+    # ties are broken by the column, so the order is reproducible
+    return np.lexsort((np.arange(len(mean)), -mean))
+
+
+def zscores(features: np.ndarray)->np.ndarray:
+    """
+    zscores is a function that scales every column to mean 0 and standard
+    deviation 1 (n - 1, like R). Constant columns become 0.
+    """
+    mean = features.mean(axis=0)
+    std = features.std(axis=0, ddof=1) if len(features) > 1 else np.zeros(features.shape[1])
+    std[std == 0] = np.inf
+    return (features - mean) / std
+
+
+def mfw_features(counts: sparse.csr_matrix, mfw_max: int, measure: str = "cosine_delta")->Tuple[np.ndarray, np.ndarray]:
+    """
+    mfw_features is a function that returns the dense (documents x mfw_max)
+    feature matrix of a measure, z-scores or relative frequencies of the
+    most frequent words in MFW order, together with their columns.
+    """
+    if measure not in MEASURES:
+        raise ValueError(f"unknown measure: {measure}")
+    freqs = term_frequency(counts, "share")
+    columns = mfw_order(freqs)[:mfw_max]
+    features = freqs[:, columns].toarray()
+    if measure != "cosine":
+        features = zscores(features)
+    return features, columns
+
+
+def iter_mfw_sweep(features: np.ndarray, cutoffs: Sequence[int],
+                   measure: str = "cosine_delta")->Iterator[Tuple[int, np.ndarray]]:
+    """
+    iter_mfw_sweep is a generator that yields (cutoff, distance matrix) for
+    every MFW cutoff in ascending order. Only the columns between two cutoffs
+    are added to the running sums.
+    """
+    n = len(features)
+    running = np.zeros((n, n))
+    done = 0
+    for cutoff in sorted(cutoffs):
+        cutoff = min(cutoff, features.shape[1])
+        block = features[:, done:cutoff]
+        if measure == "burrows":
+            for column in block.T:
+                running += np.abs(column[:, None] - column[None, :])
+            distances = running / max(cutoff, 1)
+        else:
+            running += block @ block.T
+            norms = np.sqrt(np.diag(running))
+            norms[norms == 0] = 1.0
+            distances = 1.0 - running / np.outer(norms, norms)
+            np.fill_diagonal(distances, 0.0)
+        done = cutoff
+        yield cutoff, distances
+
+
+def mfw_cutoffs(mfw_min: int, mfw_max: int, mfw_incr: int, n_words: int)->List[int]:
+    """
+    mfw_cutoffs is a function that returns the cutoffs mfw_min, mfw_min + mfw_incr, ...
+    up to mfw_max, limited to the size of the vocabulary.
+    """
+    mfw_max = min(mfw_max, n_words)
+    return sorted(set(range(min(mfw_min, mfw_max), mfw_max + 1, max(mfw_incr, 1))))
+
+
+def delta_sweep(counts: sparse.csr_matrix, cutoffs: Sequence[int],
+                measure: str = "cosine_delta")->Dict[str, np.ndarray]:
+    """
+    delta_sweep is a function that runs the whole sweep over a count matrix
+    and returns the consensus distances (mean over all cutoffs) and the
+    nearest neighbour of every document at every cutoff.
+    """
+    features, _ = mfw_features(counts, max(cutoffs), measure)
+    n = counts.shape[0]
+    consensus = np.zeros((n, n))
+    neighbours = []
+    used = []
+    for cutoff, distances in iter_mfw_sweep(features, cutoffs, measure):
+        consensus += distances
+        masked = distances + np.diag(np.full(n, np.inf))
+        neighbours.append(masked.argmin(axis=1))
+        used.append(cutoff)
+    return {
+        "cutoffs": np.array(used),
+        "consensus": consensus / max(len(used), 1),
+        "neighbours": np.array(neighbours).reshape(len(used), n),
+    }
+
+
+def group_distances(distances: np.ndarray, groups: Sequence[str])->pd.DataFrame:
+    """
+    group_distances is a function that averages the distances between the
+    documents of every pair of groups (e.g. the speeches of two parties),
+    without the distance of a document to itself.
+    """
+    labels = sorted(set(groups))
+    index = np.array([labels.index(group) for group in groups])
+    membership = np.zeros((len(labels), len(groups)))
+    membership[index, np.arange(len(groups))] = 1.0
+    sums = membership @ distances @ membership.T
+    pairs = membership @ (1.0 - np.eye(len(groups))) @ membership.T
+    # a group with a single document has a distance of 0 to itself
+    values = np.divide(sums, pairs, out=np.zeros_like(sums), where=pairs > 0)
+    return pd.DataFrame(values, index=labels, columns=labels)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Stylometric distances (Delta) over a sweep of MFW cutoffs.")
+    arg_parser.add_argument("--speeches", action="store_true",
+                            help="compare every speech and programme instead of one document per party")
+    arg_parser.add_argument("--measure", choices=MEASURES, default="cosine_delta")
+    arg_parser.add_argument("--mfw-min", type=int, default=100)
+    arg_parser.add_argument("--mfw-max", type=int, default=500)
+    arg_parser.add_argument("--mfw-incr", type=int, default=10)
+    args = arg_parser.parse_args()
+
+    if args.speeches:
+        index = load_index("data/")
+        names = index.names
+        counts = index.counts(names)
+        parties = [index.documents[name]["party"] for name in names]
+    else:
+        store = load_corpus("data/")
+        names = store.names
+        counts, _ = build_dtm(store)
+        parties = names
+
+    cutoffs = mfw_cutoffs(args.mfw_min, args.mfw_max, args.mfw_incr, counts.shape[1])
+    with stage("stylometry", unit="Schnitte", measure=args.measure, documents=len(names)) as record:
+        result = delta_sweep(counts, cutoffs, args.measure)
+        record.count(len(result["cutoffs"]))
+    print(f"{len(result['cutoffs'])} MFW-Schnitte ({result['cutoffs'][0]}–{result['cutoffs'][-1]}) "
+          f"für {len(names)} Dokumente in {record.seconds:.2f}s ({args.measure})")
+
+    # Consensus over all cutoffs, per party
+    distances = group_distances(result["consensus"], parties)
+    print(f"\nMittlere Distanz ({args.measure}) über alle MFW-Schnitte:\n")
+    print(distances.round(4))
+
+    pairs = [(p1, p2, distances.loc[p1, p2]) for p1 in distances.index for p2 in distances.columns if p1 < p2]
+    print("\nÄhnlichste Parteien (aufsteigende Distanz):\n")
+    for p1, p2, value in sorted(pairs, key=lambda x: x[2]):
+        print(f"{p1} – {p2}: {value:.4f}")
+
+    # Stability of the nearest neighbours over the cutoffs
+    neighbours = result["neighbours"]
+    if args.speeches:
+        same_party = np.array(parties)[neighbours] == np.array(parties)[None, :]
+        print(f"\nNächster Nachbar aus derselben Partei: {same_party.mean():.1%} "
+              f"(niedrigster Schnitt {same_party[0].mean():.1%}, höchster {same_party[-1].mean():.1%})")
+    else:
+        print("\nNächster Nachbar (Anteil der MFW-Schnitte):\n")
+        for i, name in enumerate(names):
+            values, counts_nn = np.unique(neighbours[:, i], return_counts=True)
+            best = counts_nn.argmax()
+            print(f"{name}: {names[values[best]]} ({counts_nn[best] / len(neighbours):.0%})")
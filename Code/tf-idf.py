@@ -1,82 +1,92 @@
-import os
-from os.path import join
+import argparse
 from typing import *
-from collections import defaultdict
-import math
 
-# Import corpus from already lemmatized files
-corpus: Dict[str, str] = {}
-
-for partei in os.listdir("data/"):
-    partei_path = join("data", partei)
-
-    # Ignore the folder "raw_programme" like before in the BoW script
-    if partei == "raw_programme":
-        continue
-
-    lemm_folder = join(partei_path, "Lemmatisiert")
-    lemm_file = join(lemm_folder, f"{partei}_lemmatisiert.txt")
-
-    if os.path.exists(lemm_file):
-        with open(lemm_file, "r", encoding="utf-8") as f:
-            corpus[partei] = f.read()
-
-print("Parteien im Korpus:", corpus.keys())
-
-
-# Generate tf for all parties
-tfs: Dict[str, Dict[str, int]] = {}
-
-for partei, text in corpus.items():
-    partei_tf = defaultdict(int)
-    for word in text.split():
-        w = word.lower()
-        partei_tf[w] += 1
-    tfs[partei] = partei_tf
-
-# Number of parties = Number of documents
-N = len(tfs)
-
-# Compute idf for all terms
-all_terms = set(term for tf in tfs.values() for term in tf.keys())
-
-idf = defaultdict(int)
-
-for term in all_terms:
-    n = 0
-    for partei_tf in tfs.values():
-        n += 1 if term in partei_tf.keys() else 0
-    idf[term] = math.log(N/n)
-
-
-tfidfs: Dict[str, Dict[str, float]] = {}
-
-for partei, partei_tf in tfs.items():
-    partei_tfidf = {}
-
-    for word, freq in partei_tf.items():
-
-        # Relative Term Frequency (TF)
-        rel_tf = freq / max(partei_tf.values())
-
-        # TF-IDF
-        partei_tfidf[word] = rel_tf * idf[word]
-
-    tfidfs[partei] = partei_tfidf
-
-
-# Output: Top 10 words with highest TF–IDF per party
-for partei, partei_tfidf in tfidfs.items():
-    print(f"\nTop-10 TF-IDF Wörter für {partei}:")
-
-    # Sorting out filter errors in the results
-    # Comment this section out to see the original, unfiltered result list
-    for filter_error in ['p', 'l', 'wolfgang', 'worauf', 'zudem', 'amerikas', 'amerikanern', 'american', 'saubere', 'june', 'donald', 'muß', 'händeklatschen', 'heiterkeit', 'bravo', 'stürmischer', 'mußte', 'süd', 'willy', '']:
-        if partei_tfidf.get(filter_error, None):
-            del partei_tfidf[filter_error]
-
-    # Sort in descending order
-    sorted_terms = sorted(partei_tfidf.items(), key=lambda x: x[1], reverse=True)
-
-    for i, (w, s) in enumerate(sorted_terms[:10]):
-        print(f"{i+1}. {w}: {s:.4f}")
+from corpus_store import load_corpus
+from dtm import build_dtm, tfidf, top_k
+from instrumentation import stage
+from phrases import load_phrase_corpus
+from speech_index import load_index
+from time_slices import find_speeches, slice_counts, year_windows
+
+arg_parser = argparse.ArgumentParser(description="Top-10 TF-IDF words per party.")
+arg_parser.add_argument("--speeches", action="store_true",
+                        help="score every speech and programme as its own document "
+                             "and aggregate the party rankings from them")
+arg_parser.add_argument("--phrases", action="store_true",
+                        help="merge multi-word terms (bigrams, trigrams) into one token, see phrases.py")
+arg_parser.add_argument("--time-slices", type=int, metavar="YEARS",
+                        help="TF-IDF trajectory: top words per party in windows of YEARS years, "
+                             "summed from the cached per-year counts of the speeches, see time_slices.py")
+arg_parser.add_argument("--step", type=int, metavar="YEARS",
+                        help="distance between the windows of --time-slices (default: YEARS, no overlap)")
+args = arg_parser.parse_args()
+if args.phrases and (args.speeches or args.time_slices):
+    arg_parser.error("--phrases only works on the party corpora, not with --speeches or --time-slices")
+
+# Sorting out filter errors in the results
+# Comment this section out to see the original, unfiltered result list
+filter_errors = ['p', 'l', 'wolfgang', 'worauf', 'zudem', 'amerikas', 'amerikanern', 'american', 'saubere', 'june', 'donald', 'muß', 'händeklatschen', 'heiterkeit', 'bravo', 'stürmischer', 'mußte', 'süd', 'willy', '']
+
+
+def print_top_10(names: List[str], tfidfs, vocab: List[str])->None:
+    """
+    print_top_10 prints the 10 words with the highest TF-IDF of every document.
+    """
+    term_ids = {term: i for i, term in enumerate(vocab)}
+    excluded = [term_ids[term] for term in filter_errors if term in term_ids]
+
+    for name, top_terms in zip(names, top_k(tfidfs, k=10, exclude=excluded)):
+        print(f"\nTop-10 TF-IDF Wörter für {name}:")
+
+        for i, (w, s) in enumerate(top_terms):
+            print(f"{i+1}. {vocab[w]}: {s:.4f}")
+
+
+if args.time_slices:
+    # Every speech is one document of the index, its counts are summed per party and year
+    index = load_index("data/")
+    slices = slice_counts(index, find_speeches("data/"))
+
+    # Output: Top 10 words per party for every window, the slices of a window are summed up
+    with stage("tfidf_time_slices", unit="Fenster") as record:
+        for first, last in year_windows(slices.years(), args.time_slices, args.step):
+            parteien, counts, _ = slices.window(first, last)
+            print(f"\n=== {first}–{last} ===")
+            if len(parteien) < 2:
+                print(f"Nur {', '.join(parteien)}, TF-IDF braucht mindestens zwei Parteien im Zeitfenster")
+                continue
+            print_top_10(parteien, tfidf(counts, tf="relative", idf="plain"), index.vocab)
+            record.count()
+
+elif args.speeches:
+    # Every speech and programme is one document, the index is updated incrementally
+    index = load_index("data/")
+
+    # Output: Top 10 words with highest TF–IDF per speech/programme
+    with stage("tfidf_speeches", unit="Dokumente") as record:
+        speech_tfidfs = index.tfidf()
+        record.count(len(index))
+    print_top_10(index.names, speech_tfidfs, index.vocab)
+
+    # Output: Top 10 words per party, aggregated from the speech-level matrix
+    parteien, party_tfidfs = index.party_tfidf()
+    print_top_10(parteien, party_tfidfs, index.vocab)
+
+else:
+    # Import corpus from the shared store of the already lemmatized files
+    store = load_phrase_corpus("data/") if args.phrases else load_corpus("data/")
+
+    print("Parteien im Korpus:", store.names)
+
+    # Generate the sparse document-term matrix (tf) for all parties
+    # Number of parties = Number of documents
+    with stage("tfidf", unit="Tokens") as record:
+        counts, vocab = build_dtm(store)
+        record.count(int(counts.sum()))
+
+        # Relative Term Frequency (TF) = freq / freq of the most frequent word of the party,
+        # IDF = log(N / number of parties using the term)
+        tfidfs = tfidf(counts, tf="relative", idf="plain")
+
+    # Output: Top 10 words with highest TF–IDF per party
+    print_top_10(store.names, tfidfs, vocab)
@@ -0,0 +1,333 @@
+"""
+time_slices
+~~~~~~~~~~~~~~~~~
+
+This module provides the time-sliced analysis of the speeches. Speaker,
+topic and year are parsed from the file names of the speeches, e.g.
+'Weidel_Generaldebatte_2025.txt' or 'Biden_DNC_Speech_2024_DEUTSCH.txt',
+and every speech belongs to the slice of its party and year ('AfD/2025').
+
+A slice cache keeps one additive aggregate per slice: the summed term
+counts (TF-IDF) or the summed vectors (word2vec, sentence transformer) of
+its speeches and their weight (tokens, chunks), together with the signatures
+of the speeches it was summed from. A slice is only computed again when one
+of its speeches was added, changed or removed. The aggregates of a year
+window are the sums of its slices, so TF-IDF and similarity trajectories
+over any window never touch the texts again:
+
+cache/time_slices/<name>/meta.json    slices with their speeches and weights
+cache/time_slices/<name>/rows.npz     summed term counts (sparse), or
+cache/time_slices/<name>/rows.npy     summed vectors (dense)
+
+The programmes carry no year and are left out.
+"""
+
+import hashlib
+import json
+import os
+from os.path import join
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from bootstrap import batched_cosine
+from chunked_embeddings import embed_chunks, MAX_TOKENS, pooling_weights
+from corpus_store import document_lemma_path, file_signature, read_text
+from embedding_cache import EmbeddingCache
+from speech_index import SpeechIndex
+
+# Default location of the slice caches, relative to the working directory of the scripts
+TIME_SLICE_DIR = join("cache", "time_slices")
+# <speaker>_<topic>_<year>[_<language>], the topic may contain underscores
+SPEECH_NAME = re.compile(r"^(?P<speaker>[^_]+)_(?P<topic>.+)_(?P<year>\d{4})(?:_(?P<language>[A-Z]+))?$")
+
+
+def parse_speech_name(file: str)->Optional[dict]:
+    """
+    parse_speech_name is a function that returns speaker, topic and year of
+    a speech file, e.g. 'Boehringer_EZB_2020.txt' -> {'speaker': 'Boehringer',
+    'topic': 'EZB', 'year': 2020}, or None if the name has no year.
+    """
+    match = SPEECH_NAME.match(os.path.splitext(os.path.basename(file))[0])
+    if match is None:
+        return None
+    return {"speaker": match["speaker"], "topic": match["topic"].replace("_", " "), "year": int(match["year"])}
+
+
+def find_speeches(data_dir: str = "data")->List[dict]:
+    """
+    find_speeches is a function that returns every speech inside the data
+    folder whose name carries a year, with its name ('AfD/Reden/Weidel_Generaldebatte_2025'),
+    party, speaker, topic, year, source (original text) and path (lemmatized file).
+    """
+    speeches = []
+    for partei in sorted(os.listdir(data_dir)):
+        dir = join(data_dir, partei, "Reden")
+        if partei == "raw_programme" or not os.path.isdir(dir):
+            continue
+        for file in sorted(os.listdir(dir)):
+            parsed = parse_speech_name(file)
+            if parsed is None or "lemmatisiert" in file or not file.endswith(".txt"):
+                continue
+            speeches.append({
+                "name": f"{partei}/Reden/{os.path.splitext(file)[0]}",
+                "party": partei,
+                **parsed,
+                "source": join(dir, file),
+                "path": document_lemma_path(data_dir, partei, "Reden", file),
+            })
+    return speeches
+
+
+def slice_key(party: str, year: int)->str:
+    return f"{party}/{year}"
+
+
+def group_slices(speeches: Sequence[dict], signature: Callable[[dict], Optional[list]])->Dict[str, Dict[str, list]]:
+    """
+    group_slices is a function that groups the speeches by party and year
+    and returns slice -> {speech name: signature}. Speeches without a
+    signature (e.g. not lemmatized yet) are left out.
+    """
+    slices: Dict[str, Dict[str, list]] = {}
+    for speech in speeches:
+        speech_signature = signature(speech)
+        if speech_signature is not None:
+            slices.setdefault(slice_key(speech["party"], speech["year"]), {})[speech["name"]] = speech_signature
+    return slices
+
+
+def year_windows(years: Sequence[int], window: int, step: Optional[int] = None)->List[Tuple[int, int]]:
+    """
+    year_windows is a function that returns the windows (first year, last
+    year) of window years from the first to the last year, every step years
+    (default: window, so the windows don't overlap). Windows without any of
+    the years (e.g. between the NSDAP speeches and today) are left out.
+    """
+    if not years:
+        return []
+    step = step or window
+    first, last = min(years), max(years)
+    windows = [(start, min(start + window - 1, last)) for start in range(first, last + 1, step)]
+    return [(start, end) for start, end in windows if any(start <= year <= end for year in years)]
+
+
+class SliceCache:
+    """
+    SliceCache keeps one additive aggregate per (party, year) slice: a sum
+    row (term counts or vectors) and a weight, together with the signatures
+    of the speeches it was summed from. key describes how the rows were
+    computed (e.g. the model), a different key discards the cache. For term
+    counts, vocab is the vocabulary of the rows, the cache is discarded if
+    the known part of the vocabulary changed.
+    """
+
+    def __init__(self, name: str, key: str = "", vocab: Optional[List[str]] = None,
+                 cache_dir: str = TIME_SLICE_DIR):
+        self.dir = join(cache_dir, name)
+        self.key = key
+        self.vocab = vocab
+        self.members: Dict[str, Dict[str, list]] = {}
+        self.rows: Dict[str, object] = {}
+        self.weights: Dict[str, float] = {}
+        self._load()
+
+    @staticmethod
+    def _vocab_hash(vocab: List[str])->str:
+        return hashlib.blake2b("\n".join(vocab).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _load(self)->None:
+        try:
+            with open(join(self.dir, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["key"] != self.key:
+                return
+            if self.vocab is not None:
+                size = meta["vocab_size"]
+                if len(self.vocab) < size or self._vocab_hash(self.vocab[:size]) != meta["vocab_hash"]:
+                    return
+                rows = sparse.load_npz(join(self.dir, "rows.npz")).tocsr()
+            else:
+                rows = np.load(join(self.dir, "rows.npy"))
+        except (OSError, ValueError, KeyError):
+            return
+        # rows of another save than meta.json, e.g. after a crash
+        if rows.shape[0] != len(meta["slices"]):
+            return
+        for i, (name, entry) in enumerate(meta["slices"].items()):
+            self.members[name] = entry["members"]
+            self.weights[name] = entry["weight"]
+            self.rows[name] = rows[i]
+
+    def save(self)->None:
+        os.makedirs(self.dir, exist_ok=True)
+        names = list(self.members)
+        meta = {"key": self.key, "slices": {name: {"members": self.members[name], "weight": self.weights[name]}
+                                             for name in names}}
+        # rows first and meta.json last, both through a temporary file
+        if self.vocab is not None:
+            meta.update({"vocab_size": len(self.vocab), "vocab_hash": self._vocab_hash(self.vocab)})
+            sparse.save_npz(join(self.dir, "rows.tmp.npz"), self._stack(names))
+            os.replace(join(self.dir, "rows.tmp.npz"), join(self.dir, "rows.npz"))
+        else:
+            np.save(join(self.dir, "rows.tmp.npy"), self._stack(names))
+            os.replace(join(self.dir, "rows.tmp.npy"), join(self.dir, "rows.npy"))
+        with open(join(self.dir, "meta.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(join(self.dir, "meta.json.tmp"), join(self.dir, "meta.json"))
+
+    def _stack(self, names: Sequence[str]):
+        """
+        _stack returns the rows of the given slices as one matrix, sparse rows
+        are padded to the current vocabulary.
+        """
+        if self.vocab is None:
+            return np.vstack([self.rows[name] for name in names]) if names else np.zeros((0, 0))
+        rows = []
+        for name in names:
+            row = sparse.csr_matrix(self.rows[name])
+            row.resize((1, len(self.vocab)))
+            rows.append(row)
+        return sparse.vstack(rows, format="csr") if rows else sparse.csr_matrix((0, len(self.vocab)))
+
+    def update(self, members: Dict[str, Dict[str, list]],
+               compute: Callable[[List[str]], Tuple[object, float]])->List[str]:
+        """
+        update brings the cache up to date with the slices (slice -> {speech:
+        signature}). compute returns the sum row and the weight of a list of
+        speeches, it is only called for new or changed slices. Returns the
+        slices that were computed.
+        """
+        removed = [name for name in self.members if name not in members]
+        for name in removed:
+            del self.members[name], self.rows[name], self.weights[name]
+        updated = []
+        for name, speeches in members.items():
+            if self.members.get(name) == speeches:
+                continue
+            self.rows[name], self.weights[name] = compute(sorted(speeches))
+            self.members[name] = speeches
+            updated.append(name)
+        if updated or removed:
+            self.save()
+        return updated
+
+    def years(self)->List[int]:
+        return sorted({int(name.rsplit("/", 1)[1]) for name in self.members})
+
+    def window(self, first: int, last: int)->Tuple[List[str], object, np.ndarray]:
+        """
+        window returns the parties with speeches between first and last year
+        (inclusive), the sum of their rows and the sum of their weights.
+        """
+        selected: Dict[str, List[str]] = {}
+        for name in sorted(self.members):
+            party, year = name.rsplit("/", 1)
+            if first <= int(year) <= last:
+                selected.setdefault(party, []).append(name)
+        parties = sorted(selected)
+        if not parties:
+            return [], self._stack([]), np.zeros(0)
+        rows = self._stack([name for party in parties for name in selected[party]])
+        membership = sparse.csr_matrix(
+            (np.ones(rows.shape[0]), (np.repeat(np.arange(len(parties)), [len(selected[p]) for p in parties]),
+                                      np.arange(rows.shape[0]))),
+            shape=(len(parties), rows.shape[0]))
+        weights = np.array([sum(self.weights[name] for name in selected[party]) for party in parties])
+        sums = membership @ rows
+        return parties, (sums.tocsr() if sparse.issparse(sums) else np.asarray(sums)), weights
+
+
+def slice_counts(index: SpeechIndex, speeches: Sequence[dict], cache_dir: str = TIME_SLICE_DIR)->SliceCache:
+    """
+    slice_counts is a function that returns the cache of the summed term
+    counts (speech index) of every slice, brought up to date with the index.
+    """
+    def signature(speech: dict)->Optional[list]:
+        document = index.documents.get(speech["name"])
+        return None if document is None else [document["size"], document["mtime_ns"]]
+
+    def compute(names: List[str])->Tuple[sparse.csr_matrix, float]:
+        row = sparse.csr_matrix(index.counts(names).sum(axis=0))
+        return row, float(row.sum())
+
+    cache = SliceCache("counts", vocab=index.vocab, cache_dir=cache_dir)
+    cache.update(group_slices(speeches, signature), compute)
+    return cache
+
+
+def source_signature(speech: dict)->list:
+    return list(file_signature(speech["source"]))
+
+
+def lemma_signature(speech: dict)->Optional[list]:
+    return list(file_signature(speech["path"])) if os.path.exists(speech["path"]) else None
+
+
+def slice_word_vectors(model, speeches: Sequence[dict], key: str,
+                       cache_dir: str = TIME_SLICE_DIR)->SliceCache:
+    """
+    slice_word_vectors is a function that returns the cache of the summed
+    word vectors (and number of known tokens) of every slice for a word2vec
+    model (KeyedVectors), brought up to date with the lemmatized speeches.
+    key identifies the model, e.g. its file signature.
+    """
+    paths = {speech["name"]: speech["path"] for speech in speeches}
+    key_to_index = model.key_to_index
+
+    def compute(names: List[str])->Tuple[np.ndarray, float]:
+        rows = []
+        for name in names:
+            with open(paths[name], "r", encoding="utf-8") as f:
+                rows.extend(key_to_index.get(token, -1) for token in f.read().split())
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows >= 0]
+        counts = np.bincount(rows, minlength=len(model.index_to_key)).astype(np.float64)
+        return counts @ model.vectors, float(len(rows))
+
+    cache = SliceCache("w2v", key=key, cache_dir=cache_dir)
+    cache.update(group_slices(speeches, lemma_signature), compute)
+    return cache
+
+
+def slice_embeddings(model, speeches: Sequence[dict], key: str, max_tokens: int = MAX_TOKENS,
+                     batch_size: int = 16, pooling: str = "mean", cache: Optional[EmbeddingCache] = None,
+                     cache_dir: str = TIME_SLICE_DIR)->SliceCache:
+    """
+    slice_embeddings is a function that returns the cache of the summed chunk
+    embeddings (weighted, see pooling_weights) of every slice for a sentence
+    transformer model, brought up to date with the original speeches. key
+    identifies the model, cache is the EmbeddingCache of the chunks.
+    """
+    sources = {speech["name"]: speech["source"] for speech in speeches}
+
+    def compute(names: List[str])->Tuple[np.ndarray, float]:
+        texts = [read_text(sources[name]).strip() for name in names]
+        embeddings, _, lengths, _ = embed_chunks(model, [texts], max_tokens=max_tokens,
+                                                 batch_size=batch_size, cache=cache)
+        weights = pooling_weights(lengths, pooling)
+        return weights @ embeddings, float(weights.sum())
+
+    slices = SliceCache("embeddings", key=f"{key}|{max_tokens}|{pooling}", cache_dir=cache_dir)
+    slices.update(group_slices(speeches, source_signature), compute)
+    return slices
+
+
+def similarity_trajectory(cache: SliceCache, windows: Sequence[Tuple[int, int]])->pd.DataFrame:
+    """
+    similarity_trajectory is a function that returns the cosine similarity
+    of every pair of parties in every window (pairs x windows), from the
+    summed vectors of the slices. A pair is empty in windows in which one of
+    the parties has no speeches.
+    """
+    columns = {}
+    for first, last in windows:
+        parties, sums, weights = cache.window(first, last)
+        sim = batched_cosine(sums / np.where(weights == 0, 1.0, weights)[:, None])
+        rows, cols = np.triu_indices(len(parties), k=1)
+        columns[f"{first}–{last}" if first != last else str(first)] = {
+            f"{parties[i]} – {parties[j]}": float(sim[i, j]) for i, j in zip(rows, cols)}
+    return pd.DataFrame(columns).sort_index()
@@ -1,24 +1,57 @@
-from gensim.models import Word2Vec
+import argparse
+import os
+import sys
 
-# Load the model
-model = Word2Vec.load("word2vec_parteien.model")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from instrumentation import stage
+from model_files import load_keyed_vectors, load_normed_vectors, W2V_VECTORS
+from w2v_query import NeighbourIndex
+
+arg_parser = argparse.ArgumentParser(description="Explore the word2vec model.")
+arg_parser.add_argument("--interactive", action="store_true",
+                        help="keep the model loaded and answer queries from the command line")
+arg_parser.add_argument("--approximate", action="store_true",
+                        help="use the approximate IVF index (for very large vocabularies)")
+args = arg_parser.parse_args()
+
+# Load the vectors of the model memory-mapped, all processes share one copy
+wv = load_keyed_vectors(W2V_VECTORS)
+# Normalized vectors for all nearest-neighbour queries (saved with the model)
+index = NeighbourIndex(wv, normed_vectors=load_normed_vectors(W2V_VECTORS))
 
 # Print the 20 most frequent words in the word2vec model
 print("\nDie 20 häufigsten Wörter im word2vec-Modell:")
-print(model.wv.index_to_key[:20])
+print(wv.index_to_key[:20])
 
 # Exploring the model: Getting the vector of a specific word
 print("\nVektor des Wortes 'deutschland':")
-print(model.wv['deutschland'])
+print(wv['deutschland'])
 print("\nVektor des Wortes 'europa':")
-print(model.wv['europa'])
+print(wv['europa'])
 print("\nVektor des Wortes 'sozial':")
-print(model.wv['sozial'])
+print(wv['sozial'])
+
+# Finding the top 10 most similar words, all words are answered with a single matrix product
+words = ['deutschland', 'europa', 'sozial']
+with stage("w2v_query", unit="Anfragen", approximate=args.approximate) as record:
+    results = index.most_similar(words, topn=10, approximate=args.approximate)
+    record.count(len(words))
+for word, neighbours in zip(words, results):
+    print(f"\nDie 10 ähnlichsten Wörter zu '{word}':")
+    print(neighbours)
 
-# Finding the top 10 most similar words
-print("\nDie 10 ähnlichsten Wörter zu 'deutschland':")
-print(model.wv.most_similar('deutschland'))
-print("\nDie 10 ähnlichsten Wörter zu 'europa':")
-print(model.wv.most_similar('europa'))
-print("\nDie 10 ähnlichsten Wörter zu 'sozial':")
-print(model.wv.most_similar("sozial", topn=10))
+# Exploring the model interactively without reloading it for every query
+if args.interactive:
+    print("\nWörter eingeben (durch Leerzeichen getrennt), leere Eingabe beendet:")
+    while True:
+        try:
+            line = input("> ").split()
+        except EOFError:
+            break
+        if not line:
+            break
+        known = [word for word in line if word in wv.key_to_index]
+        for word in set(line) - set(known):
+            print(f"'{word}' ist nicht im Modell")
+        for word, neighbours in zip(known, index.most_similar(known, topn=10, approximate=args.approximate)):
+            print(f"{word}: {neighbours}")
@@ -1,55 +1,70 @@
+import argparse
 import gensim
 import os
-from os.path import join
+import sys
 from typing import *
 
 import logging
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s' , level=logging.INFO)
 
-# Import corpus from already lemmatized files
-corpus: Dict[str, str] = {}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from corpus_store import load_corpus
+from instrumentation import stage
+from model_files import save_keyed_vectors, save_model, W2V_MODEL, W2V_VECTORS
+from phrases import load_phrase_corpus
+from w2v_training import EpochLogger, MAX_SENTENCE_LENGTH, StoreSentences, write_corpus_file
 
-for partei in os.listdir("data/"):
-    partei_path = join("data", partei)
+# Training sentences in gensim's corpus_file format (one sentence per line)
+CORPUS_FILE = os.path.join("cache", "w2v_corpus.txt")
 
-    # Ignore the folder "raw_programme" like before in the BoW script
-    if partei == "raw_programme":
-        continue
+arg_parser = argparse.ArgumentParser(description="Train the word2vec model on all parties.")
+arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker threads")
+arg_parser.add_argument("--max-sentence-length", type=int, default=MAX_SENTENCE_LENGTH,
+                        help="tokens per training sentence")
+arg_parser.add_argument("--stream", action="store_true",
+                        help="stream the sentences from the corpus store instead of using corpus_file")
+arg_parser.add_argument("--phrases", action="store_true",
+                        help="merge multi-word terms (bigrams, trigrams) into one token, see phrases.py")
+args = arg_parser.parse_args()
 
-    lemm_folder = join(partei_path, "Lemmatisiert")
-    lemm_file = join(lemm_folder, f"{partei}_lemmatisiert.txt")
+# Import corpus from the shared store of the already lemmatized files
+store = load_phrase_corpus("data/") if args.phrases else load_corpus("data/")
 
-    if os.path.exists(lemm_file):
-        with open(lemm_file, "r", encoding="utf-8") as f:
-            corpus[partei] = f.read()
-
-print("Parteien im Korpus:", corpus.keys())
+print("Parteien im Korpus:", store.names)
 
 # Word2Vec requires a list of tokens per sentence
-# Since the corpora are already lemmatized and cleaned up, a simple split is sufficient
-sentences: List[List[str]] = []
-
-for partei, text in corpus.items():
-    # Simple tokenizer (no further preprocessing)
-    tokens = text.split()
-    sentences.append(tokens)
+# Since the corpora are already lemmatized and cleaned up, the tokens of the store are sufficient.
+# Every party text is cut into sentence sized chunks, gensim would truncate longer sentences.
+sentences = StoreSentences(store, max_sentence_length=args.max_sentence_length)
+total_words = int(store.offsets[-1])
 
 # Building the model
 model = gensim.models.Word2Vec(
-    sentences, # List of tokenized sentences
     min_count=1, # Ignore all words with total frequency lower than this
-    workers=6, # Number of CPU cores
+    workers=args.workers, # Number of CPU cores
     vector_size=50, # Embedding size
     window=5, # Context window: Maximum distance between current and predicted word
     epochs=10 # Number of iterations over the text corpus
 )
 
-# Saving the complete word2vec model
-model.save("word2vec_parteien.model")
+with stage("w2v_training", unit="Wörter", workers=args.workers, stream=args.stream) as record:
+    if args.stream:
+        # Stream the sentences from the memory-mapped store in every epoch
+        model.build_vocab(sentences)
+        model.train(sentences, total_examples=model.corpus_count, epochs=model.epochs,
+                    callbacks=[EpochLogger(total_words)])
+    else:
+        # Write the sentences once in the corpus_file format, every worker reads its own part of the file
+        write_corpus_file(sentences, CORPUS_FILE)
+        model.build_vocab(corpus_file=CORPUS_FILE)
+        model.train(corpus_file=CORPUS_FILE, total_words=model.corpus_total_words, epochs=model.epochs,
+                    callbacks=[EpochLogger(total_words)])
+    record.count(total_words * model.epochs)
 
-# Export the model to txt format
-from gensim.models import Word2Vec
+# Saving the complete word2vec model and its vectors, every array in its own .npy file,
+# so the analysis scripts can load them memory-mapped (mmap='r')
+save_model(model, W2V_MODEL)
+save_keyed_vectors(model.wv, W2V_VECTORS)
 
-model = Word2Vec.load("word2vec_parteien.model")
+# Export the model to txt format (e.g. for other tools)
 model.wv.save_word2vec_format("word2vec_parteien.txt", binary=False)
-
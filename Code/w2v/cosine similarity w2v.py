@@ -1,43 +1,51 @@
-from gensim.models import KeyedVectors
+import argparse
+
+arg_parser = argparse.ArgumentParser(description="Cosine similarity of the parties in the word2vec model.")
+arg_parser.add_argument("--weighting", choices=["mean", "tfidf", "sif"], default="mean",
+                        help="how the word vectors of a party are averaged")
+arg_parser.add_argument("--remove-first-component", action="store_true",
+                        help="remove the common component of all document vectors (SIF)")
+arg_parser.add_argument("--phrases", action="store_true",
+                        help="use the corpus with merged multi-word terms (for a model trained with --phrases)")
+arg_parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="confidence intervals from N bootstrap replicates over text chunks of the parties")
+arg_parser.add_argument("--chunk-tokens", type=int, default=1000, help="tokens per chunk for the bootstrap")
+arg_parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap")
+arg_parser.add_argument("--workers", type=int, default=None, help="processes for the bootstrap (default: all cores)")
+arg_parser.add_argument("--time-slices", type=int, metavar="YEARS",
+                        help="similarity trajectory of the parties in windows of YEARS years, summed from the "
+                             "cached per-year word vectors of the speeches, see time_slices.py")
+arg_parser.add_argument("--step", type=int, metavar="YEARS",
+                        help="distance between the windows of --time-slices (default: YEARS, no overlap)")
+args = arg_parser.parse_args()
 
-# Load Word2Vec model (text format or binary format)
-model = KeyedVectors.load_word2vec_format(
-    "word2vec_parteien.txt", # or the .model file in binary format
-    binary=False
-)
-
-# Load lemmatized text files
 import os
-from os.path import join
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from corpus_store import load_corpus
+from instrumentation import stage
+from model_files import load_keyed_vectors, W2V_VECTORS
+from phrases import load_phrase_corpus
 
-corpus = {}
+# Load the Word2Vec vectors memory-mapped (instead of parsing the txt format on every run)
+model = load_keyed_vectors(W2V_VECTORS)
 
-for partei in os.listdir("data/"):
-    if partei == "raw_programme":
-        continue
-    
-    lemm_file = join("data", partei, "Lemmatisiert", f"{partei}_lemmatisiert.txt")
-    
-    if os.path.exists(lemm_file):
-        with open(lemm_file, "r", encoding="utf-8") as f:
-            corpus[partei] = f.read().split()
+# Load lemmatized texts from the shared corpus store
+
+store = load_phrase_corpus("data/") if args.phrases else load_corpus("data/")
 
 # Generate text embedding (document vector)
-# Simple averaging of all word vectors
+# Averaging of all word vectors, vectorized over all parties at once
 import numpy as np
 
-def text_vector(tokens, model):
-    vectors = []
-    for token in tokens:
-        if token in model.key_to_index:
-            vectors.append(model[token])
-    if len(vectors) == 0:
-        return np.zeros(model.vector_size)
-    return np.mean(vectors, axis=0)
+from bootstrap import batched_cosine
+from doc_vectors import document_vectors, ranked_pairs, text_vector, token_index
 
 # Example: Generate vectors for CDU & SPD
-vec_cdu = text_vector(corpus["CDU"], model)
-vec_spd = text_vector(corpus["SPD"], model)
+lookup = token_index(store.vocab, model)
+vec_cdu = text_vector(store.doc_ids("CDU"), lookup, model)
+vec_spd = text_vector(store.doc_ids("SPD"), lookup, model)
 
 # Calculate cosine similarity
 from numpy.linalg import norm
@@ -50,36 +58,55 @@ similarity = cosine_similarity(vec_cdu, vec_spd)
 print("Ähnlichkeit zwischen CDU & SPD:", similarity)
 
 # Calculate cosine similarity for all parties simultaneously
-parties = list(corpus.keys())
-
-doc_vectors = {p: text_vector(corpus[p], model) for p in parties}
+parties = store.names
 
-# Calculate matrix
-sim_matrix = {}
+with stage("w2v_document_vectors", unit="Tokens", weighting=args.weighting) as record:
+    doc_vectors = document_vectors(store, model, parties, weighting=args.weighting,
+                                   remove_first_component=args.remove_first_component)
 
-for p1 in parties:
-    sim_matrix[p1] = {}
-    for p2 in parties:
-        sim_matrix[p1][p2] = cosine_similarity(doc_vectors[p1], doc_vectors[p2])
+    # Calculate matrix with a single matmul of the normalized document vectors
+    sim_matrix = batched_cosine(doc_vectors)
+    record.count(int(store.offsets[-1]))
 
 # Output
 import pandas as pd
-df = pd.DataFrame(sim_matrix)
+df = pd.DataFrame(sim_matrix, index=parties, columns=parties)
 print("\nÄhnlichkeitswerte aller Parteien mit Cosine Similarity:\n")
 print(df)
 
 # Most similar party pairs in descending order
-similarities = []
-
-for p1 in parties:
-    for p2 in parties:
-        if p1 < p2:  # Prevents duplicate pairs such as (CDU, SPD) and (SPD, CDU)
-            sim_value = float(sim_matrix[p1][p2])
-            similarities.append((p1, p2, sim_value))
-
-# Sort by similarity in descending order
-similarities_sorted = sorted(similarities, key=lambda x: x[2], reverse=True)
+# (every pair only once, no duplicates such as (CDU, SPD) and (SPD, CDU))
+similarities_sorted = ranked_pairs(parties, sim_matrix)
 
 print("\nTop-Ähnlichkeiten zwischen den Parteien (absteigend):\n")
 for p1, p2, value in similarities_sorted:
     print(f"{p1} – {p2}: {value:.4f}")
+
+# Stability of the similarities: resample the text chunks of every party
+if args.bootstrap:
+    from bootstrap import bootstrap_similarity, format_intervals, pair_intervals
+    from doc_vectors import chunk_vectors
+
+    with stage("w2v_bootstrap", unit="Replikate", weighting=args.weighting) as record:
+        sums, weights, chunk_parties = chunk_vectors(store, model, parties, weighting=args.weighting,
+                                                     chunk_tokens=args.chunk_tokens)
+        result = bootstrap_similarity(sums, weights, chunk_parties, len(parties), n_replicates=args.bootstrap,
+                                      seed=args.seed, workers=args.workers)
+        record.count(args.bootstrap)
+    print(f"\n{len(sums)} Chunks à {args.chunk_tokens} Tokens, {record.seconds:.2f}s")
+    if args.remove_first_component:
+        print("(ohne --remove-first-component, die gemeinsame Komponente wird nicht entfernt)")
+    print(format_intervals(pair_intervals(result, parties), args.bootstrap))
+
+# Development of the similarities over time: the speeches of every party and year are one slice,
+# a window sums the cached word vectors of its slices (plain mean, the weightings need the whole corpus)
+if args.time_slices:
+    from corpus_store import file_signature
+    from time_slices import find_speeches, similarity_trajectory, slice_word_vectors, year_windows
+
+    with stage("w2v_time_slices", unit="Fenster") as record:
+        slices = slice_word_vectors(model, find_speeches("data/"), key=f"{W2V_VECTORS}:{file_signature(W2V_VECTORS)}")
+        trajectory = similarity_trajectory(slices, year_windows(slices.years(), args.time_slices, args.step))
+        record.count(trajectory.shape[1])
+    print(f"\nÄhnlichkeiten der Parteien in Zeitfenstern von {args.time_slices} Jahren (Reden):\n")
+    print(trajectory.to_string(float_format=lambda value: f"{value:.4f}", na_rep="–"))
@@ -1,81 +1,150 @@
+import argparse
 import os
-from os.path import join
+import sys
 import pandas as pd
 import numpy as np
 
-from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+from gensim.models.doc2vec import Doc2Vec
+import nltk
+from nltk.corpus import stopwords
 from numpy.linalg import norm
 
-# Load lemmatized files from folder structure
-corpus = {}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bootstrap import bootstrap_similarity, format_intervals, pair_intervals
+from corpus_store import find_document_files, load_corpus, read_text
+from doc2vec_model import PartyScorer, party_tags, read_tokens, tagged_documents, train_doc2vec
+from instrumentation import stage
+from model_files import D2V_MODEL, D2V_VECTORS, save_model
 
-for partei in os.listdir("data/"):
-    if partei == "raw_programme":
-        continue
-    
-    lemm_file = join("data", partei, "Lemmatisiert", f"{partei}_lemmatisiert.txt")
-
-    if os.path.exists(lemm_file):
-        with open(lemm_file, "r", encoding="utf-8") as f:
-            tokens = f.read().split()
-            corpus[partei] = tokens
-
-
-print("Gefundene Parteien:", list(corpus.keys()))
-
-# Create TaggedDocuments for Doc2Vec
-documents = []
-for party, tokens in corpus.items():
-    documents.append(TaggedDocument(words=tokens, tags=[party]))
-
-# Train Doc2Vec model
-model = Doc2Vec(
-    vector_size=200, # Embedding size, increased dimensions = better distinguishability
-    window=10, # Context window: Maximum distance between current and predicted word
-    min_count=2, # Ignore all words with total frequency lower than this
-    workers=4, # Number of CPU cores
-    epochs=40, # Number of iterations over the text corpus
-    dm=1,
-)
-
-model.build_vocab(documents)
-model.train(documents, total_examples=model.corpus_count, epochs=model.epochs)
-
-print("Doc2Vec Modell wurde erfolgreich trainiert.")
-
-# Extract document vectors for each party
-doc_vectors = {}
-for party in corpus.keys():
-    doc_vectors[party] = model.dv[party] # dv = document vectors
 
 # Cosine similarity function
 def cosine_similarity(a, b):
     return np.dot(a, b) / (norm(a) * norm(b))
 
-# Calculate similarity matrix
-parties = list(doc_vectors.keys())
-sim_matrix = {}
-
-for p1 in parties:
-    sim_matrix[p1] = {}
-    for p2 in parties:
-        sim_matrix[p1][p2] = cosine_similarity(doc_vectors[p1], doc_vectors[p2])
-
-# Output as DataFrame
-df = pd.DataFrame(sim_matrix)
-print("\nCosine Similarity Matrix:\n")
-print(df)
-
-# Ranking: Most similar party pairs
-similarities = []
-
-for p1 in parties:
-    for p2 in parties:
-        if p1 < p2: # no duplicates
-            similarities.append((p1, p2, sim_matrix[p1][p2]))
-
-similarities_sorted = sorted(similarities, key=lambda x: x[2], reverse=True)
 
-print("\nTop-Ähnlichkeiten zwischen den Parteien (absteigend):\n")
-for p1, p2, value in similarities_sorted:
-    print(f"{p1} – {p2}: {value:.4f}")
+def lemmatize_files(files, model):
+    """
+    lemmatize_files is a function that lemmatizes new speeches the same way
+    as the BoW script and returns the lemmas of every file.
+    """
+    # only scoring needs spaCy, training and loading the model work without it
+    from lemma_cache import LemmaCache
+    from lemmatize import lemmatize_corpus, load_lemmatizer
+
+    nltk.download("stopwords", quiet=True)
+    texts = {file: read_text(file) for file in files}
+    lemmas = {file: [] for file in files}
+    with LemmaCache(model) as cache:
+        for file, paragraph in lemmatize_corpus(load_lemmatizer(model), texts, set(stopwords.words("german")),
+                                                cache=cache):
+            lemmas[file].extend(paragraph)
+    return [lemmas[file] for file in files]
+
+
+def train(workers):
+    """
+    train is a function that trains the Doc2Vec model on all lemmatized
+    speeches and programmes and saves it.
+    """
+    # Every speech and programme is a training unit, tagged with its name and its party
+    documents = [(doc["name"], doc["party"], read_tokens(doc["path"])) for doc in find_document_files("data/")]
+    if not documents:
+        # without lemmatized single documents, fall back to one document per party
+        store = load_corpus("data/")
+        documents = [(partei, partei, store.doc_tokens(partei)) for partei in store.names]
+    print("Gefundene Parteien:", sorted({party for _, party, _ in documents}))
+    print(f"{len(documents)} Dokumente")
+
+    # Create TaggedDocuments for Doc2Vec and train the model
+    with stage("doc2vec_training", unit="Wörter", workers=workers) as record:
+        model = train_doc2vec(tagged_documents(documents), workers=workers)
+        record.count(model.corpus_total_words * model.epochs)
+
+    print("Doc2Vec Modell wurde erfolgreich trainiert.")
+
+    # Saving the model and its document vectors memory-mappable (every array in its own .npy file)
+    save_model(model, D2V_MODEL)
+    save_model(model.dv, D2V_VECTORS)
+    return model
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Train (once) and apply the Doc2Vec model of the parties.")
+    arg_parser.add_argument("--retrain", action="store_true", help="train the model again, even if it was saved before")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of CPU cores")
+    arg_parser.add_argument("--score", nargs="+", metavar="FILE", default=[],
+                            help="new speeches (text files) that are scored against the party vectors")
+    arg_parser.add_argument("--model", default="de_core_news_lg", help="spaCy model for lemmatizing the new speeches")
+    arg_parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                            help="confidence intervals from N bootstrap replicates over the document vectors of the speeches")
+    arg_parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap")
+    args = arg_parser.parse_args()
+
+    # The model is trained once, afterwards the saved model is loaded (memory-mapped)
+    if args.retrain or not os.path.exists(D2V_MODEL):
+        model = train(args.workers)
+    else:
+        model = Doc2Vec.load(D2V_MODEL, mmap="r")
+        print(f"Doc2Vec Modell geladen: {D2V_MODEL} (--retrain trainiert es neu)")
+
+    # Extract document vectors for each party
+    doc_vectors = {}
+    for party in party_tags(model):
+        doc_vectors[party] = model.dv[party] # dv = document vectors
+
+    # Calculate similarity matrix
+    parties = list(doc_vectors.keys())
+    sim_matrix = {}
+
+    for p1 in parties:
+        sim_matrix[p1] = {}
+        for p2 in parties:
+            sim_matrix[p1][p2] = cosine_similarity(doc_vectors[p1], doc_vectors[p2])
+
+    # Output as DataFrame
+    df = pd.DataFrame(sim_matrix)
+    print("\nCosine Similarity Matrix:\n")
+    print(df)
+
+    # Ranking: Most similar party pairs
+    similarities = []
+
+    for p1 in parties:
+        for p2 in parties:
+            if p1 < p2: # no duplicates
+                similarities.append((p1, p2, sim_matrix[p1][p2]))
+
+    similarities_sorted = sorted(similarities, key=lambda x: x[2], reverse=True)
+
+    print("\nTop-Ähnlichkeiten zwischen den Parteien (absteigend):\n")
+    for p1, p2, value in similarities_sorted:
+        print(f"{p1} – {p2}: {value:.4f}")
+
+    # Stability of the similarities: resample the speeches and programmes of every party,
+    # a party is the mean of the vectors of its documents
+    if args.bootstrap:
+        documents = [tag for tag in model.dv.index_to_key if "/" in str(tag) and tag.split("/")[0] in parties]
+        if not documents:
+            print("\nKeine Dokumentvektoren im Modell, Bootstrap übersprungen (--retrain)")
+        else:
+            document_parties = np.array([parties.index(tag.split("/")[0]) for tag in documents])
+            with stage("doc2vec_bootstrap", unit="Replikate") as record:
+                result = bootstrap_similarity(model.dv[documents], np.ones(len(documents)), document_parties,
+                                              len(parties), n_replicates=args.bootstrap, seed=args.seed,
+                                              workers=args.workers)
+                record.count(args.bootstrap)
+            print(f"\nParteivektoren als Mittel von {len(documents)} Dokumentvektoren, {record.seconds:.2f}s")
+            print(format_intervals(pair_intervals(result, parties), args.bootstrap))
+
+    # Score new speeches against the party vectors without retraining
+    if args.score:
+        token_lists = lemmatize_files(args.score, args.model)
+        with PartyScorer(D2V_MODEL, workers=args.workers) as scorer:
+            with stage("doc2vec_scoring", unit="Reden") as record:
+                results = scorer.classify(token_lists)
+                record.count(len(results))
+        print(f"\n{len(results)} Reden bewertet in {record.seconds * 1000:.0f} ms\n")
+        for file, scores in zip(args.score, results):
+            print(file)
+            for party, value in scores.items():
+                print(f"  {party}: {value:.4f}")
@@ -0,0 +1,159 @@
+"""
+doc2vec_model
+~~~~~~~~~~~~~~~~~
+
+This module provides training and inference for the persisted Doc2Vec model.
+Instead of one tagged document per party (only 7 training units), every
+speech and programme is its own training unit, cut into pieces of at most
+max_words tokens. Every piece carries two tags: the name of its document
+('AfD/Reden/Weidel_Generaldebatte_2025') and its party ('AfD'), so the model
+learns a vector for every document as well as for every party.
+
+New speeches are embedded with infer_vector, in batches spread over a pool of
+worker processes. Every worker loads the saved model once with mmap='r', so
+all workers share the same physical copy of the weights, and the inferred
+vectors are scored against the stored party vectors.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+import numpy as np
+
+from bootstrap import normalize_rows
+from instrumentation import untrace_worker
+from w2v_training import MAX_SENTENCE_LENGTH
+
+# Speeches that are inferred by one task of the process pool
+INFER_BATCH_SIZE = 16
+
+
+def read_tokens(filepath: str)->List[str]:
+    """
+    read_tokens is a function that returns the tokens of a lemmatized file.
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        return f.read().split()
+
+
+def tagged_documents(documents: Iterable[Tuple[str, str, List[str]]],
+                     max_words: int = MAX_SENTENCE_LENGTH)->List[TaggedDocument]:
+    """
+    tagged_documents is a function that cuts every (name, party, tokens)
+    document into pieces of at most max_words tokens, tagged with the name of
+    the document and its party. gensim would truncate longer documents.
+    """
+    tagged = []
+    for name, party, tokens in documents:
+        tags = [name] if name == party else [name, party]
+        for start in range(0, len(tokens), max_words):
+            tagged.append(TaggedDocument(words=tokens[start:start + max_words], tags=tags))
+    return tagged
+
+
+def train_doc2vec(documents: List[TaggedDocument], workers: int = 4, epochs: int = 40)->Doc2Vec:
+    """
+    train_doc2vec is a function that trains the Doc2Vec model on the tagged documents.
+    """
+    model = Doc2Vec(
+        vector_size=200, # Embedding size, increased dimensions = better distinguishability
+        window=10, # Context window: Maximum distance between current and predicted word
+        min_count=2, # Ignore all words with total frequency lower than this
+        workers=workers, # Number of CPU cores
+        epochs=epochs, # Number of iterations over the text corpus
+        dm=1,
+    )
+    model.build_vocab(documents)
+    model.train(documents, total_examples=model.corpus_count, epochs=model.epochs)
+    return model
+
+
+def party_tags(model: Doc2Vec)->List[str]:
+    """
+    party_tags is a function that returns the party tags of the model, the
+    document tags are the ones with a '/' in their name.
+    """
+    return [tag for tag in model.dv.index_to_key if "/" not in str(tag)]
+
+
+_worker_model: Optional[Doc2Vec] = None
+
+
+def _init_worker(model_path: str)->None:
+    global _worker_model
+    untrace_worker()
+    _worker_model = Doc2Vec.load(model_path, mmap="r")
+
+
+def _infer_batch(token_lists: List[List[str]], epochs: Optional[int])->np.ndarray:
+    return np.vstack([_worker_model.infer_vector(tokens, epochs=epochs) for tokens in token_lists])
+
+
+class PartyScorer:
+    """
+    PartyScorer embeds new (lemmatized) speeches with the saved Doc2Vec model
+    and scores them against the party vectors by cosine similarity.
+    The process pool is started on the first batch that is worth it and kept
+    until close() is called, so it is meant to be created once and reused.
+    """
+
+    def __init__(self, model_path: str, workers: Optional[int] = None, epochs: Optional[int] = None):
+        self.model_path = model_path
+        self.model = Doc2Vec.load(model_path, mmap="r")
+        self.workers = workers or os.cpu_count() or 1
+        self.epochs = epochs
+        self.parties = party_tags(self.model)
+        party_vectors = np.vstack([self.model.dv[party] for party in self.parties])
+        self.party_vectors = party_vectors / np.linalg.norm(party_vectors, axis=1, keepdims=True)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self)->'PartyScorer':
+        return self
+
+    def __exit__(self, *exc)->None:
+        self.close()
+
+    def close(self)->None:
+        """
+        close shuts the worker processes down.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def infer_vectors(self, token_lists: Sequence[List[str]], batch_size: int = INFER_BATCH_SIZE)->np.ndarray:
+        """
+        infer_vectors returns the inferred vector of every speech as a
+        (speeches x vector_size) array. A single batch is inferred in this
+        process, larger inputs are spread over the worker processes.
+        """
+        token_lists = list(token_lists)
+        if not token_lists:
+            return np.zeros((0, self.model.vector_size), dtype=np.float32)
+        if self.workers == 1 or len(token_lists) <= batch_size:
+            return np.vstack([self.model.infer_vector(tokens, epochs=self.epochs) for tokens in token_lists])
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self.model_path,))
+        batches = [token_lists[start:start + batch_size] for start in range(0, len(token_lists), batch_size)]
+        return np.vstack(list(self._pool.map(_infer_batch, batches, [self.epochs] * len(batches))))
+
+    def score(self, token_lists: Sequence[List[str]])->np.ndarray:
+        """
+        score returns the cosine similarity of every speech with every party
+        as a (speeches x parties) array, the columns are in the order of self.parties.
+        """
+        return normalize_rows(self.infer_vectors(token_lists)) @ self.party_vectors.T
+
+    def classify(self, token_lists: Sequence[List[str]])->List[Dict[str, float]]:
+        """
+        classify returns the scores of every speech as {party: similarity},
+        sorted by similarity in descending order.
+        """
+        results = []
+        for row in self.score(token_lists):
+            order = np.argsort(-row, kind="stable")
+            results.append({self.parties[i]: float(row[i]) for i in order})
+        return results
@@ -0,0 +1,145 @@
+"""
+doc_vectors
+~~~~~~~~~~~~~~~~~
+
+This module provides vectorized document vectors for the word2vec model.
+The tokens of the corpus store are mapped to rows of the model once per
+vocabulary entry (not per token), every document becomes a row of a sparse
+weight matrix and all document vectors are a single sparse @ dense product
+with the word vectors. All pairwise cosine similarities come from one matmul
+of the L2-normalized document vectors.
+
+weighting:  "mean"   plain average of all word vectors (like text_vector)
+            "tfidf"  average weighted by the count and the (smooth) idf of a word
+            "sif"    smooth inverse frequency, a / (a + p(w)), optionally with
+                     the first principal component removed (Arora et al. 2017)
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+from gensim.models import KeyedVectors
+import numpy as np
+from scipy import sparse
+
+from corpus_store import CorpusStore
+from dtm import build_dtm, document_frequency, inverse_document_frequency
+
+
+def token_index(vocab: Sequence[str], model: KeyedVectors)->np.ndarray:
+    """
+    token_index is a function that maps every token id of a vocabulary to its
+    row in the word2vec model, or -1 if the model doesn't know the token.
+    """
+    key_to_index = model.key_to_index
+    return np.fromiter((key_to_index.get(token, -1) for token in vocab), dtype=np.int64, count=len(vocab))
+
+
+def text_vector(ids: np.ndarray, lookup: np.ndarray, model: KeyedVectors)->np.ndarray:
+    """
+    text_vector is a function that returns the mean of all word vectors of a
+    text, given as token ids of the store (see token_index for lookup).
+    """
+    rows = lookup[ids]
+    rows = rows[rows >= 0]
+    if len(rows) == 0:
+        return np.zeros(model.vector_size)
+    counts = np.bincount(rows, minlength=len(model.index_to_key))
+    return (counts @ model.vectors) / len(rows)
+
+
+def term_weights(store: CorpusStore, counts: sparse.csr_matrix, weighting: str = "mean",
+                 sif_a: float = 1e-3)->np.ndarray:
+    """
+    term_weights is a function that returns the weight of every token id of
+    the store for the given (documents x store vocabulary) counts.
+    """
+    if weighting == "mean":
+        return np.ones(counts.shape[1])
+    if weighting == "tfidf":
+        return inverse_document_frequency(document_frequency(counts), counts.shape[0], "smooth")
+    if weighting == "sif":
+        # p(w) is the frequency of a word in the whole store
+        all_counts, _ = build_dtm(store, lowercase=False)
+        frequency = np.asarray(all_counts.sum(axis=0)).ravel() / max(all_counts.sum(), 1)
+        return sif_a / (sif_a + frequency)
+    raise ValueError(f"unknown weighting: {weighting}")
+
+
+def weight_matrix(store: CorpusStore, model: KeyedVectors, names: Optional[Sequence[str]] = None,
+                  weighting: str = "mean", sif_a: float = 1e-3)->sparse.csr_matrix:
+    """
+    weight_matrix is a function that returns the sparse (documents x model
+    vocabulary) matrix of word weights, every row sums up to 1.
+    """
+    counts, vocab = build_dtm(store, names, lowercase=False)
+    lookup = token_index(vocab, model)
+    known = np.flatnonzero(lookup >= 0)
+    # map the columns of the store vocabulary to the rows of the model
+    projection = sparse.csr_matrix((np.ones(len(known)), (known, lookup[known])),
+                                   shape=(len(vocab), len(model.index_to_key)))
+    counts = counts.astype(np.float64)
+    weights = counts @ sparse.diags(term_weights(store, counts, weighting, sif_a))
+
+    weights = (weights @ projection).tocsr()
+    totals = np.asarray(weights.sum(axis=1)).ravel()
+    totals[totals == 0] = 1.0
+    return (sparse.diags(1.0 / totals) @ weights).tocsr()
+
+
+def document_vectors(store: CorpusStore, model: KeyedVectors, names: Optional[Sequence[str]] = None,
+                     weighting: str = "mean", remove_first_component: bool = False)->np.ndarray:
+    """
+    document_vectors is a function that returns one (weighted) average word
+    vector per document as a (documents x vector_size) array.
+    """
+    vectors = np.asarray(weight_matrix(store, model, names, weighting) @ model.vectors)
+    if remove_first_component and len(vectors) > 1:
+        # remove the direction that all documents share
+        _, _, vt = np.linalg.svd(vectors, full_matrices=False)
+        component = vt[0]
+        vectors = vectors - np.outer(vectors @ component, component)
+    return vectors
+
+
+def chunk_vectors(store: CorpusStore, model: KeyedVectors, names: Optional[Sequence[str]] = None,
+                  weighting: str = "mean", chunk_tokens: int = 1000,
+                  sif_a: float = 1e-3)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    chunk_vectors is a function that cuts every document into chunks of
+    chunk_tokens tokens and returns the weighted sum of the word vectors of
+    every chunk, the sum of its word weights and its document. The weighted
+    mean of the chunks of a document is its document vector (see
+    document_vectors without remove_first_component), e.g. for the bootstrap.
+    """
+    names = store.names if names is None else names
+    counts, vocab = build_dtm(store, names, lowercase=False)
+    weights = term_weights(store, counts.astype(np.float64), weighting, sif_a)
+    lookup = token_index(vocab, model)
+
+    rows, cols, data, documents = [], [], [], []
+    n_chunks = 0
+    for idx, name in enumerate(names):
+        ids = np.asarray(store.doc_ids(name))
+        chunks = n_chunks + np.arange(len(ids)) // chunk_tokens
+        known = lookup[ids] >= 0
+        rows.append(chunks[known])
+        cols.append(lookup[ids][known])
+        data.append(weights[ids][known])
+        n_document_chunks = max(-(-len(ids) // chunk_tokens), 1)
+        documents.extend([idx] * n_document_chunks)
+        n_chunks += n_document_chunks
+
+    rows, cols, data = np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+    matrix = sparse.csr_matrix((data, (rows, cols)), shape=(n_chunks, len(model.index_to_key)))
+    sums = np.asarray(matrix @ model.vectors, dtype=np.float64)
+    return sums, np.asarray(matrix.sum(axis=1)).ravel(), np.array(documents, dtype=np.int64)
+
+
+def ranked_pairs(names: List[str], sim: np.ndarray)->List[tuple]:
+    """
+    ranked_pairs is a function that returns every pair of documents once
+    as (name 1, name 2, similarity), sorted by similarity in descending order.
+    """
+    rows, cols = np.triu_indices(len(names), k=1)
+    order = np.argsort(-sim[rows, cols], kind="stable")
+    return [(names[rows[i]], names[cols[i]], float(sim[rows[i], cols[i]])) for i in order]
@@ -0,0 +1,64 @@
+"""
+model_files
+~~~~~~~~~~~~~~~~~
+
+This module provides the file layout of the trained models. All numpy arrays
+of the models are saved as separate .npy files next to the (small) pickled
+model, so they can be loaded with mmap='r': loading is close to instant and
+all processes that load the same model share one physical copy of the
+vectors through the page cache.
+
+word2vec_parteien.model               complete Word2Vec model (for further training)
+word2vec_parteien.kv                  KeyedVectors (vocabulary + vectors)
+word2vec_parteien.kv.normed.npy       L2-normalized vectors for nearest-neighbour queries
+doc2vec_parteien.model                complete Doc2Vec model (for infer_vector)
+doc2vec_parteien.dv                   KeyedVectors of the document vectors
+"""
+
+import os
+from typing import Optional
+
+from gensim.models import KeyedVectors
+from gensim.utils import SaveLoad
+import numpy as np
+
+from bootstrap import normalize_rows
+
+W2V_MODEL = "word2vec_parteien.model"
+W2V_VECTORS = "word2vec_parteien.kv"
+D2V_MODEL = "doc2vec_parteien.model"
+D2V_VECTORS = "doc2vec_parteien.dv"
+
+
+def save_model(model: SaveLoad, path: str)->None:
+    """
+    save_model is a function that saves a gensim model (or KeyedVectors) with
+    every numpy array in its own .npy file, no matter how small it is.
+    """
+    model.save(path, sep_limit=0)
+
+
+def save_keyed_vectors(vectors: KeyedVectors, path: str)->None:
+    """
+    save_keyed_vectors is a function that saves KeyedVectors memory-mappable
+    and additionally their L2-normalized vectors as <path>.normed.npy.
+    """
+    save_model(vectors, path)
+    np.save(path + ".normed.npy", normalize_rows(np.asarray(vectors.vectors, dtype=np.float32)))
+
+
+def load_keyed_vectors(path: str)->KeyedVectors:
+    """
+    load_keyed_vectors is a function that loads KeyedVectors with memory-mapped vectors.
+    """
+    return KeyedVectors.load(path, mmap="r")
+
+
+def load_normed_vectors(path: str)->Optional[np.ndarray]:
+    """
+    load_normed_vectors is a function that returns the memory-mapped
+    L2-normalized vectors saved by save_keyed_vectors, or None if there are none.
+    """
+    if not os.path.exists(path + ".normed.npy"):
+        return None
+    return np.load(path + ".normed.npy", mmap_mode="r")
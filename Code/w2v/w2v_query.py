@@ -0,0 +1,142 @@
+"""
+w2v_query
+~~~~~~~~~~~~~~~~~
+
+This module provides a batched nearest-neighbour query engine for the word2vec
+model. The L2-normalized embedding matrix is computed once and kept, many
+words (or vectors) are answered with a single matrix product and the top k of
+every row are selected with np.argpartition instead of sorting the whole
+vocabulary.
+
+For very large vocabularies an optional approximate IVF index (inverted file)
+can be built: the normalized vectors are clustered with k-means, a query only
+scores the vectors of the n_probe closest clusters.
+"""
+
+from typing import List, Optional, Sequence, Tuple, Union
+
+from gensim.models import KeyedVectors
+import numpy as np
+
+from bootstrap import normalize_rows
+
+# Queries that are scored against the vocabulary at once (bounds the memory)
+QUERY_BLOCK_SIZE = 256
+
+Query = Union[str, np.ndarray]
+
+
+def top_k_rows(scores: np.ndarray, k: int)->Tuple[np.ndarray, np.ndarray]:
+    """
+    top_k_rows is a function that returns the columns and scores of the k
+    highest scores of every row, in descending order.
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.zeros((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class IVFIndex:
+    """
+    IVFIndex is an approximate inverted file index over normalized vectors.
+    The vectors are clustered into n_lists clusters (spherical k-means), a
+    query is only compared with the vectors of its n_probe closest clusters.
+    """
+
+    def __init__(self, vectors: np.ndarray, n_lists: Optional[int] = None, n_iter: int = 10, seed: int = 0):
+        self.vectors = vectors
+        n_lists = min(n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        rng = np.random.default_rng(seed)
+        self.centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignment, vectors)
+            empty = ~sums.any(axis=1)
+            sums[empty] = self.centroids[empty]
+            self.centroids = normalize_rows(sums)
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        # members of every cluster, one after another
+        self.members = order
+        self.list_offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+
+    def search(self, queries: np.ndarray, k: int, n_probe: int = 8)->Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        search returns the (approximate) top k rows and scores of every query.
+        """
+        probes, _ = top_k_rows(queries @ self.centroids.T, n_probe)
+        rows, scores = [], []
+        for query, lists in zip(queries, probes):
+            candidates = np.concatenate([self.members[self.list_offsets[i]:self.list_offsets[i + 1]]
+                                         for i in lists])
+            best, best_scores = top_k_rows((self.vectors[candidates] @ query)[None, :], k)
+            rows.append(candidates[best[0]])
+            scores.append(best_scores[0])
+        return rows, scores
+
+
+class NeighbourIndex:
+    """
+    NeighbourIndex answers nearest-neighbour queries for a word2vec model.
+    It is meant to be created once and kept alive (e.g. in an interactive
+    session), so the normalized vectors are only computed once.
+    """
+
+    def __init__(self, model: KeyedVectors, normed_vectors: Optional[np.ndarray] = None):
+        self.model = model
+        # precomputed (e.g. memory-mapped) normalized vectors are used as they are
+        if normed_vectors is None:
+            normed_vectors = normalize_rows(np.asarray(model.vectors, dtype=np.float32))
+        self.vectors = normed_vectors
+        self.ivf: Optional[IVFIndex] = None
+
+    def build_ivf(self, n_lists: Optional[int] = None, n_iter: int = 10)->IVFIndex:
+        """
+        build_ivf builds the optional approximate index for large vocabularies.
+        """
+        self.ivf = IVFIndex(self.vectors, n_lists=n_lists, n_iter=n_iter)
+        return self.ivf
+
+    def _query_matrix(self, queries: Sequence[Query])->Tuple[np.ndarray, List[int]]:
+        rows, own = [], []
+        for query in queries:
+            if isinstance(query, str):
+                index = self.model.key_to_index[query]
+                rows.append(self.vectors[index])
+                own.append(index)
+            else:
+                rows.append(np.asarray(query, dtype=np.float32))
+                own.append(-1)
+        return normalize_rows(np.vstack(rows)), own
+
+    def most_similar(self, queries: Sequence[Query], topn: int = 10,
+                     approximate: bool = False, n_probe: int = 8)->List[List[Tuple[str, float]]]:
+        """
+        most_similar returns the topn most similar words of every query (a word
+        or a vector) like gensim's most_similar, the query word itself is
+        left out. With approximate=True the IVF index is used.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        index_to_key = self.model.index_to_key
+        results = []
+        for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            matrix, own = self._query_matrix(queries[start:start + QUERY_BLOCK_SIZE])
+            # one more candidate, in case the query word is among the best
+            if approximate:
+                if self.ivf is None:
+                    self.build_ivf()
+                block_rows, block_scores = self.ivf.search(matrix, topn + 1, n_probe)
+            else:
+                block_rows, block_scores = top_k_rows(matrix @ self.vectors.T, topn + 1)
+            for rows, scores, own_index in zip(block_rows, block_scores, own):
+                results.append([(index_to_key[row], float(score)) for row, score in zip(rows, scores)
+                                if row != own_index][:topn])
+        return results
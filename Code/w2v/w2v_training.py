@@ -0,0 +1,83 @@
+"""
+w2v_training
+~~~~~~~~~~~~~~~~~
+
+This module provides the streaming training input for the word2vec model.
+gensim silently truncates every sentence after 10,000 tokens, so a whole
+party text as one "sentence" is mostly never trained on, and with only
+7 sentences the worker threads have nothing to share. Instead, the token ids
+of the corpus store are cut into sentence sized chunks, which are either
+streamed through a restartable iterable or written once to a file in
+gensim's corpus_file line format (one sentence per line), which lets every
+worker read its own part of the file.
+"""
+
+import logging
+import os
+import time
+from typing import Iterator, List
+
+from gensim.models.callbacks import CallbackAny2Vec
+
+from corpus_store import CorpusStore
+
+# Number of tokens per training sentence, well below gensim's limit of 10,000
+MAX_SENTENCE_LENGTH = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class StoreSentences:
+    """
+    StoreSentences is a restartable iterable over all documents of the corpus
+    store, cut into sentences of at most max_sentence_length tokens. Every
+    iteration (one per epoch) reads the memory-mapped token ids again, so
+    the corpus is never held in memory as strings.
+    """
+
+    def __init__(self, store: CorpusStore, max_sentence_length: int = MAX_SENTENCE_LENGTH):
+        self.store = store
+        self.max_sentence_length = max_sentence_length
+
+    def __iter__(self)->Iterator[List[str]]:
+        vocab = self.store.vocab
+        for name in self.store.names:
+            ids = self.store.doc_ids(name)
+            for start in range(0, len(ids), self.max_sentence_length):
+                yield [vocab[i] for i in ids[start:start + self.max_sentence_length].tolist()]
+
+
+def write_corpus_file(sentences: StoreSentences, filepath: str)->int:
+    """
+    write_corpus_file is a function that writes the sentences in gensim's
+    corpus_file format (tokens separated by spaces, one sentence per line)
+    and returns the number of words written.
+    """
+    if os.path.dirname(filepath):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    n_words = 0
+    with open(filepath, "w", encoding="utf-8", newline="\n") as outfile:
+        for sentence in sentences:
+            outfile.write(" ".join(sentence) + "\n")
+            n_words += len(sentence)
+    return n_words
+
+
+class EpochLogger(CallbackAny2Vec):
+    """
+    EpochLogger logs the duration and the words/sec of every training epoch.
+    """
+
+    def __init__(self, total_words: int):
+        self.total_words = total_words
+        self.epoch = 0
+        self.start = 0.0
+
+    def on_epoch_begin(self, model)->None:
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, model)->None:
+        duration = time.perf_counter() - self.start
+        logger.info("Epoche %d: %d Wörter in %.2fs (%.0f Wörter/s)", self.epoch,
+                    self.total_words, duration, self.total_words / max(duration, 1e-9))
+        self.epoch += 1